@@ -1,75 +1,325 @@
-import json  # Adicionar essa importação
-import numpy as np
-import singlestoredb as s2
-import fitz  # PyMuPDF para extrair texto do PDF
-from sentence_transformers import SentenceTransformer
-
-# Conectar ao banco de dados SingleStore
-conexao = s2.connect(
-    host='svc-2bb855a2-bafe-4117-b888-641a3ff41420-dml.aws-oregon-4.svc.singlestore.com',
-    port=3306,
-    user='admin',
-    password='CVjXTlvNtj2mR4LjDtG6r1OwRwrmdAnq',
-    database='db_smartnurse'
-)
-
-# Carregar modelo de embeddings
-modelo = SentenceTransformer('all-MiniLM-L6-v2')
-
-# Caminho do PDF
-caminho_pdf = 'Files/Geral/file27.pdf'
-
-try:
-    # 1️⃣ Abrir o PDF e extrair o texto
-    with open(caminho_pdf, 'rb') as file:
-        conteudo_pdf = file.read()
-
-    # Extrair texto do PDF
-    with fitz.open(stream=conteudo_pdf, filetype="pdf") as doc:
-        texto_extraido = "\n".join([pagina.get_text() for pagina in doc])
-
-    # 2️⃣ Inserir o PDF e texto no banco
-    cursor = conexao.cursor()
-    print(f"Inserindo o arquivo '{caminho_pdf}' no banco...")
-    
-    query = "INSERT INTO documentos_pdf (nome_arquivo, conteudo, texto_extraido, especialidade_id) VALUES (%s, %s, %s, %s)"
-    valores = (caminho_pdf, conteudo_pdf, texto_extraido, 8)
-    cursor.execute(query, valores)
-    conexao.commit()
-
-    # 3️⃣ Obter ID do documento recém-adicionado
-    documento_id = cursor.lastrowid
-
-    if documento_id is None or documento_id <= 0:
-        print(f"❌ Erro: documento_id inválido ({documento_id}).")
-        exit()
-
-    print(f"✅ PDF '{caminho_pdf}' inserido com ID {documento_id}!")
-
-except Exception as e:
-    print(f"❌ Erro ao inserir PDF no banco: {e}")
-    exit()
-
-# 4️⃣ Criar embedding do texto
-try:
-    embedding = modelo.encode(texto_extraido)
-    embedding = np.round(embedding, 6).tolist()
-
-    # Converter para JSON
-    embedding_json = json.dumps(embedding)
-
-    # 5️⃣ Inserir embedding no banco
-    embedding_bytes = np.array(embedding, dtype=np.float32).tobytes()
-    query = "INSERT INTO pdf_embeddings (document_id, embedding) VALUES (%s, %s)"
-    cursor.execute(query, (documento_id, embedding_bytes))
-    conexao.commit()
-    print(f"✅ Embedding do PDF '{caminho_pdf}' salvo com sucesso!")
-
-except Exception as e:
-    print(f"❌ Erro ao inserir embedding: {e}")
-
-finally:
-    # 6️⃣ Fechar conexão
-    cursor.close()
-    conexao.close()
-    print("🔒 Conexão fechada.")
\ No newline at end of file
+#!/usr/bin/env python3
+"""
+Ingestão em massa dos protocolos médicos em PDF.
+
+Percorre database/documents/Files/<Especialidade>/*.pdf, extrai o texto com
+PyMuPDF num pool de processos, divide-o em passagens sobrepostas, gera os
+embeddings em lotes grandes e grava tudo com executemany em transações por
+lote. Cada passagem fica em pdf_chunks com os seus offsets; o embedding do
+documento (pdf_embeddings) é a média normalizada das passagens. O resumo e
+os extratos de diagnóstico/recomendação também são calculados aqui, para que
+o backend não tenha de percorrer o texto completo a cada pedido. Ficheiros
+cujo conteúdo já foi ingerido na mesma especialidade (mesmo hash SHA-256)
+são ignorados, pelo que pode ser reexecutado; o mesmo PDF em pastas de
+especialidades diferentes é ingerido uma vez por especialidade.
+
+Uso:
+    python FuncaoAuxiliar/api.py [--root PASTA] [--workers N] [--batch-size N] [--dry-run]
+    python FuncaoAuxiliar/api.py --backfill-extracts   # extratos de documentos antigos
+"""
+import os
+import sys
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "backend"))
+
+from specialties import resolve_specialty  # noqa: E402
+from chunking import split_passages  # noqa: E402
+from document_extracts import compute_extracts  # noqa: E402
+from encoders import create_encoder  # noqa: E402
+
+load_dotenv()
+
+DEFAULT_ROOT = os.path.join(BASE_DIR, "..", "database", "documents", "Files")
+
+
+def conectar():
+    """Conexão ao SingleStore com as mesmas variáveis de ambiente do backend"""
+    import singlestoredb as s2
+    return s2.connect(
+        host=os.getenv('SINGLESTORE_HOST'),
+        port=int(os.getenv('SINGLESTORE_PORT', '3306')),
+        user=os.getenv('SINGLESTORE_USER'),
+        password=os.getenv('SINGLESTORE_PASSWORD'),
+        database=os.getenv('SINGLESTORE_DB')
+    )
+
+
+def especialidade_da_pasta(pasta: str) -> Optional[int]:
+    """Mapeia o nome da pasta para o especialidade_id (registo em backend/specialties.py)"""
+    especialidade = resolve_specialty(pasta)
+    return especialidade.id if especialidade else None
+
+
+def descobrir_pdfs(root: str) -> List[Tuple[str, str, int]]:
+    """Devolve (caminho absoluto, nome_arquivo relativo, especialidade_id)"""
+    encontrados = []
+    for pasta in sorted(os.listdir(root)):
+        caminho_pasta = os.path.join(root, pasta)
+        if not os.path.isdir(caminho_pasta):
+            continue
+        especialidade_id = especialidade_da_pasta(pasta)
+        if especialidade_id is None:
+            print(f"⚠️  Pasta '{pasta}' sem especialidade correspondente - ignorada")
+            continue
+        for ficheiro in sorted(os.listdir(caminho_pasta)):
+            if ficheiro.lower().endswith(".pdf"):
+                nome_arquivo = f"Files/{pasta}/{ficheiro}"
+                encontrados.append((os.path.join(caminho_pasta, ficheiro), nome_arquivo, especialidade_id))
+    return encontrados
+
+
+def hash_ficheiro(caminho: str) -> str:
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as file:
+        for bloco in iter(lambda: file.read(1 << 20), b""):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def extrair_pdf(caminho: str) -> Tuple[str, bytes, str, str, Dict]:
+    """Executado no pool de processos: lê o PDF e extrai texto, título e extratos"""
+    import fitz  # PyMuPDF para extrair texto do PDF
+
+    with open(caminho, 'rb') as file:
+        conteudo_pdf = file.read()
+    with fitz.open(stream=conteudo_pdf, filetype="pdf") as doc:
+        texto_extraido = "\n".join(pagina.get_text() for pagina in doc)
+        titulo = (doc.metadata or {}).get("title") or os.path.splitext(os.path.basename(caminho))[0]
+    return caminho, conteudo_pdf, texto_extraido, titulo, compute_extracts(texto_extraido)
+
+
+# Colunas acrescentadas a documentos_pdf pela ingestão
+COLUNAS_EXTRA = {
+    "hash_conteudo": "CHAR(64)",
+    "resumo": "TEXT",
+    "extrato_diagnostico": "TEXT",
+    "extrato_recomendacao": "TEXT",
+}
+
+
+def garantir_esquema(cursor) -> None:
+    """Acrescenta as colunas de hash e extratos e a tabela de passagens"""
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'documentos_pdf'
+    """)
+    existentes = {row[0].lower() for row in cursor.fetchall()}
+    for coluna, tipo in COLUNAS_EXTRA.items():
+        if coluna not in existentes:
+            cursor.execute(f"ALTER TABLE documentos_pdf ADD COLUMN {coluna} {tipo}")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pdf_chunks (
+            id BIGINT AUTO_INCREMENT,
+            document_id BIGINT NOT NULL,
+            especialidade_id INT,
+            chunk_index INT NOT NULL,
+            start_offset INT NOT NULL,
+            end_offset INT NOT NULL,
+            texto TEXT,
+            embedding BLOB,
+            PRIMARY KEY (id),
+            KEY (document_id)
+        )
+    """)
+
+
+def documentos_existentes(cursor) -> Dict[str, Tuple[int, Optional[str], Optional[int]]]:
+    """nome_arquivo -> (id, hash_conteudo, especialidade_id) dos documentos já ingeridos"""
+    cursor.execute("SELECT nome_arquivo, id, hash_conteudo, especialidade_id FROM documentos_pdf")
+    return {row[0]: (row[1], row[2], row[3]) for row in cursor.fetchall()}
+
+
+def embedding_documento(embeddings_passagens: np.ndarray) -> np.ndarray:
+    """Média normalizada dos embeddings das passagens de um documento"""
+    media = np.asarray(embeddings_passagens, dtype=np.float32).mean(axis=0)
+    norma = np.linalg.norm(media)
+    return media / norma if norma else media
+
+
+def gravar_lote(conexao, lote: List[Tuple], passagens: List[List[Tuple]], substituir: List[int]) -> None:
+    """
+    Grava um lote de documentos, passagens e embeddings numa única transação.
+    `passagens[i]` contém (start, end, texto, embedding) do documento `lote[i]`.
+    """
+    cursor = conexao.cursor()
+    try:
+        if substituir:
+            marcadores = ", ".join(["%s"] * len(substituir))
+            cursor.execute(f"DELETE FROM pdf_chunks WHERE document_id IN ({marcadores})", substituir)
+            cursor.execute(f"DELETE FROM pdf_embeddings WHERE document_id IN ({marcadores})", substituir)
+            cursor.execute(f"DELETE FROM documentos_pdf WHERE id IN ({marcadores})", substituir)
+
+        cursor.executemany(
+            "INSERT INTO documentos_pdf (nome_arquivo, titulo, conteudo, texto_extraido, especialidade_id, hash_conteudo, "
+            "resumo, extrato_diagnostico, extrato_recomendacao) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            lote
+        )
+
+        # Obtém os ids gerados a partir de (hash, especialidade) dos documentos do lote
+        hashes = sorted({item[5] for item in lote})
+        marcadores = ", ".join(["%s"] * len(hashes))
+        cursor.execute(
+            f"SELECT hash_conteudo, especialidade_id, MAX(id) FROM documentos_pdf "
+            f"WHERE hash_conteudo IN ({marcadores}) GROUP BY hash_conteudo, especialidade_id",
+            hashes
+        )
+        ids = {(hash_conteudo, especialidade_id): doc_id for hash_conteudo, especialidade_id, doc_id in cursor.fetchall()}
+
+        linhas_passagens = [
+            (ids[(item[5], item[4])], item[4], indice, inicio, fim, texto, np.asarray(embedding, dtype=np.float32).tobytes())
+            for item, passagens_doc in zip(lote, passagens)
+            for indice, (inicio, fim, texto, embedding) in enumerate(passagens_doc)
+        ]
+        linhas_embeddings = [
+            (ids[(item[5], item[4])], embedding_documento([p[3] for p in passagens_doc]).tobytes())
+            for item, passagens_doc in zip(lote, passagens)
+            if passagens_doc
+        ]
+        if linhas_passagens:
+            cursor.executemany(
+                "INSERT INTO pdf_chunks (document_id, especialidade_id, chunk_index, start_offset, end_offset, texto, embedding) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                linhas_passagens
+            )
+            cursor.executemany(
+                "INSERT INTO pdf_embeddings (document_id, embedding) VALUES (%s, %s)",
+                linhas_embeddings
+            )
+        conexao.commit()
+    except Exception:
+        conexao.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def ingerir(root: str, workers: int, batch_size: int, dry_run: bool = False) -> None:
+    pdfs = descobrir_pdfs(root)
+    print(f"📂 {len(pdfs)} PDFs encontrados em '{root}'")
+
+    conexao = None if dry_run else conectar()
+    existentes: Dict[str, Tuple[int, Optional[str], Optional[int]]] = {}
+    if conexao is not None:
+        cursor = conexao.cursor()
+        garantir_esquema(cursor)
+        existentes = documentos_existentes(cursor)
+        cursor.close()
+    # (hash, especialidade) -> nome_arquivo: o mesmo PDF noutra especialidade
+    # é ingerido de novo, para essa especialidade não o perder
+    ingeridos = {(h, esp): nome for nome, (_, h, esp) in existentes.items() if h}
+
+    # Só processa ficheiros novos ou alterados
+    pendentes = []
+    for caminho, nome_arquivo, especialidade_id in pdfs:
+        hash_conteudo = hash_ficheiro(caminho)
+        igual = ingeridos.get((hash_conteudo, especialidade_id))
+        if igual is not None:
+            if igual != nome_arquivo:
+                print(f"⏭️  '{nome_arquivo}' ignorado: conteúdo igual a '{igual}' (mesma especialidade)")
+            continue
+        antigo = existentes.get(nome_arquivo)
+        pendentes.append((caminho, nome_arquivo, especialidade_id, hash_conteudo, antigo[0] if antigo else None))
+        ingeridos[(hash_conteudo, especialidade_id)] = nome_arquivo
+    print(f"🔎 {len(pdfs) - len(pendentes)} inalterados, {len(pendentes)} a ingerir")
+    if not pendentes or dry_run:
+        return
+
+    # Mesmo codificador que a API (EMBEDDING_BACKEND=torch|onnx)
+    modelo = create_encoder()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for inicio in range(0, len(pendentes), batch_size):
+                bloco = pendentes[inicio:inicio + batch_size]
+                extraidos = list(pool.map(extrair_pdf, [item[0] for item in bloco]))
+
+                lote = [
+                    (
+                        nome_arquivo, titulo, conteudo_pdf, texto_extraido, especialidade_id, hash_conteudo,
+                        extratos['summary'], extratos['diagnosis'], extratos['recommendation']
+                    )
+                    for (_, nome_arquivo, especialidade_id, hash_conteudo, _), (_, conteudo_pdf, texto_extraido, titulo, extratos)
+                    in zip(bloco, extraidos)
+                ]
+
+                # Todas as passagens do lote vão ao modelo numa só chamada
+                divisoes = [split_passages(texto) for _, _, texto, _, _ in extraidos]
+                embeddings = modelo.encode(
+                    [passagem for divisao in divisoes for _, _, passagem in divisao],
+                    batch_size=64
+                )
+                embeddings = np.round(embeddings, 6)
+
+                passagens, posicao = [], 0
+                for divisao in divisoes:
+                    passagens.append([
+                        (inicio, fim, passagem, embeddings[posicao + i])
+                        for i, (inicio, fim, passagem) in enumerate(divisao)
+                    ])
+                    posicao += len(divisao)
+
+                substituir = [item[4] for item in bloco if item[4] is not None]
+                gravar_lote(conexao, lote, passagens, substituir)
+                print(f"✅ Lote {inicio // batch_size + 1}: {len(lote)} PDFs ingeridos")
+    finally:
+        conexao.close()
+        print("🔒 Conexão fechada.")
+
+
+def preencher_extratos(batch_size: int) -> None:
+    """Calcula resumo e extratos de documentos ingeridos antes de existirem"""
+    conexao = conectar()
+    total = 0
+    try:
+        cursor = conexao.cursor()
+        garantir_esquema(cursor)
+        while True:
+            cursor.execute(
+                "SELECT id, texto_extraido FROM documentos_pdf WHERE resumo IS NULL LIMIT %s",
+                [batch_size]
+            )
+            linhas = cursor.fetchall()
+            if not linhas:
+                break
+            valores = []
+            for documento_id, texto in linhas:
+                extratos = compute_extracts(texto)
+                valores.append((extratos['summary'], extratos['diagnosis'], extratos['recommendation'], documento_id))
+            cursor.executemany(
+                "UPDATE documentos_pdf SET resumo = %s, extrato_diagnostico = %s, extrato_recomendacao = %s WHERE id = %s",
+                valores
+            )
+            conexao.commit()
+            total += len(valores)
+        cursor.close()
+        print(f"✅ Extratos calculados para {total} documentos")
+    finally:
+        conexao.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestão em massa de PDFs médicos")
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="Pasta com uma subpasta por especialidade")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos para extrair texto")
+    parser.add_argument("--batch-size", type=int, default=64, help="PDFs por lote/transação")
+    parser.add_argument("--dry-run", action="store_true", help="Só lista o que seria ingerido")
+    parser.add_argument("--backfill-extracts", action="store_true",
+                        help="Calcula resumo/extratos dos documentos já ingeridos e termina")
+    args = parser.parse_args()
+    if args.backfill_extracts:
+        preencher_extratos(args.batch_size)
+        return
+    ingerir(os.path.abspath(args.root), args.workers, args.batch_size, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Dict, List, Optional, Tuple
+
+# Urgências da árvore de decisão, da mais para a menos prioritária
+URGENCY_LEVELS = ("Alta", "Média", "Baixa")
+# Urgência desconhecida conta como intermédia
+DEFAULT_PRIORITY = 1
+
+
+class AdmissionRejected(Exception):
+    """Pedido recusado pelo controlo de admissão (429: fila cheia, 503: espera esgotada)"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float = 1.0):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """Lugar obtido na fila; release() é idempotente"""
+
+    def __init__(self, admission: "PriorityAdmission", urgency: str, waited: float):
+        self._admission = admission
+        self.urgency = urgency
+        self.waited = waited
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._admission._release()
+
+    async def __aenter__(self) -> "AdmissionTicket":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+class PriorityAdmission:
+    """
+    Controlo de admissão das etapas caras (embedding, pesquisa e LLM), com
+    prioridade pela urgência da árvore de decisão.
+
+    No máximo `max_concurrent` pedidos correm em simultâneo, dos quais
+    `reserved_urgent` lugares só servem casos de urgência "Alta". Quem não
+    tem lugar espera numa fila ordenada por urgência (e por ordem de
+    chegada dentro de cada nível). Com `max_queue` pedidos à espera, os
+    restantes são recusados de imediato (429), exceto os de urgência
+    "Alta", que nunca são recusados e passam à frente de todos os outros.
+    Só corre num event loop (não é thread-safe).
+    """
+
+    def __init__(self, max_concurrent: int = 32, max_queue: int = 64, reserved_urgent: int = 4):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.reserved_urgent = min(reserved_urgent, max_concurrent - 1)
+        self._in_flight = 0
+        # (prioridade, ordem de chegada, future); entradas canceladas ficam até saírem do topo
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._waiting = {level: 0 for level in URGENCY_LEVELS}
+        self._order = itertools.count()
+        self._stats = {"admitted": 0, "queued": 0, "rejected_full": 0, "rejected_timeout": 0}
+
+    @staticmethod
+    def priority(urgency: str) -> int:
+        return URGENCY_LEVELS.index(urgency) if urgency in URGENCY_LEVELS else DEFAULT_PRIORITY
+
+    @classmethod
+    def level(cls, urgency: str) -> str:
+        """Nível de urgência usado na fila e nas métricas"""
+        return URGENCY_LEVELS[cls.priority(urgency)]
+
+    def _has_capacity(self, priority: int) -> bool:
+        limit = self.max_concurrent if priority == 0 else self.max_concurrent - self.reserved_urgent
+        return self._in_flight < limit
+
+    def _ahead(self, priority: int) -> bool:
+        """Há alguém à espera com prioridade igual ou superior?"""
+        return any(self._waiting[level] for level in URGENCY_LEVELS[:priority + 1])
+
+    async def acquire(self, urgency: str, timeout: Optional[float] = None) -> AdmissionTicket:
+        """
+        Obtém um lugar (usar com `async with`)
+
+        Args:
+            urgency: Urgência do caso ("Alta", "Média", "Baixa")
+            timeout: Espera máxima na fila (None = sem limite)
+
+        Raises:
+            AdmissionRejected: 429 com a fila cheia, 503 se a espera esgotar
+        """
+        level = self.level(urgency)
+        priority = self.priority(level)
+        start = time.perf_counter()
+
+        if self._has_capacity(priority) and not self._ahead(priority):
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            return AdmissionTicket(self, level, 0.0)
+
+        if priority > 0 and sum(self._waiting.values()) >= self.max_queue:
+            self._stats["rejected_full"] += 1
+            raise AdmissionRejected(429, "Serviço sobrecarregado: tente novamente dentro de momentos")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._waiting[level] += 1
+        self._stats["queued"] += 1
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._stats["rejected_timeout"] += 1
+            raise AdmissionRejected(503, "Tempo de espera esgotado: tente novamente", retry_after=2.0)
+        except BaseException:
+            # Cancelado depois de o lugar ter sido atribuído: devolve-o
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        finally:
+            self._waiting[level] -= 1
+        self._stats["admitted"] += 1
+        return AdmissionTicket(self, level, time.perf_counter() - start)
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._has_capacity(priority):
+                return
+            heapq.heappop(self._waiters)
+            self._in_flight += 1
+            future.set_result(None)
+
+    def stats(self) -> Dict:
+        return {
+            **self._stats,
+            "in_flight": self._in_flight,
+            "waiting": dict(self._waiting),
+            "max_concurrent": self.max_concurrent,
+            "reserved_urgent": self.reserved_urgent,
+            "max_queue": self.max_queue,
+        }
+
+
+# Testes (executar com pytest -v)
+def test_urgent_cases_jump_the_queue_and_low_priority_is_shed():
+    async def run():
+        admission = PriorityAdmission(max_concurrent=2, max_queue=2, reserved_urgent=1)
+        first = await admission.acquire("Média")
+        # O último lugar está reservado para urgências
+        order = []
+
+        async def case(urgency, name):
+            async with await admission.acquire(urgency, timeout=1) as ticket:
+                order.append((name, ticket.urgency))
+                await asyncio.sleep(0)
+
+        waiting = [asyncio.ensure_future(case("Média", "m1")), asyncio.ensure_future(case("Baixa", "b1"))]
+        await asyncio.sleep(0)
+        try:
+            await admission.acquire("Média")
+            assert False
+        except AdmissionRejected as e:
+            assert e.status_code == 429
+
+        urgent = await admission.acquire("Alta")  # lugar reservado, sem esperar
+        assert urgent.waited == 0.0
+        late_urgent = asyncio.ensure_future(case("Alta", "a1"))
+        await asyncio.sleep(0)
+        urgent.release()
+        first.release()
+        first.release()  # idempotente
+        await asyncio.gather(*waiting, late_urgent)
+        assert [name for name, _ in order] == ["a1", "m1", "b1"]
+
+        blocker = [await admission.acquire("Média")]
+        try:
+            await admission.acquire("Baixa", timeout=0.01)
+            assert False
+        except AdmissionRejected as e:
+            assert e.status_code == 503
+        blocker[0].release()
+        assert admission.stats()["in_flight"] == 0 and admission.stats()["waiting"] == {"Alta": 0, "Média": 0, "Baixa": 0}
+
+    asyncio.run(run())
@@ -1,27 +1,82 @@
-import google.generativeai as genai
 import os
-from typing import Dict, List
+import asyncio
+import logging
+import threading
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional
 from dotenv import load_dotenv
+from response_cache import ResponseCache
+from resilience import CircuitBreaker, Deadline
 
 load_dotenv()
 
+FALLBACK_EXPLANATION = "Não foi possível gerar uma explicação automática."
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+# Tempo máximo de uma chamada ao Gemini (limitado ainda pelo orçamento do pedido)
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT_SECONDS', '8'))
+# Com menos orçamento do que isto o Gemini nem é chamado
+LLM_MIN_BUDGET = float(os.getenv('LLM_MIN_BUDGET_MS', '300')) / 1000
+
+class Explanation(NamedTuple):
+    """Explicação (ou parte dela, em streaming) e se é a resposta degradada"""
+    text: str
+    degraded: bool = False
+    reason: Optional[str] = None  # "deadline", "timeout", "error" ou "circuit_open"
+
 class AIEnhancer:
     def __init__(self):
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
+        # O cliente do Gemini só é importado quando é preciso: ver load_model
+        self._model = None
+        self._model_lock = threading.Lock()
+        # Respostas repetem-se para o mesmo contexto clínico
+        self.cache = ResponseCache(
+            max_entries=int(os.getenv('LLM_CACHE_SIZE', '2000')),
+            ttl=float(os.getenv('LLM_CACHE_TTL', '86400')),
+            disk_path=os.getenv('LLM_CACHE_PATH') or None,
+            max_disk_entries=int(os.getenv('LLM_CACHE_DISK_MAX_ENTRIES', '50000'))
+        )
+        # Falhas seguidas abrem o disjuntor: o Gemini deixa de ser chamado
+        # durante o período de espera e as respostas saem degradadas
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv('LLM_BREAKER_FAILURES', '5')),
+            reset_timeout=float(os.getenv('LLM_BREAKER_COOLDOWN_SECONDS', '30'))
+        )
+        self._degraded = {"deadline": 0, "timeout": 0, "error": 0, "circuit_open": 0}
     
-    def enhance_response(self, diagnosis: Dict, medical_info: Dict, symptoms: str) -> str:
-        """Gera explicação contextualizada com IA"""
-        try:
-            # Prepara contexto
-            context = ""
-            if medical_info['relevant_info']:
-                context = "\n".join(
-                    f"Fonte {i+1}: {info['text'][:300]}..."
-                    for i, info in enumerate(medical_info['relevant_info'])
-                )
-
-            prompt = f"""
+    @property
+    def model(self):
+        """Cliente do Gemini, criado no primeiro uso"""
+        if self._model is None:
+            self.load_model()
+        return self._model
+
+    def load_model(self):
+        """
+        Importa e configura o google.generativeai (uma só vez). Com
+        GEMINI_API_ENDPOINT usa o cliente REST (ex.: servidor de fake_llm.py)
+        """
+        with self._model_lock:
+            if self._model is None:
+                endpoint = os.getenv('GEMINI_API_ENDPOINT')
+                if endpoint:
+                    from gemini_rest import GeminiRestModel
+                    self._model = GeminiRestModel(endpoint, GEMINI_MODEL_NAME, os.getenv("GEMINI_API_KEY"))
+                else:
+                    import google.generativeai as genai
+                    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+                    self._model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        return self._model
+
+    def build_prompt(self, diagnosis: Dict, medical_info: Dict, symptoms: str) -> str:
+        """Monta o prompt com o diagnóstico e as fontes recuperadas"""
+        # Prepara contexto
+        context = ""
+        if medical_info['relevant_info']:
+            context = "\n".join(
+                f"Fonte {i+1}: {info['text']}"
+                for i, info in enumerate(medical_info['relevant_info'])
+            )
+
+        return f"""
             És um assistente médico e o teu trabalho é fazeres o diagnóstico dos pacientes com base nos ficheiros da especialização que encontrares disponíveis na base de dados.
             Caso não consigas aceder a esses ficheiros usa a tua inteligência para formar uma resposta direta onde indiques o que poderá ser o diagnóstico bem como os cuidados a ter e se necessário ações a tomar.
             Faz respostas de 1 parágrafo, fala do diagnóstico estimado geral mas não ignores nenhum dos sintomas e fqala um pouco de cada caso sejam de áreas diferentes.
@@ -41,10 +96,214 @@ class AIEnhancer:
             3. Não faça diagnósticos definitivos
             4. Use apenas as informações fornecidas
             """
-            
-            response = self.model.generate_content(prompt)
+
+    def _cache_key(self, diagnosis: Dict, medical_info: Dict, symptoms: str, use_cache: bool) -> Optional[str]:
+        if not use_cache:
+            self.cache.record_bypass()
+            return None
+        return self.cache.fingerprint(diagnosis, medical_info, symptoms)
+
+    def fallback_explanation(self, diagnosis: Dict, medical_info: Dict) -> str:
+        """
+        Explicação determinística (sem LLM): diagnóstico da árvore de decisão
+        e excertos das fontes recuperadas
+        """
+        lines = [f"Triagem automática: {diagnosis.get('category')}, urgência {diagnosis.get('urgency')}."]
+        if diagnosis.get('alerts'):
+            lines.append(f"Sinais de alerta: {', '.join(diagnosis['alerts'])}.")
+        for info in (medical_info or {}).get('relevant_info', [])[:2]:
+            excerpt = " ".join((info.get('text') or "").split())[:300]
+            if excerpt:
+                lines.append(f"{info.get('title') or 'Fonte'}: {excerpt}")
+        if (medical_info or {}).get('recommendation'):
+            lines.append(f"Recomendação: {medical_info['recommendation']}.")
+        if len(lines) == 1:
+            lines.append(FALLBACK_EXPLANATION)
+        return "\n".join(lines)
+
+    def _degrade(self, reason: str, diagnosis: Dict, medical_info: Dict) -> Explanation:
+        self._degraded[reason] += 1
+        return Explanation(self.fallback_explanation(diagnosis, medical_info), True, reason)
+
+    def _timeout(self, deadline: Optional[Deadline]) -> float:
+        return deadline.budget(LLM_TIMEOUT) if deadline is not None else LLM_TIMEOUT
+
+    def _timed_out(self, timeout: float) -> str:
+        """
+        Motivo de um timeout. Só conta como falha do Gemini (disjuntor) se a
+        chamada teve o LLM_TIMEOUT inteiro; se o orçamento do pedido já vinha
+        gasto (ex.: recuperação lenta) é "deadline" e o disjuntor não muda.
+        """
+        if timeout < LLM_TIMEOUT:
+            return "deadline"
+        self.breaker.record_failure()
+        return "timeout"
+
+    def stats(self) -> Dict:
+        """Estado do disjuntor e respostas degradadas por motivo"""
+        return {"breaker": self.breaker.stats(), "degraded": dict(self._degraded), "timeout_s": LLM_TIMEOUT}
+
+    def enhance_response(self, diagnosis: Dict, medical_info: Dict, symptoms: str, use_cache: bool = True) -> str:
+        """Gera explicação contextualizada com IA (texto degradado se o Gemini falhar)"""
+        try:
+            key = self._cache_key(diagnosis, medical_info, symptoms, use_cache)
+            cached = self.cache.get(key) if key else None
+            if cached is not None:
+                return cached
+            if not self.breaker.allow():
+                return self._degrade("circuit_open", diagnosis, medical_info).text
+
+            prompt = self.build_prompt(diagnosis, medical_info, symptoms)
+            response = self.model.generate_content(prompt, request_options={"timeout": LLM_TIMEOUT})
+            self.breaker.record_success()
+            if key:
+                self.cache.put(key, response.text)
             return response.text
         
         except Exception as e:
-            print(f"⚠️  Erro na geração da explicação: {str(e)}")
-            return "Não foi possível gerar uma explicação automática."
\ No newline at end of file
+            self.breaker.record_failure()
+            logging.error(f"Erro na geração da explicação: {str(e)}")
+            return self._degrade("error", diagnosis, medical_info).text
+
+    async def _cached_async(self, key: Optional[str]) -> Optional[str]:
+        """Resposta em cache sem I/O no event loop: a leitura do SQLite corre num executor"""
+        if not key:
+            return None
+        cached = self.cache.get_memory(key)
+        if cached is None:
+            if self.cache.disk:
+                cached = await asyncio.get_running_loop().run_in_executor(None, self.cache.get_disk, key)
+            else:
+                cached = self.cache.get_disk(key)  # sem disco: não há I/O, só conta a falha
+        return cached
+
+    async def enhance_response_async(
+        self,
+        diagnosis: Dict,
+        medical_info: Dict,
+        symptoms: str,
+        use_cache: bool = True,
+        deadline: Optional[Deadline] = None
+    ) -> Explanation:
+        """
+        Versão assíncrona de enhance_response (não bloqueia o event loop).
+        A chamada é cancelada ao fim de LLM_TIMEOUT ou do orçamento do pedido;
+        nesse caso, em erro ou com o disjuntor aberto, a explicação é a
+        determinística (degraded=True). Só o LLM_TIMEOUT esgotado e os erros
+        contam como falhas para o disjuntor.
+        """
+        key = self._cache_key(diagnosis, medical_info, symptoms, use_cache)
+        cached = await self._cached_async(key)
+        if cached is not None:
+            return Explanation(cached)
+
+        timeout = self._timeout(deadline)
+        if timeout < LLM_MIN_BUDGET:
+            return self._degrade("deadline", diagnosis, medical_info)
+        if not self.breaker.allow():
+            return self._degrade("circuit_open", diagnosis, medical_info)
+
+        try:
+            prompt = self.build_prompt(diagnosis, medical_info, symptoms)
+            response = await asyncio.wait_for(self.model.generate_content_async(prompt), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Explicação cancelada ao fim de {timeout:.2f}s")
+            return self._degrade(self._timed_out(timeout), diagnosis, medical_info)
+        except Exception as e:
+            self.breaker.record_failure()
+            logging.error(f"Erro na geração da explicação: {str(e)}")
+            return self._degrade("error", diagnosis, medical_info)
+
+        self.breaker.record_success()
+        if key:
+            self.cache.put(key, response.text)
+        return Explanation(response.text)
+
+    async def stream_response_async(
+        self,
+        diagnosis: Dict,
+        medical_info: Dict,
+        symptoms: str,
+        use_cache: bool = True,
+        deadline: Optional[Deadline] = None
+    ) -> AsyncIterator[Explanation]:
+        """
+        Gera a explicação em modo streaming, devolvendo o texto por partes.
+        O tempo total está limitado como em enhance_response_async; se a
+        geração for interrompida depois de enviadas partes, a última parte
+        vem vazia com degraded=True.
+        """
+        key = self._cache_key(diagnosis, medical_info, symptoms, use_cache)
+        cached = await self._cached_async(key)
+        if cached is not None:
+            yield Explanation(cached)
+            return
+
+        timeout = self._timeout(deadline)
+        if timeout < LLM_MIN_BUDGET:
+            yield self._degrade("deadline", diagnosis, medical_info)
+            return
+        if not self.breaker.allow():
+            yield self._degrade("circuit_open", diagnosis, medical_info)
+            return
+
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + timeout
+        parts = []
+        try:
+            prompt = self.build_prompt(diagnosis, medical_info, symptoms)
+            response = await asyncio.wait_for(self.model.generate_content_async(prompt, stream=True), timeout)
+            chunks = response.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, expires_at - loop.time()))
+                except StopAsyncIteration:
+                    break
+                if chunk.text:
+                    parts.append(chunk.text)
+                    yield Explanation(chunk.text)
+        except asyncio.TimeoutError:
+            reason = self._timed_out(timeout)
+            logging.warning(f"Explicação (stream) cancelada ao fim de {timeout:.2f}s")
+        except Exception as e:
+            reason = "error"
+            self.breaker.record_failure()
+            logging.error(f"Erro na geração da explicação: {str(e)}")
+        else:
+            self.breaker.record_success()
+            # Só respostas completas vão para a cache
+            if key and parts:
+                self.cache.put(key, "".join(parts))
+            return
+
+        if parts:
+            self._degraded[reason] += 1
+            yield Explanation("", True, reason)
+        else:
+            yield self._degrade(reason, diagnosis, medical_info)
+
+
+# Testes (executar com pytest -v)
+def test_deadline_timeouts_do_not_open_the_breaker():
+    class SlowModel:
+        async def generate_content_async(self, prompt, stream=False):
+            await asyncio.sleep(1)
+
+    ai = AIEnhancer()
+    ai._model = SlowModel()
+    ai.breaker.failure_threshold = 1
+    diagnosis = {"category": "Cardiologia", "urgency": "Alta", "alerts": []}
+    medical_info = {"relevant_info": [], "recommendation": None}
+
+    async def run():
+        # Orçamento quase gasto pela recuperação: degrada sem culpar o Gemini
+        for _ in range(3):
+            result = await ai.enhance_response_async(diagnosis, medical_info, "dor", False, Deadline(LLM_MIN_BUDGET + 0.01))
+            assert result.degraded and result.reason == "deadline"
+        streamed = [part async for part in ai.stream_response_async(diagnosis, medical_info, "dor", False, Deadline(LLM_MIN_BUDGET + 0.01))]
+        assert streamed[-1].reason == "deadline"
+        assert ai.breaker.state == "closed"
+
+    asyncio.run(run())
+    # Um LLM_TIMEOUT inteiro esgotado continua a contar como falha
+    assert ai._timed_out(LLM_TIMEOUT) == "timeout" and ai.breaker.state == "open"
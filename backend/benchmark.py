@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks dos componentes da triagem.
+
+Mede a árvore de decisão (tamanho da tabela de regras x tamanho do texto),
+os embeddings (um texto e lote), a recuperação num corpus sintético local
+(LocalVectorIndex + DocumentCache) e a construção do prompt do AIEnhancer.
+O resultado é JSON, para comparar entre commits; com --baseline as
+regressões acima de --threshold são assinaladas (e com --fail-on-regression
+o código de saída é 1).
+
+Uso:
+    python benchmark.py [--filter TEXTO] [--output resultados.json]
+    python benchmark.py --baseline benchmark_baseline.json --fail-on-regression
+    python benchmark.py --save-baseline
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import subprocess
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BASE_DIR, "benchmark_baseline.json")
+# Duração mínima de cada repetição (o número de chamadas é calibrado)
+MIN_REPEAT_SECONDS = 0.05
+REPEATS = 7
+# Regressão = mediana acima de (1 + threshold) x a da baseline
+DEFAULT_THRESHOLD = 0.25
+
+# Cada benchmark devolve [(nome, função sem argumentos, itens por chamada)]
+Case = Tuple[str, Callable[[], object], int]
+BENCHMARKS: Dict[str, Callable[[], List[Case]]] = {}
+
+
+class SkipBenchmark(Exception):
+    """Dependência em falta (ex.: modelo de embeddings não instalado)"""
+
+
+def benchmark(group: str):
+    def register(func):
+        BENCHMARKS[group] = func
+        return func
+    return register
+
+
+def _words(count: int) -> str:
+    base = ("doente com dor no peito e falta de ar desde ontem, refere também febre alta "
+            "tosse persistente e dor de cabeça sem outras queixas relevantes").split()
+    return " ".join(base[i % len(base)] for i in range(count))
+
+
+@benchmark("decision_tree")
+def decision_tree_cases() -> List[Case]:
+    from decision_trees import MedicalDecisionTree
+
+    cases = []
+    for rules in (0, 1000, 10000):
+        tree = MedicalDecisionTree()
+        tree.symptom_map.update({f"sintoma sintético {i}": "Neurologia" for i in range(rules)})
+        tree.compile_rules()
+        for words in (10, 100, 1000):
+            text = _words(words)
+            cases.append((
+                f"decision_tree.evaluate[rules+{rules},words={words}]",
+                lambda tree=tree, text=text: tree.evaluate(text, "hipertensão", 45),
+                1
+            ))
+        # Sem correspondência exata: passa pelo índice aproximado
+        cases.append((
+            f"decision_tree.evaluate_fuzzy[rules+{rules}]",
+            lambda tree=tree: tree.evaluate("doente com dor no peitu e palpitassoes desde ontem", "", 45),
+            1
+        ))
+    tree = MedicalDecisionTree()
+    batch = [{"symptoms": _words(30), "medical_history": "", "age": 40}] * 100
+    cases.append(("decision_tree.evaluate_batch[100]", lambda: tree.evaluate_batch(batch), 100))
+    return cases
+
+
+@benchmark("embedding")
+def embedding_cases() -> List[Case]:
+    from encoders import create_encoder
+
+    try:
+        encoder = create_encoder()
+    except ImportError as e:
+        raise SkipBenchmark(str(e))
+    single = _words(12)
+    batch = [f"{_words(12)} caso {i}" for i in range(32)]
+    encoder.encode(single)  # aquecimento
+    return [
+        ("embedding.encode[single]", lambda: encoder.encode(single), 1),
+        ("embedding.encode[batch=32]", lambda: encoder.encode(batch, batch_size=32), 32),
+    ]
+
+
+@benchmark("retrieval")
+def retrieval_cases() -> List[Case]:
+    from vector_index import LocalVectorIndex
+    from document_cache import DocumentCache
+    from specialty_router import SpecialtyCentroids
+
+    rng = np.random.default_rng(7)
+    cases = []
+    for documents in (1000, 20000):
+        vectors = rng.standard_normal((documents, 384)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index = LocalVectorIndex()
+        index.build([(i + 1, i % 7 + 1, vectors[i].tobytes()) for i in range(documents)])
+        query = vectors[documents // 2]
+        cases.append((f"retrieval.search[docs={documents}]", lambda index=index: index.search(query, 10), 1))
+        cases.append((
+            f"retrieval.search_boosted[docs={documents}]",
+            lambda index=index: index.search(query, 10, boost_specialty=3, boost=0.1),
+            1
+        ))
+        cases.append((
+            f"retrieval.search_specialty[docs={documents}]",
+            lambda index=index: index.search(query, 10, specialty_id=3),
+            1
+        ))
+
+    centroids = SpecialtyCentroids()
+    centroids.build(index.specialty_sums())
+    cases.append(("retrieval.route_specialty[7]", lambda: centroids.rank(query, 3), 1))
+
+    cache = DocumentCache(lambda ids: {i: {"title": f"Protocolo {i}", "summary": _words(50)} for i in ids})
+    ids = list(range(1, 11))
+    cache.get_many(ids)
+    cases.append(("retrieval.document_cache[hit,10]", lambda: cache.get_many(ids), 10))
+    return cases
+
+
+@benchmark("prompt")
+def prompt_cases() -> List[Case]:
+    from ai_enhancer import AIEnhancer
+
+    enhancer = AIEnhancer()
+    diagnosis = {"category": "Cardiologia", "urgency": "Alta", "alerts": ["dor no peito"]}
+    medical_info = {"relevant_info": [{"id": i, "text": _words(80)} for i in range(3)]}
+    symptoms = _words(20)
+    return [
+        ("prompt.build", lambda: enhancer.build_prompt(diagnosis, medical_info, symptoms), 1),
+        ("prompt.fingerprint", lambda: enhancer.cache.fingerprint(diagnosis, medical_info, symptoms), 1),
+    ]
+
+
+def measure(func: Callable[[], object], repeats: int = REPEATS) -> Dict:
+    """Tempo por chamada (µs): calibra o número de chamadas e repete"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_REPEAT_SECONDS or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < MIN_REPEAT_SECONDS / 10 else 2
+
+    samples = [elapsed / number]
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    samples.sort()
+    return {
+        "median_us": round(statistics.median(samples) * 1e6, 3),
+        "min_us": round(samples[0] * 1e6, 3),
+        "max_us": round(samples[-1] * 1e6, 3),
+        "calls_per_repeat": number,
+        "repeats": repeats,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(filter_text: Optional[str] = None) -> Dict:
+    """Corre os benchmarks (opcionalmente filtrados pelo nome) e devolve o relatório"""
+    results, skipped = {}, {}
+    for group, build in BENCHMARKS.items():
+        try:
+            cases = build()
+        except SkipBenchmark as e:
+            skipped[group] = str(e)
+            continue
+        for name, func, items in cases:
+            if filter_text and filter_text not in name:
+                continue
+            result = measure(func)
+            result["items_per_call"] = items
+            result["items_per_s"] = round(items / (result["median_us"] / 1e6), 1) if result["median_us"] else None
+            results[name] = result
+            print(f"{name:60s} {result['median_us']:>12.3f} µs", file=sys.stderr)
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} ({os.cpu_count()} CPUs)",
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+def compare(report: Dict, baseline: Dict, threshold: float = DEFAULT_THRESHOLD) -> List[Dict]:
+    """Razão mediana atual / baseline por benchmark; marca regressões"""
+    comparison = []
+    for name, result in report["results"].items():
+        reference = baseline.get("results", {}).get(name)
+        if not reference or not reference["median_us"]:
+            continue
+        ratio = result["median_us"] / reference["median_us"]
+        comparison.append({
+            "name": name,
+            "baseline_us": reference["median_us"],
+            "current_us": result["median_us"],
+            "ratio": round(ratio, 3),
+            "regression": ratio > 1 + threshold,
+        })
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks da triagem")
+    parser.add_argument("--filter", help="Só corre benchmarks cujo nome contém este texto")
+    parser.add_argument("--output", help="Ficheiro JSON de resultados (por omissão: stdout)")
+    parser.add_argument("--baseline", help="JSON de referência para comparação")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Grava os resultados em {BASELINE_PATH}")
+    args = parser.parse_args()
+
+    report = run(args.filter)
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f), args.threshold)
+        regressions = [c["name"] for c in report["comparison"] if c["regression"]]
+        for name in regressions:
+            print(f"❌ Regressão: {name}", file=sys.stderr)
+        if regressions and args.fail_on_regression:
+            exit_code = 1
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    target = BASELINE_PATH if args.save_baseline else args.output
+    if target:
+        with open(target, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# Testes (executar com pytest -v)
+def test_measure_and_compare():
+    result = measure(lambda: sum(range(100)), repeats=3)
+    assert result["min_us"] <= result["median_us"] <= result["max_us"]
+    report = {"results": {"a": {"median_us": 13.0}, "b": {"median_us": 10.0}}}
+    baseline = {"results": {"a": {"median_us": 10.0}, "b": {"median_us": 10.0}}}
+    flags = {c["name"]: c["regression"] for c in compare(report, baseline, threshold=0.25)}
+    assert flags == {"a": True, "b": False}
@@ -0,0 +1,58 @@
+from typing import List, Tuple
+
+# Tamanho das passagens (caracteres) e sobreposição entre passagens vizinhas.
+# ~500 caracteres ficam bem abaixo do limite de tokens do all-MiniLM-L6-v2.
+PASSAGE_SIZE = 500
+PASSAGE_OVERLAP = 100
+
+
+def _last_space(text: str, start: int, end: int) -> int:
+    return max(text.rfind(" ", start, end), text.rfind("\n", start, end))
+
+
+def _first_space(text: str, start: int, end: int) -> int:
+    positions = [p for p in (text.find(" ", start, end), text.find("\n", start, end)) if p != -1]
+    return min(positions) if positions else -1
+
+
+def split_passages(text: str, size: int = PASSAGE_SIZE, overlap: int = PASSAGE_OVERLAP) -> List[Tuple[int, int, str]]:
+    """
+    Divide o texto em passagens sobrepostas, cortando em espaços sempre que
+    possível. Devolve (início, fim, passagem) com offsets no texto original.
+    """
+    if overlap >= size:
+        raise ValueError("overlap deve ser menor que size")
+
+    passages = []
+    length = len(text)
+    start = 0
+    while start < length:
+        end = min(length, start + size)
+        if end < length:
+            cut = _last_space(text, start + size // 2, end)
+            if cut > start:
+                end = cut
+
+        passage = text[start:end].strip()
+        if passage:
+            passages.append((start, end, passage))
+        if end >= length:
+            break
+
+        # Recua `overlap` caracteres e alinha ao início da palavra seguinte
+        next_start = end - overlap
+        space = _first_space(text, next_start, end)
+        next_start = space + 1 if space != -1 else next_start
+        start = max(next_start, start + 1)
+    return passages
+
+
+# Testes (executar com pytest -v)
+def test_passages_overlap_and_offsets():
+    text = " ".join(f"palavra{i}" for i in range(200))
+    passages = split_passages(text, size=100, overlap=20)
+    assert passages[0][0] == 0 and passages[-1][1] == len(text)
+    for (start, end, passage), (next_start, _, _) in zip(passages, passages[1:]):
+        assert text[start:end].strip() == passage
+        assert next_start < end  # há sobreposição
+        assert text[next_start - 1] == " "  # começa numa palavra inteira
@@ -0,0 +1,213 @@
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+
+class PoolTimeoutError(Exception):
+    """Nenhuma conexão ficou disponível dentro do tempo de espera"""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """
+    Pool limitado de conexões reutilizáveis, partilhado entre pedidos.
+
+    Args:
+        connect: Função que abre uma nova conexão
+        max_size: Número máximo de conexões abertas em simultâneo
+        acquire_timeout: Segundos de espera por uma conexão livre
+        max_lifetime: Idade máxima (s) de uma conexão antes de ser reciclada
+        health_check_after: Conexões paradas há mais tempo (s) são testadas
+            antes de serem devolvidas
+    """
+
+    def __init__(
+        self,
+        connect: Callable,
+        max_size: int = 5,
+        acquire_timeout: float = 10.0,
+        max_lifetime: float = 1800.0,
+        health_check_after: float = 30.0,
+    ):
+        if max_size < 1:
+            raise ValueError("max_size deve ser pelo menos 1")
+        self._connect = connect
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+
+        self._idle: List[_PooledConnection] = []
+        self._size = 0
+        self._in_use = 0
+        self._lock = threading.Condition()
+        self._closed = False
+        self._stats = {"creates": 0, "waits": 0, "timeouts": 0, "recycled": 0, "failed_checks": 0}
+
+    def _is_stale(self, item: _PooledConnection) -> bool:
+        return time.monotonic() - item.created_at > self.max_lifetime
+
+    def _is_healthy(self, item: _PooledConnection) -> bool:
+        """Faz um ping leve se a conexão estiver parada há algum tempo"""
+        if time.monotonic() - item.last_used < self.health_check_after:
+            return True
+        try:
+            with item.conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            return True
+        except Exception as e:
+            logging.warning(f"Pooled connection failed health check: {str(e)}")
+            return False
+
+    def _discard(self, item: _PooledConnection) -> None:
+        try:
+            item.conn.close()
+        except Exception:
+            pass
+
+    def acquire(self) -> _PooledConnection:
+        """Obtém uma conexão livre, abrindo uma nova se houver espaço"""
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Connection pool is closed")
+            waited = False
+            while not self._idle and self._size >= self.max_size:
+                if not waited:
+                    self._stats["waits"] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._lock.wait(remaining):
+                    if not self._idle and self._size >= self.max_size:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"No connection available after {self.acquire_timeout}s"
+                        )
+            item = self._idle.pop() if self._idle else None
+            if item is None:
+                # Reserva o lugar antes de abrir a conexão fora do lock
+                self._size += 1
+            self._in_use += 1
+
+        if item is not None:
+            reason = None
+            if self._is_stale(item):
+                reason = "recycled"
+            elif not self._is_healthy(item):
+                reason = "failed_checks"
+            if reason:
+                self._discard(item)
+                item = None
+                with self._lock:
+                    self._stats[reason] += 1
+
+        if item is None:
+            try:
+                item = _PooledConnection(self._connect())
+                with self._lock:
+                    self._stats["creates"] += 1
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._lock.notify()
+                raise
+        return item
+
+    def release(self, item: _PooledConnection, broken: bool = False) -> None:
+        """Devolve a conexão ao pool (ou fecha-a se estiver inutilizável)"""
+        item.last_used = time.monotonic()
+        discard = broken or self._closed or self._is_stale(item)
+        if discard:
+            self._discard(item)
+        with self._lock:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append(item)
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager que empresta uma conexão do pool"""
+        item = self.acquire()
+        try:
+            yield item.conn
+        except Exception:
+            # Em caso de erro a conexão pode ter ficado num estado inválido
+            self.release(item, broken=True)
+            raise
+        else:
+            self.release(item)
+
+    def stats(self) -> Dict:
+        """Estatísticas do pool para dimensionamento"""
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                **self._stats,
+            }
+
+    def close(self) -> None:
+        """Fecha todas as conexões livres; as emprestadas fecham ao voltar"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._lock.notify_all()
+        for item in idle:
+            self._discard(item)
+
+
+# Testes (executar com pytest -v)
+class _FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_pool_reuses_connections():
+    pool = ConnectionPool(_FakeConnection, max_size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert pool.stats()["creates"] == 1
+    assert pool.stats()["in_use"] == 0
+
+
+def test_pool_discards_broken_and_times_out():
+    pool = ConnectionPool(_FakeConnection, max_size=1, acquire_timeout=0.01)
+    try:
+        with pool.connection() as conn:
+            raise ValueError("query failed")
+    except ValueError:
+        pass
+    assert conn.closed and pool.stats()["size"] == 0
+
+    held = pool.acquire()
+    try:
+        pool.acquire()
+        assert False, "acquire should time out"
+    except PoolTimeoutError:
+        pass
+    pool.release(held)
+    assert pool.stats()["waits"] == 1 and pool.stats()["timeouts"] == 1
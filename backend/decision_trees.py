@@ -1,165 +1,190 @@
 import os
-from typing import Dict, List
+import threading
+from typing import Dict, List, Optional
 import logging
 from dotenv import load_dotenv
+from specialties import SPECIALTY_MAPPING
+from rule_tables import CompiledRules, RuleSetError, compile_rule_set, fold, load_rules
 
 # Configuração
 load_dotenv()
-logging.basicConfig(filename='decision_tree.log', level=logging.INFO)
-
-SPECIALTY_MAPPING = {
-    "Cardiologia": 1,
-    "Dermatologia": 2,
-    "Cirurgia Geral": 3,
-    "Ginecologia e Obstetricia": 4,
-    "Psiquiatria": 5,
-    "Doenças e Infeções": 6,
-    "Neurologia": 7
-}
+
+# Correspondência aproximada (erros de escrita) e o seu orçamento por pedido
+FUZZY_MATCHING = os.getenv('FUZZY_MATCHING', '1') == '1'
+FUZZY_BUDGET_MS = float(os.getenv('FUZZY_BUDGET_MS', '2'))
+
+# Ficheiro de regras versionado (recarregado a quente, ver MedicalDecisionTree.reload)
+RULES_PATH = os.getenv('TRIAGE_RULES_PATH') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "rules", "triage_rules.json"
+)
 
 class MedicalDecisionTree:
-    def __init__(self):
-        self.symptom_map = {
-            # Cardiologia / Cardiologia
-            "chest pain": "Cardiologia",
-            "dor no peito": "Cardiologia",
-            "shortness of breath": "Cardiologia",
-            "falta de ar": "Cardiologia",
-            "palpitations": "Cardiologia",
-            "taquicardia": "Cardiologia",
-            "dizziness": "Cardiologia",
-            "tontura": "Cardiologia",
-            "fainting": "Cardiologia",
-            "desmaio": "Cardiologia",
-            
-            # Neurologia / Neurologia
-            "headache": "Neurologia",
-            "dor de cabeça": "Neurologia",
-            "seizure": "Neurologia",
-            "convulsão": "Neurologia",
-            "numbness": "Neurologia",
-            "formigamento": "Neurologia",
-            
-            # Dermatologia / Dermatologia
-            "rash": "Dermatologia",
-            "erupção cutânea": "Dermatologia",
-            "itching": "Dermatologia",
-            "coceira": "Dermatologia",
-            "skin lesion": "Dermatologia",
-            "lesão na pele": "Dermatologia",
-            "acne": "Dermatologia",
-            "psoriasis": "Dermatologia",
-            "psoríase": "Dermatologia",
-            "eczema": "Dermatologia",
-            "pele seca": "Dermatologia",
-            "dry skin": "Dermatologia",
-            
-            # Cirurgia Geral / Cirurgia Geral
-            "abdominal pain": "Cirurgia Geral",
-            "dor abdominal": "Cirurgia Geral",
-            "appendicitis": "Cirurgia Geral",
-            "apendicite": "Cirurgia Geral",
-            "hernia": "Cirurgia Geral",
-            "hérnia": "Cirurgia Geral",
-            "gallstones": "Cirurgia Geral",
-            "pedras na vesícula": "Cirurgia Geral",
-            "hemorrhoids": "Cirurgia Geral",
-            "hemorroidas": "Cirurgia Geral",
-            
-            # Ginecologia e Obstetricia / Ginecologia e Obstetrícia
-            "vaginal bleeding": "Ginecologia e Obstetricia",
-            "sangramento vaginal": "Ginecologia e Obstetricia",
-            "pregnancy": "Ginecologia e Obstetricia",
-            "gravidez": "Ginecologia e Obstetricia",
-            "menstrual pain": "Ginecologia e Obstetricia",
-            "cólica menstrual": "Ginecologia e Obstetricia",
-            "breast pain": "Ginecologia e Obstetricia",
-            "dor nos seios": "Ginecologia e Obstetricia",
-            "infertility": "Ginecologia e Obstetricia",
-            "infertilidade": "Ginecologia e Obstetricia",
-            
-            # Psiquiatria / Psiquiatria
-            "depression": "Psiquiatria",
-            "depressão": "Psiquiatria",
-            "anxiety": "Psiquiatria",
-            "ansiedade": "Psiquiatria",
-            "insomnia": "Psiquiatria",
-            "insônia": "Psiquiatria",
-            "panic attacks": "Psiquiatria",
-            "ataques de pânico": "Psiquiatria",
-            "hallucinations": "Psiquiatria",
-            "alucinações": "Psiquiatria",
-            
-            # Doenças e Infeções / Doenças Infecciosas
-            "fever": "Doenças e Infeções",
-            "febre": "Doenças e Infeções",
-            "diarrhea": "Doenças e Infeções",
-            "diarreia": "Doenças e Infeções",
-            "vomiting": "Doenças e Infeções",
-            "vômito": "Doenças e Infeções",
-            "HIV": "Doenças e Infeções",
-            "hepatitis": "Doenças e Infeções",
-            "hepatite": "Doenças e Infeções",
-            "tuberculosis": "Doenças e Infeções",
-            "tuberculose": "Doenças e Infeções",
-        }
+    def __init__(self, rules_path: Optional[str] = None):
+        self.rules_path = rules_path or RULES_PATH
+        self._rules: Optional[CompiledRules] = None
+        self._stop_watch = None
+        self.fuzzy_enabled = FUZZY_MATCHING
+        self.fuzzy_budget = FUZZY_BUDGET_MS / 1000
+        self._fuzzy_stats = {"searches": 0, "matched": 0, "rescued": 0, "truncated": 0}
+        self.reload()
 
-        # Sintomas de alto risco (urgência máxima)
-        self.red_flag_symptoms = {
-            "chest pain": "Possible cardiac event",
-            "dor no peito": "Possível evento cardíaco",
-            "shortness of breath": "Respiratory distress",
-            "falta de ar": "Dificuldade respiratória",
-            "fainting": "Possible syncope",
-            "desmaio": "Possível síncope"
-        }
+    @property
+    def rules(self) -> CompiledRules:
+        """Conjunto de regras em uso (substituído atomicamente por reload)"""
+        return self._rules
 
-        # Sintomas pediátricos de alto risco
-        self.pediatric_red_flags = {
-            "chest pain": "Pediatric cardiac concern",
-            "dor no peito": "Problema cardíaco pediátrico",
-            "lethargy": "Pediatric emergency",
-            "letargia": "Emergência pediátrica"
-        }
+    def _install(self, rules: CompiledRules) -> None:
+        # Uma só atribuição: os pedidos em curso continuam com o conjunto
+        # que já leram; os seguintes usam o novo
+        self._rules = rules
+        self.symptom_map = dict(rules.symptom_map)
+        self.red_flag_symptoms = dict(rules.red_flag_symptoms)
+        self.pediatric_red_flags = dict(rules.pediatric_red_flags)
+
+    def reload(self, path: Optional[str] = None) -> Dict:
+        """
+        Lê, valida e compila o ficheiro de regras e troca-o pelo atual.
+        Se o ficheiro for inválido lança RuleSetError e mantém as regras em uso.
+        """
+        rules = load_rules(path or self.rules_path)
+        self._install(rules)
+        logging.info("Triage rules loaded", extra={"rules": rules.info()})
+        return rules.info()
+
+    def compile_rules(self) -> None:
+        """
+        Recompila a partir das tabelas em memória (symptom_map, red_flag_symptoms,
+        pediatric_red_flags), ex.: depois de as alterar diretamente.
+        """
+        current = self._rules
+        self._install(compile_rule_set({
+            "version": f"{current.version}+local" if current else "local",
+            "fallback_specialty": current.fallback_specialty if current else None,
+            "symptoms": self.symptom_map,
+            "red_flags": self.red_flag_symptoms,
+            "pediatric_red_flags": self.pediatric_red_flags,
+        }))
+
+    def start_watching(self, interval: float) -> None:
+        """Verifica o ficheiro de regras a cada `interval` segundos e recarrega-o se mudar"""
+        if interval <= 0 or self._stop_watch is not None:
+            return
+        self._stop_watch = threading.Event()
+
+        def signature():
+            try:
+                stat = os.stat(self.rules_path)
+                return stat.st_mtime_ns, stat.st_size
+            except OSError:
+                return None
+
+        def watch(last):
+            while not self._stop_watch.wait(interval):
+                current = signature()
+                if current is None or current == last:
+                    continue
+                try:
+                    self.reload()
+                    last = current
+                except RuleSetError as e:
+                    # Fica com as regras atuais; volta a tentar quando o ficheiro mudar
+                    logging.error(f"Triage rules reload rejected: {str(e)}")
+                    last = current
+
+        threading.Thread(target=watch, args=(signature(),), name="rules-watch", daemon=True).start()
+
+    def stop_watching(self) -> None:
+        if self._stop_watch is not None:
+            self._stop_watch.set()
+            self._stop_watch = None
 
     def _normalize_text(self, text: str) -> str:
-        """Normaliza texto para comparação"""
-        return text.Baixaer().strip()
+        """Normaliza texto para comparação (minúsculas, sem acentos)"""
+        return fold(text).strip()
+
+    def _scan(self, symptoms: str, medical_history: str = "", rules: Optional[CompiledRules] = None) -> Dict:
+        """
+        Percorre sintomas + histórico uma única vez e devolve, em conjunto,
+        a contagem por especialidade e os alertas gerais e pediátricos.
+        Os alertas só consideram ocorrências dentro dos sintomas. Se a
+        correspondência exata não reconhecer nenhum sintoma, os sintomas
+        passam pelo índice aproximado (trigramas, distância de edição
+        limitada) dentro de fuzzy_budget, antes de se cair no fallback.
+        """
+        rules = rules or self._rules
+        normalized_symptoms = fold(symptoms)
+        combined = f"{normalized_symptoms} {fold(medical_history)}"
+        symptoms_end = len(normalized_symptoms)
+
+        symptom_counts = {specialty: 0 for specialty in SPECIALTY_MAPPING.keys()}
+        seen = set()
+        red_flags = {}
+        pediatric = {}
+
+        for _, end, payload in rules.matcher.iter_matches(combined):
+            if payload in seen:
+                continue
+            kind, _, value = payload
+            if kind == "symptom":
+                seen.add(payload)
+                symptom_counts[value] += 1
+            elif end <= symptoms_end:
+                seen.add(payload)
+                (red_flags if kind == "red_flag" else pediatric)[value] = None
+
+        fuzzy_matches = []
+        if self.fuzzy_enabled and not any(symptom_counts.values()):
+            result = rules.fuzzy.search(
+                normalized_symptoms,
+                budget=self.fuzzy_budget,
+                exclude={fold(phrase).strip() for _, phrase, _ in seen}
+            )
+            for match in result["matches"]:
+                if match.payload in seen:
+                    continue
+                seen.add(match.payload)
+                kind, phrase, value = match.payload
+                if kind == "symptom":
+                    symptom_counts[value] += 1
+                else:
+                    (red_flags if kind == "red_flag" else pediatric)[value] = None
+                if not fuzzy_matches or fuzzy_matches[-1]["phrase"] != phrase:
+                    fuzzy_matches.append({"phrase": phrase, "text": match.text, "score": match.score})
+            self._count_fuzzy(result["truncated"], bool(fuzzy_matches), any(symptom_counts.values()))
+
+        return {
+            "symptom_counts": symptom_counts,
+            "red_flags": list(red_flags),
+            "pediatric_red_flags": list(pediatric),
+            "fuzzy_matches": fuzzy_matches,
+        }
+
+    def _count_fuzzy(self, truncated: bool, matched: bool, rescued: bool) -> None:
+        # Contadores aproximados (sem lock): só servem para monitorização
+        stats = self._fuzzy_stats
+        stats["searches"] += 1
+        stats["truncated"] += truncated
+        stats["matched"] += matched
+        stats["rescued"] += rescued
+
+    def fuzzy_stats(self) -> Dict:
+        """Pesquisas aproximadas, quantas encontraram frases e quantos casos evitaram o fallback"""
+        return {**self._fuzzy_stats, "enabled": self.fuzzy_enabled, "budget_ms": self.fuzzy_budget * 1000}
 
     def _identify_symptoms(self, text: str) -> Dict[str, int]:
         """Identifica sintomas e conta ocorrências por especialidade"""
-        normalized_text = self._normalize_text(text)
-        symptom_counts = {specialty: 0 for specialty in SPECIALTY_MAPPING.keys()}
-        
-        for symptom, specialty in self.symptom_map.items():
-            if self._normalize_text(symptom) in normalized_text:
-                symptom_counts[specialty] += 1
-                
-        return symptom_counts
-
-    def _determine_priority(self, symptoms: List[str], age: int) -> Dict:
+        return self._scan(text)["symptom_counts"]
+
+    def _determine_priority(self, scan: Dict, age: int) -> Dict:
         """Determina urgência e alertas"""
-        urgency = "Média"
-        alerts = []
-        
-        # Verifica sintomas de alto risco
-        for symptom in symptoms:
-            norm_symptom = self._normalize_text(symptom)
-            
-            # Prioridade pediátrica
-            if age < 18:
-                for ped_symptom, alert in self.pediatric_red_flags.items():
-                    if self._normalize_text(ped_symptom) in norm_symptom:
-                        urgency = "Alta"
-                        alerts.append(alert)
-            
-            # Sintomas gerais de alto risco
-            for red_symptom, alert in self.red_flag_symptoms.items():
-                if self._normalize_text(red_symptom) in norm_symptom:
-                    urgency = "Alta"
-                    alerts.append(alert)
-        
-        return {"urgency": urgency, "alerts": list(set(alerts))}
+        alerts = list(scan["red_flags"])
+        # Prioridade pediátrica
+        if age < 18:
+            alerts = scan["pediatric_red_flags"] + alerts
+        alerts = list(dict.fromkeys(alerts))
+
+        urgency = "Alta" if alerts else "Média"
+        return {"urgency": urgency, "alerts": alerts}
 
     def evaluate(self, symptoms: str, medical_history: str = "", age: int = 0) -> Dict:
         """
@@ -168,29 +193,36 @@ class MedicalDecisionTree:
             "category": "Specialty",
             "urgency": "Alta/Média/Baixa",
             "alerts": ["alert1", "alert2"],
-            "specialty_id": int
+            "specialty_id": int,
+            "fuzzy_matches": [{"phrase", "text", "score"}]  # só se houver
         }
         """
+        # Lê o conjunto de regras uma vez: um reload a meio não afeta este pedido
+        rules = self._rules
         try:
-            # Combina sintomas e histórico para análise
-            combined_input = f"{symptoms} {medical_history}"
+            # Analisa sintomas e histórico numa só passagem
+            scan = self._scan(symptoms, medical_history, rules)
             
             # Contagem de sintomas por especialidade
-            symptom_counts = self._identify_symptoms(combined_input)
+            symptom_counts = scan["symptom_counts"]
             total_symptoms = sum(symptom_counts.values())
             
             if total_symptoms == 0:
-                logging.warning(f"No recognized symptoms in: {combined_input}")
-                return self._fallback_response(age)
+                logging.warning("No recognized symptoms", extra={"symptom_chars": len(symptoms)})
+                return self._fallback_response(age, rules)
             
             # Determina especialidade principal
             primary_specialty = max(symptom_counts.items(), key=lambda x: x[1])[0]
             
             # Urgência e alertas
-            priority_info = self._determine_priority(
-                symptoms.split(","), 
-                age
-            )
+            priority_info = self._determine_priority(scan, age)
+            if scan["fuzzy_matches"]:
+                # Só correspondências aproximadas: podem juntar categoria e
+                # alertas, mas nunca baixar a urgência nem tirar o alerta do fallback
+                fallback = self._fallback_response(age, rules)
+                if fallback["urgency"] == "Alta":
+                    priority_info["urgency"] = "Alta"
+                priority_info["alerts"] = list(dict.fromkeys(priority_info["alerts"] + fallback["alerts"]))
             
             # Resposta final
             response = {
@@ -199,21 +231,47 @@ class MedicalDecisionTree:
                 "alerts": priority_info["alerts"],
                 "specialty_id": SPECIALTY_MAPPING[primary_specialty]
             }
+            if scan["fuzzy_matches"]:
+                response["fuzzy_matches"] = scan["fuzzy_matches"]
             
-            logging.info(f"Evaluation complete: {response}")
+            # Evento de alto volume: amostrado (ver log_config)
+            logging.info("Evaluation complete", extra={
+                "sampled": True, "category": primary_specialty, "urgency": response["urgency"]
+            })
             return response
             
         except Exception as e:
             logging.error(f"Evaluation error: {str(e)}")
-            return self._fallback_response(age)
+            return self._fallback_response(age, rules)
 
-    def _fallback_response(self, age: int) -> Dict:
-        """Resposta para casos indeterminados"""
+    def evaluate_batch(self, cases: List[Dict]) -> List[Dict]:
+        """
+        Avalia vários casos de uma vez.
+        Cada caso é um dicionário com "symptoms" e, opcionalmente,
+        "medical_history" e "age". Os resultados mantêm a ordem de entrada.
+        """
+        results = []
+        for case in cases:
+            try:
+                results.append(self.evaluate(
+                    case["symptoms"],
+                    case.get("medical_history") or "",
+                    case.get("age") or 0
+                ))
+            except Exception as e:
+                logging.error(f"Batch evaluation error: {str(e)}")
+                results.append(self._fallback_response(case.get("age") or 0))
+        return results
+
+    def _fallback_response(self, age: int, rules: Optional[CompiledRules] = None) -> Dict:
+        """Resposta para casos indeterminados ("fallback": especialidade por omissão)"""
+        category = (rules or self._rules).fallback_specialty
         return {
-            "category": "Cirurgia Geral",
+            "category": category,
             "urgency": "Alta" if age < 18 else "Média",
             "alerts": ["Undifferentiated symptoms - needs evaluation"],
-            "specialty_id": SPECIALTY_MAPPING["Cirurgia Geral"]
+            "specialty_id": SPECIALTY_MAPPING[category],
+            "fallback": True
         }
 
 # Testes (executar com pytest -v)
@@ -229,4 +287,58 @@ def test_pediatric_case():
     result = tree.evaluate("criança com dor no peito", age=9)
     assert result["category"] == "Cardiologia"
     assert result["urgency"] == "Alta"
-    assert "Problema cardíaco pediátrico" in result["alerts"]
\ No newline at end of file
+    assert "Problema cardíaco pediátrico" in result["alerts"]
+
+def test_history_does_not_raise_red_flags():
+    tree = MedicalDecisionTree()
+    result = tree.evaluate("tontura e cansaço", "teve dor no peito em 2019", age=40)
+    assert result["category"] == "Cardiologia"
+    assert result["urgency"] == "Média"
+    assert result["alerts"] == []
+
+def test_batch_keeps_input_order():
+    tree = MedicalDecisionTree()
+    results = tree.evaluate_batch([
+        {"symptoms": "coceira e pele seca", "age": 30},
+        {"symptoms": "dor no peito", "medical_history": "", "age": 50},
+    ])
+    assert [r["category"] for r in results] == ["Dermatologia", "Cardiologia"]
+
+def test_reload_swaps_rules_and_rejects_invalid_files(tmp_path):
+    import json
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"version": "v1", "symptoms": {"Psiquiatria": ["insónia"]}}), encoding="utf-8")
+    tree = MedicalDecisionTree(str(path))
+    assert tree.evaluate("Insonia ha semanas")["category"] == "Psiquiatria"
+
+    path.write_text(json.dumps({"version": "v2", "symptoms": {"Ortopedia": ["fratura"]}}), encoding="utf-8")
+    try:
+        tree.reload()
+        assert False
+    except RuleSetError:
+        pass
+    assert tree.rules.version == "v1"
+
+    path.write_text(json.dumps({"version": "v3", "symptoms": {"Neurology": ["insónia"]}}), encoding="utf-8")
+    assert tree.reload()["version"] == "v3"
+    assert tree.evaluate("insónia")["category"] == "Neurologia"
+
+def test_typos_resolve_without_fallback():
+    tree = MedicalDecisionTree()
+    result = tree.evaluate("tenho dor no peitu desde manhã", age=50)
+    assert result["category"] == "Cardiologia"
+    assert "Possível evento cardíaco" in result["alerts"]
+    assert result["fuzzy_matches"][0]["phrase"] == "dor no peito"
+    assert tree.fuzzy_stats()["rescued"] == 1
+
+def test_fuzzy_matches_never_lower_the_fallback():
+    tree = MedicalDecisionTree()
+    fallback = tree.evaluate("I never felt like this before, my knee hurts", age=8)
+    assert fallback["urgency"] == "Alta"
+    assert "Undifferentiated symptoms - needs evaluation" in fallback["alerts"]
+    assert tree.evaluate("I rush to the bathroom", age=30).get("fallback")
+    assert tree.evaluate("tenho tortura nas costas", age=30).get("fallback")
+
+    child = tree.evaluate("o meu filho tem tontra desde ontem", age=8)
+    assert child["category"] == "Cardiologia" and child["urgency"] == "Alta"
+    assert "Undifferentiated symptoms - needs evaluation" in child["alerts"]
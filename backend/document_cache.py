@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List
+
+
+class DocumentCache:
+    """
+    Cache em processo dos dados textuais dos documentos, indexada pelo id.
+
+    As pesquisas vetoriais devolvem apenas ids e scores; título, resumo e
+    extratos vêm desta cache, que em caso de falha carrega todos os ids em
+    falta com uma única chamada a `loader` (um SELECT ... WHERE id IN (...)).
+    O tamanho é limitado pelo total de caracteres guardados, com expulsão LRU.
+
+    Args:
+        loader: Função que recebe uma lista de ids e devolve {id: entrada},
+            onde cada entrada é um dicionário de campos (strings ou None)
+        max_chars: Limite de caracteres de texto mantidos em memória
+    """
+
+    def __init__(self, loader: Callable[[List[int]], Dict[int, Dict]], max_chars: int = 50_000_000):
+        self._loader = loader
+        self.max_chars = max_chars
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0}
+
+    @staticmethod
+    def _size(entry: Dict) -> int:
+        return sum(len(value) for value in entry.values() if isinstance(value, str))
+
+    def get_many(self, document_ids: Iterable[int]) -> Dict[int, Dict]:
+        """Devolve {id: entrada} para os ids pedidos (os inexistentes são omitidos)"""
+        found, missing = {}, []
+        with self._lock:
+            for document_id in dict.fromkeys(document_ids):
+                entry = self._entries.get(document_id)
+                if entry is None:
+                    missing.append(document_id)
+                else:
+                    self._entries.move_to_end(document_id)
+                    found[document_id] = entry
+            self._stats["hits"] += len(found)
+            self._stats["misses"] += len(missing)
+
+        if missing:
+            loaded = self._loader(missing)
+            with self._lock:
+                self._stats["loads"] += 1
+                for document_id, entry in loaded.items():
+                    found[document_id] = entry
+                    self._store(document_id, entry)
+        return found
+
+    def _store(self, document_id: int, entry: Dict) -> None:
+        previous = self._entries.pop(document_id, None)
+        if previous is not None:
+            self._chars -= self._size(previous)
+        self._entries[document_id] = entry
+        self._chars += self._size(entry)
+        while self._chars > self.max_chars and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._chars -= self._size(evicted)
+            self._stats["evictions"] += 1
+
+    def invalidate(self, document_ids: Iterable[int] = None) -> None:
+        """Remove ids da cache (todos se None), ex.: após reingestão"""
+        with self._lock:
+            if document_ids is None:
+                self._entries.clear()
+                self._chars = 0
+                return
+            for document_id in document_ids:
+                entry = self._entries.pop(document_id, None)
+                if entry is not None:
+                    self._chars -= self._size(entry)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "chars": self._chars, "max_chars": self.max_chars}
+
+
+# Testes (executar com pytest -v)
+def test_document_cache_batches_misses_and_bounds_size():
+    calls = []
+
+    def loader(ids):
+        calls.append(list(ids))
+        return {i: {'title': None, 'summary': "x" * 10} for i in ids if i != 99}
+
+    cache = DocumentCache(loader, max_chars=20)
+    assert set(cache.get_many([1, 2, 99])) == {1, 2}
+    assert cache.get_many([2])[2]['summary'] == "x" * 10
+    assert calls == [[1, 2, 99]]
+    cache.get_many([3])  # expulsa o 1 (menos usado)
+    cache.get_many([1])
+    assert calls[-1] == [1] and cache.stats()["evictions"] >= 1
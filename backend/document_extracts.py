@@ -0,0 +1,48 @@
+from typing import Dict, Optional
+
+DIAGNOSIS_KEYWORD = "diagnóstico"
+RECOMMENDATION_KEYWORD = "recomendação"
+# Tamanho máximo dos extratos e do resumo guardados na base de dados
+EXTRACT_MAX_CHARS = 200
+SUMMARY_CHARS = 300
+
+
+def extract_after_keyword(text: str, keyword: str) -> Optional[str]:
+    """Frase que segue a primeira ocorrência da palavra-chave (até ao ponto)"""
+    lowered = text.lower()
+    position = lowered.find(keyword)
+    if position == -1:
+        return None
+    start = position + len(keyword)
+    end = lowered.find(".", start)
+    if end == -1:
+        end = len(lowered)
+    extract = lowered[start:min(end, start + EXTRACT_MAX_CHARS)].strip(" :-–\n\t")
+    return " ".join(extract.split()).capitalize() or None
+
+
+def summarize(text: str) -> str:
+    """Resumo curto e normalizado (espaços colapsados) do início do texto"""
+    summary = " ".join(text[:SUMMARY_CHARS * 2].split())
+    if len(summary) > SUMMARY_CHARS:
+        return summary[:SUMMARY_CHARS].rsplit(" ", 1)[0] + "..."
+    return summary
+
+
+def compute_extracts(text: str) -> Dict[str, Optional[str]]:
+    """Extratos fixos de um documento, calculados uma vez na ingestão"""
+    text = text or ""
+    return {
+        'diagnosis': extract_after_keyword(text, DIAGNOSIS_KEYWORD),
+        'recommendation': extract_after_keyword(text, RECOMMENDATION_KEYWORD),
+        'summary': summarize(text),
+    }
+
+
+# Testes (executar com pytest -v)
+def test_compute_extracts():
+    extracts = compute_extracts("Protocolo.\nDIAGNÓSTICO: Enfarte agudo. Recomendação - repouso absoluto")
+    assert extracts['diagnosis'] == "Enfarte agudo"
+    assert extracts['recommendation'] == "Repouso absoluto"
+    assert extracts['summary'].startswith("Protocolo. DIAGNÓSTICO")
+    assert compute_extracts("")['diagnosis'] is None
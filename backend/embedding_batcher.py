@@ -0,0 +1,221 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+
+import numpy as np
+
+# Limites superiores dos intervalos do histograma de tamanhos de lote
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class EmbeddingBatcher:
+    """
+    Agrupa pedidos de embedding concorrentes num só forward pass.
+
+    Cada `submit` põe o texto numa fila e devolve um Future. Uma thread
+    dedicada espera pelo primeiro pedido, junta os que chegarem durante
+    `max_wait` segundos (ou até `max_batch_size`), codifica-os de uma vez
+    (textos repetidos só uma vez) e entrega cada vetor ao respetivo Future.
+
+    Args:
+        encode: Função que recebe uma lista de textos e devolve uma matriz
+        max_batch_size: Número máximo de textos por lote
+        max_wait: Janela de recolha (s) contada a partir do primeiro pedido
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_batch_size: int = 32, max_wait: float = 0.002):
+        self._encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "batched": 0, "encoded": 0, "errors": 0, "max_queue_depth": 0, "wait_seconds": 0.0}
+        self._histogram = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """Agenda a codificação do texto; o Future recebe o vetor"""
+        if self._closed:
+            raise RuntimeError("EmbeddingBatcher fechado")
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queue.qsize())
+        return future
+
+    def encode(self, text: str) -> np.ndarray:
+        """Versão bloqueante de submit"""
+        return self.submit(text).result()
+
+    def _collect(self) -> List:
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get_nowait() if remaining <= 0 else self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # fecha depois de servir este lote
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+            try:
+                self._serve(batch)
+            except Exception as e:
+                # Nunca deixar a thread morrer: os pedidos seguintes ficariam pendurados
+                logging.error(f"Embedding batcher failed to serve a batch: {str(e)}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _serve(self, batch: List) -> None:
+        # Pedidos cancelados entretanto (timeout ou cliente desligado) saem do lote;
+        # os restantes ficam RUNNING e já não podem ser cancelados
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        started = time.perf_counter()
+        try:
+            vectors = dict(zip(texts, self._encode(texts)))
+        except Exception as e:
+            logging.error(f"Batched embedding failed ({len(texts)} texts): {str(e)}")
+            with self._lock:
+                self._stats["errors"] += 1
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["batched"] += len(batch)
+            self._stats["encoded"] += len(texts)
+            self._stats["wait_seconds"] += sum(started - queued_at for _, _, queued_at in batch)
+            self._histogram[self._bucket(len(batch))] += 1
+        for text, future, _ in batch:
+            future.set_result(vectors[text])
+
+    @staticmethod
+    def _bucket(size: int) -> int:
+        for i, limit in enumerate(BATCH_SIZE_BUCKETS):
+            if size <= limit:
+                return i
+        return len(BATCH_SIZE_BUCKETS)
+
+    def close(self) -> None:
+        """Termina a thread depois de servir os pedidos já em fila"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+
+    def stats(self) -> Dict:
+        """Profundidade da fila, tamanho médio dos lotes e histograma"""
+        with self._lock:
+            stats = dict(self._stats)
+            histogram = list(self._histogram)
+        labels = [f"<={limit}" for limit in BATCH_SIZE_BUCKETS] + [f">{BATCH_SIZE_BUCKETS[-1]}"]
+        return {
+            **stats,
+            "wait_seconds": round(stats["wait_seconds"], 4),
+            "queue_depth": self._queue.qsize(),
+            "avg_batch_size": round(stats["batched"] / stats["batches"], 2) if stats["batches"] else 0.0,
+            "batch_size_histogram": dict(zip(labels, histogram)),
+            "max_batch_size": self.max_batch_size,
+            "max_wait": self.max_wait,
+        }
+
+
+# Testes (executar com pytest -v)
+def test_concurrent_requests_share_one_forward_pass():
+    calls = []
+    gate = threading.Event()
+
+    def encode(texts):
+        gate.wait(1)
+        calls.append(list(texts))
+        return np.array([[float(len(t))] for t in texts])
+
+    batcher = EmbeddingBatcher(encode, max_batch_size=8, max_wait=0.05)
+    futures = [batcher.submit(t) for t in ["a", "bb", "a", "ccc"]]
+    gate.set()
+    assert [f.result(1)[0] for f in futures] == [1.0, 2.0, 1.0, 3.0]
+    assert calls == [["a", "bb", "ccc"]]
+    stats = batcher.stats()
+    assert stats["batches"] == 1 and stats["avg_batch_size"] == 4 and stats["batch_size_histogram"]["<=4"] == 1
+    batcher.close()
+
+
+def test_encode_errors_reach_every_caller():
+    def encode(texts):
+        raise ValueError("modelo indisponível")
+
+    batcher = EmbeddingBatcher(encode, max_wait=0.01)
+    futures = [batcher.submit("x"), batcher.submit("y")]
+    for future in futures:
+        try:
+            future.result(1)
+            assert False
+        except ValueError:
+            pass
+    batcher.close()
+
+
+def test_cancelled_waiter_does_not_kill_the_batcher():
+    gate = threading.Event()
+
+    def encode(texts):
+        gate.wait(1)
+        return np.array([[float(len(t))] for t in texts])
+
+    batcher = EmbeddingBatcher(encode, max_wait=0.01)
+    batcher.submit("ocupa")  # prende a thread no encode
+    time.sleep(0.05)
+    abandoned = batcher.submit("abandonado")
+    assert abandoned.cancel()
+    gate.set()
+    assert batcher.submit("seguinte").result(1)[0] == 8.0
+    assert batcher._thread.is_alive()
+    batcher.close()
+
+
+def test_waiter_cancelled_after_wrap_future_is_skipped():
+    import asyncio
+
+    gate = threading.Event()
+
+    def encode(texts):
+        gate.wait(1)
+        return np.array([[1.0] for _ in texts])
+
+    batcher = EmbeddingBatcher(encode, max_wait=0.01)
+    batcher.submit("ocupa")
+    time.sleep(0.05)
+
+    async def waiter():
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(batcher.submit("lento")), 0.05)
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(waiter())
+    gate.set()
+    assert batcher.submit("depois").result(1)[0] == 1.0
+    assert batcher._thread.is_alive()
+    batcher.close()
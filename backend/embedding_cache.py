@@ -0,0 +1,265 @@
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Cache LRU limitado para embeddings de queries.
+
+    As chaves são o texto normalizado (minúsculas, espaços colapsados) e os
+    valores vetores float32 compactos. Opcionalmente mantém uma segunda
+    camada em disco (SQLite, em modo WAL) que sobrevive a reinícios.
+
+    O lock só protege a camada em memória. As leituras do disco usam uma
+    ligação por thread, fora do lock; as escritas (e a atualização de
+    last_used dos acertos em disco) vão para uma fila limitada e são
+    feitas em lotes por uma thread dedicada, que também mantém a tabela
+    abaixo de `max_disk_entries` (remove as entradas usadas há mais tempo).
+
+    Args:
+        max_entries: Número máximo de vetores mantidos em memória
+        disk_path: Caminho do ficheiro SQLite (None desativa a camada em disco)
+        namespace: Identifica o modelo, para não misturar vetores de modelos diferentes
+        max_disk_entries: Número máximo de linhas na tabela em disco
+    """
+
+    # Escritas entre verificações do tamanho da tabela em disco
+    TRIM_EVERY = 256
+
+    def __init__(self, max_entries: int = 10000, disk_path: Optional[str] = None, namespace: str = "",
+                 max_disk_entries: int = 100_000, max_pending_writes: int = 10_000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.namespace = namespace
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "disk_hits": 0, "evictions": 0,
+                       "disk_writes": 0, "disk_dropped": 0, "disk_evictions": 0}
+        self._disk_path = None
+        self._readers = threading.local()
+        self._writes: "queue.Queue" = queue.Queue(maxsize=max_pending_writes)
+        self._writer = None
+        if disk_path:
+            try:
+                db = sqlite3.connect(disk_path)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings ("
+                    "namespace TEXT, text TEXT, vector BLOB, last_used REAL DEFAULT 0, "
+                    "PRIMARY KEY (namespace, text))"
+                )
+                columns = {row[1] for row in db.execute("PRAGMA table_info(embeddings)")}
+                if "last_used" not in columns:
+                    db.execute("ALTER TABLE embeddings ADD COLUMN last_used REAL DEFAULT 0")
+                db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+                db.commit()
+                db.close()
+            except sqlite3.Error as e:
+                logging.error(f"Embedding disk cache unavailable: {str(e)}")
+            else:
+                self._disk_path = disk_path
+                self._writer = threading.Thread(target=self._write_loop, name="embedding-cache-writer", daemon=True)
+                self._writer.start()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Normaliza o texto usado como chave"""
+        return " ".join(text.lower().split())
+
+    @property
+    def disk(self) -> bool:
+        """True se a camada em disco estiver ativa"""
+        return self._disk_path is not None
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Procura um vetor pela chave já normalizada (memória, depois disco)"""
+        vector = self.get_memory(key)
+        if vector is not None:
+            return vector
+        return self.get_disk(key)
+
+    def get_memory(self, key: str) -> Optional[np.ndarray]:
+        """
+        Só a camada em memória (seguro no event loop). Uma falha aqui não é
+        contada: segue-se get_disk, que a conta.
+        """
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+            return vector
+
+    def get_disk(self, key: str) -> Optional[np.ndarray]:
+        """Só a camada em disco (bloqueante: fora do event loop)"""
+        vector = None
+        if self._disk_path is not None:
+            try:
+                row = self._reader().execute(
+                    "SELECT vector FROM embeddings WHERE namespace = ? AND text = ?",
+                    (self.namespace, key)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logging.error(f"Embedding disk cache read failed: {str(e)}")
+                row = None
+            if row is not None:
+                vector = np.frombuffer(row[0], dtype=np.float32)
+                self._enqueue(("touch", key, time.time()))
+        with self._lock:
+            if vector is None:
+                self._stats["misses"] += 1
+            else:
+                self._store(key, vector)
+                self._stats["hits"] += 1
+                self._stats["disk_hits"] += 1
+        return vector
+
+    def put(self, key: str, vector) -> np.ndarray:
+        """Guarda um vetor (convertido para float32) e devolve-o; nunca espera pelo disco"""
+        vector = np.ascontiguousarray(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        with self._lock:
+            self._store(key, vector)
+        if self._disk_path is not None:
+            self._enqueue(("put", key, time.time(), vector.tobytes()))
+        return vector
+
+    def _store(self, key: str, vector: np.ndarray) -> None:
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _reader(self) -> sqlite3.Connection:
+        db = getattr(self._readers, "db", None)
+        if db is None:
+            db = self._readers.db = sqlite3.connect(self._disk_path, check_same_thread=False)
+        return db
+
+    def _enqueue(self, item) -> None:
+        try:
+            self._writes.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self._stats["disk_dropped"] += 1
+
+    def _write_loop(self) -> None:
+        db = sqlite3.connect(self._disk_path)
+        since_trim = self.TRIM_EVERY
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < 512:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            puts = [(self.namespace, item[1], item[3], item[2]) for item in batch if item and item[0] == "put"]
+            touches = [(item[2], self.namespace, item[1]) for item in batch if item and item[0] == "touch"]
+            try:
+                if puts:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO embeddings (namespace, text, vector, last_used) VALUES (?, ?, ?, ?)",
+                        puts
+                    )
+                if touches:
+                    db.executemany("UPDATE embeddings SET last_used = ? WHERE namespace = ? AND text = ?", touches)
+                since_trim += len(puts)
+                if since_trim >= self.TRIM_EVERY:
+                    since_trim = 0
+                    self._trim(db)
+                db.commit()
+                with self._lock:
+                    self._stats["disk_writes"] += len(puts)
+            except sqlite3.Error as e:
+                logging.error(f"Embedding disk cache write failed: {str(e)}")
+            for _ in batch:
+                self._writes.task_done()
+            if None in batch:
+                db.close()
+                return
+
+    def _trim(self, db: sqlite3.Connection) -> None:
+        """Remove as linhas usadas há mais tempo acima de max_disk_entries"""
+        excess = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            db.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+            with self._lock:
+                self._stats["disk_evictions"] += excess
+
+    def flush(self) -> None:
+        """Espera que as escritas pendentes cheguem ao disco"""
+        if self._writer is not None and self._writer.is_alive():
+            self._writes.join()
+
+    def close(self) -> None:
+        """Escreve o que estiver pendente e termina a thread de escrita"""
+        if self._writer is not None and self._writer.is_alive():
+            self._writes.put(None)
+            self._writer.join(timeout=5)
+
+    def stats(self) -> Dict:
+        """Contadores de acertos/falhas e ocupação"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "disk": self._disk_path is not None,
+                "disk_pending": self._writes.qsize(),
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Testes (executar com pytest -v)
+def test_cache_lru_eviction_and_counters():
+    cache = EmbeddingCache(max_entries=2)
+    key = cache.normalize("  Dor no   PEITO ")
+    assert key == "dor no peito"
+    assert cache.get(key) is None
+    cache.put(key, [0.1, 0.2])
+    cache.put("febre", [0.3, 0.4])
+    assert cache.get(key).dtype == np.float32
+    cache.put("tosse", [0.5, 0.6])  # "febre" é o menos usado
+    assert cache.get("febre") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 2, 1)
+
+
+def test_cache_disk_tier_survives_restart_and_is_bounded(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    cache = EmbeddingCache(disk_path=path, namespace="m")
+    cache.put("febre", [1.0, 2.0])
+    cache.close()
+    restarted = EmbeddingCache(disk_path=path, namespace="m", max_disk_entries=3)
+    restarted.TRIM_EVERY = 1
+    assert restarted.get_memory("febre") is None
+    assert restarted.get("febre").tolist() == [1.0, 2.0]
+    assert restarted.stats()["disk_hits"] == 1
+
+    # "febre" voltou a ser lida depois de "tosse" ser escrita: sai "tosse"
+    restarted.put("tosse", [3.0, 4.0])
+    restarted.flush()
+    restarted.get_disk("febre")
+    restarted.put("vomitos", [5.0, 6.0])
+    restarted.put("dor", [7.0, 8.0])
+    restarted.close()
+    assert restarted.stats()["disk_evictions"] == 1
+    final = EmbeddingCache(disk_path=path, namespace="m")
+    assert final.get("tosse") is None and final.get("febre") is not None
+    final.close()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Servidor de embeddings partilhado pelos workers da API (sidecar).
+
+Com `uvicorn main:app --workers N` cada worker carregaria o seu próprio
+modelo (e runtime do torch), e a memória crescia com o número de workers.
+Aqui o modelo é carregado uma única vez neste processo, que atende os
+workers por um socket Unix; os pedidos concorrentes de todos os workers
+são agrupados em forward passes pelo EmbeddingBatcher.
+
+Protocolo (ligação persistente, um pedido de cada vez):
+    ao ligar: o servidor envia {"name": <codificador>}
+    pedido:   uint32 tamanho + JSON {"texts": [...]}
+    resposta: uint32 tamanho + JSON {"rows", "dim"} ou {"error"},
+              seguido de rows*dim float32
+
+Configuração: EMBEDDING_SOCKET (caminho do socket, nos workers e aqui),
+EMBEDDING_BACKEND/EMBEDDING_ONNX_PATH/EMBEDDING_THREADS (modelo servido),
+EMBEDDING_MICROBATCH_SIZE e EMBEDDING_MICROBATCH_WAIT_MS (lotes).
+
+Uso:
+    python embedding_server.py serve [--socket CAMINHO]
+    EMBEDDING_SOCKET=CAMINHO uvicorn main:app --workers N
+    python embedding_server.py measure --workers N
+"""
+import os
+import json
+import time
+import socket
+import struct
+import logging
+import argparse
+import threading
+import socketserver
+import multiprocessing
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from embedding_batcher import EmbeddingBatcher
+from encoders import Texts, create_encoder
+
+DEFAULT_SOCKET = os.getenv('EMBEDDING_SOCKET') or "/tmp/smartnurse-embeddings.sock"
+# Tempo que um worker espera pelo servidor ao arrancar (o modelo pode ainda estar a carregar)
+EMBEDDING_SOCKET_WAIT = float(os.getenv('EMBEDDING_SOCKET_WAIT_SECONDS', '60'))
+# Textos usados para exercitar o modelo nas medições de memória
+MEASURE_TEXTS = [f"dor no peito e falta de ar há {i} dias" for i in range(1, 65)]
+
+_LENGTH = struct.Struct("<I")
+
+
+def _send(sock: socket.socket, header: Dict, payload: bytes = b"") -> None:
+    data = json.dumps(header, ensure_ascii=False).encode()
+    sock.sendall(_LENGTH.pack(len(data)) + data + payload)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            raise ConnectionError("Ligação ao servidor de embeddings fechada")
+        buffer += chunk
+    return bytes(buffer)
+
+
+def _recv(sock: socket.socket) -> Dict:
+    (size,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return json.loads(_recv_exact(sock, size))
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    embedding_server: "EmbeddingServer"
+
+    def handle(self):
+        sock = self.request
+        _send(sock, {"name": self.embedding_server.encoder.name})
+        while True:
+            try:
+                request = _recv(sock)
+            except (ConnectionError, OSError):
+                return
+            try:
+                vectors = self.embedding_server.embed(request["texts"])
+            except Exception as e:
+                logging.error(f"Erro ao gerar embeddings ({len(request.get('texts') or [])} textos): {str(e)}")
+                _send(sock, {"error": str(e)})
+                continue
+            _send(sock, {"rows": vectors.shape[0], "dim": vectors.shape[1]}, vectors.tobytes())
+
+
+class EmbeddingServer:
+    """
+    Serve o codificador num socket Unix. Cada ligação tem a sua thread; os
+    textos de todas as ligações passam pelo mesmo EmbeddingBatcher.
+
+    Args:
+        encoder: Codificador local (ver encoders.create_encoder)
+        socket_path: Caminho do socket (um ficheiro antigo é substituído)
+    """
+
+    def __init__(self, encoder, socket_path: str, max_batch_size: int = 32, max_wait: float = 0.002):
+        self.encoder = encoder
+        self.socket_path = socket_path
+        self.batcher = EmbeddingBatcher(self._encode, max_batch_size=max_batch_size, max_wait=max_wait)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        handler = type("EmbeddingHandler", (_Handler,), {"embedding_server": self})
+        self._server = socketserver.ThreadingUnixStreamServer(socket_path, handler)
+        self._server.daemon_threads = True
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.encoder.encode(texts, batch_size=self.batcher.max_batch_size)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Matriz (len(texts), dim) float32, codificada em micro-lotes"""
+        futures = [self.batcher.submit(text) for text in texts]
+        if not futures:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.ascontiguousarray(np.vstack([future.result() for future in futures]), dtype=np.float32)
+
+    def start(self) -> "EmbeddingServer":
+        """Atende pedidos numa thread (para testes); ver serve_forever"""
+        threading.Thread(target=self._server.serve_forever, name="embedding-server", daemon=True).start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self.batcher.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class RemoteEncoder:
+    """
+    Codificador que delega no servidor de embeddings, com a mesma interface
+    `encode(textos, batch_size)` dos backends locais (o tamanho dos lotes é
+    decidido pelo servidor). Não importa o torch nem carrega pesos.
+
+    Uma ligação por thread, reaberta se cair. O construtor espera até
+    `connect_timeout` pelo servidor e confirma que serve o modelo esperado
+    (a cache de embeddings depende dele).
+    """
+
+    def __init__(self, socket_path: str, expected_name: Optional[str] = None,
+                 connect_timeout: float = EMBEDDING_SOCKET_WAIT, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        wait_until = time.monotonic() + connect_timeout
+        while True:
+            try:
+                self.name = self._connection()[1]
+                break
+            except (ConnectionError, FileNotFoundError):
+                if time.monotonic() >= wait_until:
+                    raise ConnectionError(f"Servidor de embeddings indisponível em {socket_path}")
+                time.sleep(0.2)
+        if expected_name and self.name != expected_name:
+            raise ValueError(f"O servidor de embeddings serve '{self.name}', esperado '{expected_name}'")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+                connection = (sock, _recv(sock)["name"])
+            except BaseException:
+                sock.close()
+                raise
+            self._local.connection = connection
+        return connection
+
+    def _disconnect(self) -> None:
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            connection[0].close()
+
+    def _request(self, texts: List[str]) -> np.ndarray:
+        sock = self._connection()[0]
+        try:
+            _send(sock, {"texts": texts})
+            header = _recv(sock)
+            if "error" in header:
+                raise RuntimeError(f"Servidor de embeddings: {header['error']}")
+            rows, dim = header["rows"], header["dim"]
+            payload = _recv_exact(sock, rows * dim * 4)
+        except (ConnectionError, OSError):
+            # Resposta a meio: a ligação deixa de ser utilizável
+            self._disconnect()
+            raise
+        return np.frombuffer(payload, dtype=np.float32).reshape(rows, dim)
+
+    def encode(self, texts: Texts, batch_size: int = 32) -> np.ndarray:
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        try:
+            vectors = self._request(batch)
+        except ConnectionError:
+            # Servidor reiniciado: uma nova tentativa com ligação nova
+            vectors = self._request(batch)
+        return vectors[0] if single else vectors
+
+
+def process_memory(pid="self") -> Dict[str, float]:
+    """
+    Memória do processo em MB (Linux, /proc/<pid>/smaps_rollup): RSS, PSS
+    (páginas partilhadas repartidas pelos processos que as usam) e USS
+    (páginas só deste processo). Vazio se não estiver disponível.
+    """
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                    values[key] = int(rest.split()[0]) / 1024
+    except (OSError, ValueError, IndexError):
+        return {}
+    return {
+        "rss_mb": round(values.get("Rss", 0.0), 1),
+        "pss_mb": round(values.get("Pss", 0.0), 1),
+        "uss_mb": round(values.get("Private_Clean", 0.0) + values.get("Private_Dirty", 0.0), 1),
+    }
+
+
+def serve(socket_path: str = DEFAULT_SOCKET) -> None:
+    """Carrega o modelo configurado, aquece-o e atende os workers"""
+    encoder = create_encoder(socket_path="")
+    encoder.encode(MEASURE_TEXTS[:2])
+    server = EmbeddingServer(
+        encoder, socket_path,
+        max_batch_size=int(os.getenv('EMBEDDING_MICROBATCH_SIZE', '32')),
+        max_wait=float(os.getenv('EMBEDDING_MICROBATCH_WAIT_MS', '2')) / 1000
+    )
+    logging.info(f"Servidor de embeddings ({encoder.name}) em {socket_path}: {process_memory()}")
+    try:
+        server.serve_forever()
+    finally:
+        server.close()
+
+
+def _measure_worker(socket_path: str, loaded, done) -> None:
+    encoder = create_encoder(socket_path=socket_path)
+    encoder.encode(MEASURE_TEXTS, batch_size=32)
+    loaded.put(os.getpid())
+    done.wait()
+
+
+def measure(workers: int, sidecar: bool, socket_path: str = DEFAULT_SOCKET) -> List[Dict]:
+    """
+    Arranca `workers` processos (spawn, como o uvicorn), cada um com o seu
+    codificador local ou ligado ao servidor de embeddings, e mede a memória
+    de cada processo com todos ativos e o modelo já exercitado.
+    """
+    context = multiprocessing.get_context("spawn")
+    loaded, done = context.Queue(), context.Event()
+    processes = []
+    if sidecar:
+        server = context.Process(target=serve, args=(socket_path,), daemon=True)
+        server.start()
+        processes.append(("sidecar", server))
+    for i in range(workers):
+        worker = context.Process(target=_measure_worker, args=(socket_path if sidecar else "", loaded, done), daemon=True)
+        worker.start()
+        processes.append((f"worker-{i}", worker))
+    try:
+        for _ in range(workers):
+            loaded.get(timeout=600)
+        return [{"process": name, "pid": process.pid, **process_memory(process.pid)} for name, process in processes]
+    finally:
+        done.set()
+        for name, process in processes:
+            if name == "sidecar":
+                process.terminate()
+            process.join(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de embeddings partilhado pelos workers")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("serve", help="Carrega o modelo e atende os workers")
+    run.add_argument("--socket", default=DEFAULT_SOCKET)
+    check = sub.add_parser("measure", help="Memória por worker: modelo por worker vs servidor partilhado")
+    check.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    check.add_argument("--socket", default=DEFAULT_SOCKET)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "serve":
+        serve(args.socket)
+        return
+    for sidecar in (False, True):
+        rows = measure(args.workers, sidecar, args.socket)
+        print(f"\n{'Servidor partilhado' if sidecar else 'Modelo por worker'} ({args.workers} workers)")
+        for row in rows:
+            print(f"  {row['process']:<10} rss={row.get('rss_mb')} MB  pss={row.get('pss_mb')} MB  uss={row.get('uss_mb')} MB")
+        print(f"  total PSS: {round(sum(row.get('pss_mb', 0.0) for row in rows), 1)} MB")
+
+
+if __name__ == "__main__":
+    main()
+
+
+# Testes (executar com pytest -v)
+def test_remote_encoder_round_trip(tmp_path):
+    class FakeEncoder:
+        name = "fake-model"
+
+        def encode(self, texts, batch_size=32):
+            if "falha" in texts:
+                raise ValueError("texto inválido")
+            return np.array([[len(text), 1.0, 0.5] for text in texts], dtype=np.float32)
+
+    path = str(tmp_path / "embeddings.sock")
+    server = EmbeddingServer(FakeEncoder(), path).start()
+    try:
+        encoder = RemoteEncoder(path, expected_name="fake-model", connect_timeout=1)
+        assert encoder.encode("abc").tolist() == [3.0, 1.0, 0.5]
+        assert encoder.encode(["a", "abcd", "a"]).shape == (3, 3)
+        assert encoder.encode([]).shape == (0, 0)
+        try:
+            encoder.encode(["falha"])
+            assert False
+        except RuntimeError as e:
+            assert "texto inválido" in str(e)
+        assert encoder.encode("ab")[0] == 2.0  # a ligação continua utilizável
+
+        try:
+            RemoteEncoder(path, expected_name="outro-modelo", connect_timeout=1)
+            assert False
+        except ValueError:
+            pass
+    finally:
+        server.close()
+    try:
+        RemoteEncoder(path, connect_timeout=0.3)
+        assert False
+    except ConnectionError:
+        pass
+    assert process_memory()["rss_mb"] > 0
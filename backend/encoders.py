@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Codificadores de embeddings partilhados pela API e pela ingestão.
+
+Dois backends com a mesma interface (`encode(textos, batch_size)`):
+- "torch": SentenceTransformer (PyTorch), o comportamento original;
+- "onnx": grafo ONNX exportado do mesmo modelo e quantizado em int8,
+  executado pelo ONNX Runtime com um número de threads configurável.
+
+Configuração: EMBEDDING_BACKEND (torch|onnx), EMBEDDING_ONNX_PATH (pasta
+criada por `export`) e EMBEDDING_THREADS. Com EMBEDDING_SOCKET, o modelo é
+servido por embedding_server.py, carregado uma só vez para todos os workers.
+
+Uso:
+    python encoders.py export PASTA [--no-quantize]
+    python encoders.py compare PASTA [--threads N] [--texts N]
+"""
+import os
+import time
+import argparse
+from typing import List, Optional, Union
+
+import numpy as np
+
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+# Ficheiros dentro da pasta exportada
+ONNX_MODEL_FILE = "model.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+# Mesmo limite de tokens que o SentenceTransformer usa para este modelo
+MAX_SEQ_LENGTH = 256
+
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+EMBEDDING_ONNX_PATH = os.getenv('EMBEDDING_ONNX_PATH') or None
+EMBEDDING_THREADS = int(os.getenv('EMBEDDING_THREADS', '0')) or None
+EMBEDDING_SOCKET = os.getenv('EMBEDDING_SOCKET') or None
+
+Texts = Union[str, List[str]]
+
+
+class SentenceTransformerEncoder:
+    """Backend PyTorch (sentence_transformers)"""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, threads: Optional[int] = None):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            torch.set_num_threads(threads)
+        self.name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: Texts, batch_size: int = 32) -> np.ndarray:
+        return self.model.encode(texts, batch_size=batch_size)
+
+
+class OnnxEncoder:
+    """
+    Backend ONNX Runtime: tokenização com `tokenizers`, mean pooling sobre a
+    máscara de atenção e normalização L2, tal como o pipeline do
+    SentenceTransformer. Não importa o torch.
+
+    Args:
+        model_dir: Pasta com model.onnx e tokenizer.json (ver export_onnx)
+        threads: Threads intra-operação do ONNX Runtime (None = automático)
+    """
+
+    def __init__(self, model_dir: str, threads: Optional[int] = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, ONNX_MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+        self.name = f"{EMBEDDING_MODEL_NAME}:onnx"
+
+    def encode(self, texts: Texts, batch_size: int = 32) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        batches = [self._encode_batch(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        vectors = np.vstack(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+        return vectors[0] if single else vectors
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        token_embeddings = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        return mean_pool_normalize(token_embeddings, feeds["attention_mask"])
+
+
+def mean_pool_normalize(token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """Média dos embeddings dos tokens reais (sem padding), normalizada (L2)"""
+    mask = attention_mask[..., None].astype(np.float32)
+    pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+def encoder_id(backend: str = None) -> str:
+    """Identificador do codificador configurado (namespace da cache de embeddings)"""
+    backend = backend or EMBEDDING_BACKEND
+    return EMBEDDING_MODEL_NAME if backend == 'torch' else f"{EMBEDDING_MODEL_NAME}:{backend}"
+
+
+def create_encoder(backend: str = None, onnx_path: str = None, threads: Optional[int] = None,
+                   socket_path: Optional[str] = None):
+    """
+    Cria o codificador configurado por EMBEDDING_BACKEND/EMBEDDING_ONNX_PATH/EMBEDDING_THREADS.
+    Com um socket (EMBEDDING_SOCKET por omissão, "" força o modelo local),
+    devolve um cliente do servidor de embeddings que serve esse backend.
+    """
+    backend = backend or EMBEDDING_BACKEND
+    threads = threads or EMBEDDING_THREADS
+    socket_path = EMBEDDING_SOCKET if socket_path is None else socket_path
+    if socket_path:
+        from embedding_server import RemoteEncoder
+        return RemoteEncoder(socket_path, expected_name=encoder_id(backend))
+    if backend == 'onnx':
+        onnx_path = onnx_path or EMBEDDING_ONNX_PATH
+        if not onnx_path:
+            raise ValueError("EMBEDDING_ONNX_PATH é obrigatório com EMBEDDING_BACKEND=onnx")
+        return OnnxEncoder(onnx_path, threads)
+    if backend == 'torch':
+        return SentenceTransformerEncoder(EMBEDDING_MODEL_NAME, threads)
+    raise ValueError(f"EMBEDDING_BACKEND desconhecido: {backend}")
+
+
+def export_onnx(output_dir: str, quantize: bool = True) -> str:
+    """
+    Exporta o modelo para ONNX (e quantiza os pesos em int8)
+
+    Returns:
+        Caminho do model.onnx criado
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    model_id = f"sentence-transformers/{EMBEDDING_MODEL_NAME}"
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModel.from_pretrained(model_id, return_dict=False).eval()
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer.save_pretrained(output_dir)
+
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    sample = tokenizer(["dor no peito"], return_tensors="pt")
+    target = os.path.join(output_dir, ONNX_MODEL_FILE)
+    fp32 = os.path.join(output_dir, "model_fp32.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in names),
+            fp32,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in names + ["last_hidden_state"]},
+            opset_version=17
+        )
+    if quantize:
+        quantize_dynamic(fp32, target, weight_type=QuantType.QInt8)
+        os.remove(fp32)
+    else:
+        os.replace(fp32, target)
+    return target
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Pico de RSS do processo (MB); None sem o módulo resource (ex.: Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _sample_texts(count: int) -> List[str]:
+    symptoms = ["dor no peito", "falta de ar", "febre alta", "dor de cabeça intensa", "manchas na pele",
+                "vómitos", "tonturas", "ansiedade", "dor abdominal", "tosse persistente"]
+    return [
+        f"{symptoms[i % len(symptoms)]} e {symptoms[(i * 7 + 3) % len(symptoms)]} há {i % 12 + 1} dias"
+        for i in range(count)
+    ]
+
+
+def _throughput(encoder, texts: List[str], batch_size: int) -> float:
+    encoder.encode(texts[:batch_size], batch_size=batch_size)  # aquecimento
+    start = time.perf_counter()
+    encoder.encode(texts, batch_size=batch_size)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def compare(onnx_path: str, threads: int = 1, count: int = 512, batch_size: int = 32) -> dict:
+    """
+    Paridade (cosseno ONNX vs PyTorch) e débito de cada backend com o mesmo
+    número de threads. O ONNX é carregado primeiro para que o pico de RSS
+    medido após o seu carregamento não inclua o torch.
+    """
+    texts = _sample_texts(count)
+    onnx = OnnxEncoder(onnx_path, threads)
+    onnx_vectors = onnx.encode(texts, batch_size=batch_size)
+    onnx_rss = _peak_rss_mb()
+    torch_encoder = SentenceTransformerEncoder(EMBEDDING_MODEL_NAME, threads)
+    torch_vectors = torch_encoder.encode(texts, batch_size=batch_size)
+
+    cosines = np.sum(onnx_vectors * torch_vectors, axis=1)  # ambos normalizados
+    onnx_rate = _throughput(onnx, texts, batch_size)
+    torch_rate = _throughput(torch_encoder, texts, batch_size)
+    return {
+        "texts": count,
+        "threads": threads,
+        "cosine_min": round(float(cosines.min()), 4),
+        "cosine_mean": round(float(cosines.mean()), 4),
+        "onnx_texts_per_s": round(onnx_rate, 1),
+        "torch_texts_per_s": round(torch_rate, 1),
+        "speedup": round(onnx_rate / torch_rate, 2),
+        "peak_rss_mb_onnx_only": onnx_rss,
+        "peak_rss_mb_with_torch": _peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exportação e comparação dos backends de embeddings")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Exporta o modelo para ONNX (int8)")
+    export.add_argument("output_dir")
+    export.add_argument("--no-quantize", action="store_true")
+    check = sub.add_parser("compare", help="Paridade e débito ONNX vs PyTorch")
+    check.add_argument("onnx_dir")
+    check.add_argument("--threads", type=int, default=1)
+    check.add_argument("--texts", type=int, default=512)
+    check.add_argument("--min-cosine", type=float, default=0.98,
+                       help="Falha (código 1) se algum vetor ficar abaixo deste cosseno")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(f"✅ Modelo exportado para {export_onnx(args.output_dir, quantize=not args.no_quantize)}")
+        return
+    result = compare(args.onnx_dir, threads=args.threads, count=args.texts)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    if result["cosine_min"] < args.min_cosine:
+        print(f"❌ Paridade abaixo de {args.min_cosine}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# Testes (executar com pytest -v)
+def test_mean_pool_ignores_padding_and_normalizes():
+    tokens = np.array([[[3.0, 4.0], [100.0, 100.0]]], dtype=np.float32)
+    pooled = mean_pool_normalize(tokens, np.array([[1, 0]]))
+    assert np.allclose(pooled, [[0.6, 0.8]])
+    assert encoder_id('torch') == EMBEDDING_MODEL_NAME and encoder_id('onnx').endswith(':onnx')
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Servidor falso da API REST do Gemini, para testes locais de latência e de
+falhas sem chamar o serviço real.
+
+Responde a generateContent e streamGenerateContent (SSE) no formato do
+Gemini, com atraso configurável (antes da resposta e entre partes) e uma
+fração de pedidos que falham com 503.
+
+Uso:
+    python fake_llm.py --port 8089 --latency 0.5 --fail-rate 0.2
+    GEMINI_API_ENDPOINT=http://127.0.0.1:8089 uvicorn main:app
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+FAKE_TEXT = "Explicação de teste gerada pelo servidor falso."
+
+
+class FakeLLMConfig:
+    """Comportamento do servidor (alterável durante os testes)"""
+
+    def __init__(self, latency: float = 0.0, chunk_delay: float = 0.0, fail_rate: float = 0.0,
+                 text: str = FAKE_TEXT, chunks: int = 3):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.fail_rate = fail_rate
+        self.text = text
+        self.chunks = chunks
+        self.requests = 0
+
+
+def _response(text: str) -> Dict:
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    config: FakeLLMConfig
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        config = self.config
+        config.requests += 1
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(config.latency)
+
+        if random.random() < config.fail_rate:
+            body = json.dumps({"error": {"code": 503, "message": "fake overload", "status": "UNAVAILABLE"}}).encode()
+            self.send_response(503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if ":streamGenerateContent" in self.path:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            words = config.text.split(" ")
+            size = max(1, -(-len(words) // config.chunks))
+            for start in range(0, len(words), size):
+                text = " ".join(words[start:start + size]) + (" " if start + size < len(words) else "")
+                self.wfile.write(f"data: {json.dumps(_response(text), ensure_ascii=False)}\r\n\r\n".encode())
+                self.wfile.flush()
+                time.sleep(config.chunk_delay)
+            return
+
+        body = json.dumps(_response(config.text), ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_fake_llm(port: int = 0, config: FakeLLMConfig = None) -> Tuple[ThreadingHTTPServer, str]:
+    """Arranca o servidor numa thread; devolve (servidor, endpoint)"""
+    handler = type("FakeLLMHandler", (_Handler,), {"config": config or FakeLLMConfig()})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor falso da API do Gemini")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Atraso (s) antes de responder")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Atraso (s) entre partes em streaming")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fração de pedidos que falham com 503")
+    args = parser.parse_args()
+
+    server, endpoint = start_fake_llm(args.port, FakeLLMConfig(args.latency, args.chunk_delay, args.fail_rate))
+    print(f"Fake Gemini em {endpoint} (GEMINI_API_ENDPOINT={endpoint})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
+
+
+# Testes (executar com pytest -v)
+def test_enhancer_degrades_on_timeout_and_open_circuit(monkeypatch):
+    import asyncio
+    from ai_enhancer import AIEnhancer
+    from resilience import CircuitBreaker, Deadline
+
+    config = FakeLLMConfig()
+    server, endpoint = start_fake_llm(config=config)
+    monkeypatch.setenv("GEMINI_API_ENDPOINT", endpoint)
+    try:
+        ai = AIEnhancer()
+        ai.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        diagnosis = {"category": "Cardiologia", "urgency": "Alta", "alerts": ["Possível evento cardíaco"]}
+        medical_info = {"relevant_info": [{"id": 1, "title": "Dor torácica", "text": "Avaliar ECG em 10 minutos."}],
+                        "recommendation": "Procurar a urgência"}
+
+        async def run():
+            ok = await ai.enhance_response_async(diagnosis, medical_info, "dor no peito", use_cache=False)
+            assert ok.text == FAKE_TEXT and not ok.degraded
+            parts = [p async for p in ai.stream_response_async(diagnosis, medical_info, "dor no peito", use_cache=False)]
+            assert "".join(p.text for p in parts) == FAKE_TEXT
+
+            config.latency = 0.5
+            start = time.perf_counter()
+            slow = await ai.enhance_response_async(diagnosis, medical_info, "dor no peito", False, Deadline(0.4))
+            assert time.perf_counter() - start < 0.45
+            # Orçamento do pedido esgotado: não é falha do Gemini
+            assert slow.degraded and slow.reason == "deadline" and "Avaliar ECG" in slow.text
+            assert ai.breaker.stats()["consecutive_failures"] == 0
+
+            monkeypatch.setattr("ai_enhancer.LLM_TIMEOUT", 0.3)
+            timed_out = await ai.enhance_response_async(diagnosis, medical_info, "dor no peito", use_cache=False)
+            assert timed_out.reason == "timeout" and ai.breaker.stats()["consecutive_failures"] == 1
+
+            config.latency, config.fail_rate = 0.0, 1.0
+            failed = await ai.enhance_response_async(diagnosis, medical_info, "dor no peito", use_cache=False)
+            assert failed.reason == "error" and ai.breaker.state == "open"
+
+            before = config.requests
+            rejected = await ai.enhance_response_async(diagnosis, medical_info, "dor no peito", use_cache=False)
+            assert rejected.reason == "circuit_open" and config.requests == before
+
+        asyncio.run(run())
+        assert ai.stats()["degraded"] == {"deadline": 1, "timeout": 1, "error": 1, "circuit_open": 1}
+    finally:
+        server.shutdown()
@@ -0,0 +1,209 @@
+import re
+import time
+from typing import Dict, FrozenSet, Hashable, List, NamedTuple, Optional, Set, Tuple
+
+_WORDS = re.compile(r"\w+")
+# Frases mais curtas só por correspondência exata: a uma edição de distância
+# estão palavras comuns ("never" -> "fever", "rush" -> "rash", "hiv")
+MIN_FUZZY_LENGTH = 7
+# Máximo de edições aceite (frases mais longas que MIN_FUZZY_LENGTH)
+MAX_EDITS = 2
+# Janelas memorizadas (o vocabulário das queixas repete-se muito)
+WINDOW_CACHE_SIZE = 50_000
+
+
+class FuzzyMatch(NamedTuple):
+    phrase: str        # frase normalizada da tabela
+    text: str          # janela do texto que lhe corresponde
+    distance: int      # distância de edição
+    score: float       # 1 - distância / comprimento da frase
+    payload: Hashable
+
+
+def max_edits(length: int) -> int:
+    """Distância máxima aceite para uma frase com este comprimento"""
+    if length < MIN_FUZZY_LENGTH:
+        return 0
+    return 1 if length <= 7 else MAX_EDITS
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> Optional[int]:
+    """Distância de edição entre a e b, ou None se exceder `limit`"""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            row_min = min(row_min, current[j])
+        if row_min > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+class FuzzyPhraseIndex:
+    """
+    Índice de trigramas de caracteres sobre frases já normalizadas.
+
+    Para cada janela de palavras do texto (com o número de palavras de
+    alguma frase e comprimento compatível), os candidatos vêm do índice
+    invertido, separado por comprimento da frase, e só passam os que
+    partilham trigramas suficientes para estarem a `max_edits` edições
+    (cada edição altera no máximo 3 trigramas); a distância é depois
+    confirmada com Levenshtein limitado. O resultado de cada janela é
+    memorizado.
+
+    Janelas só com palavras conhecidas (corretamente escritas, ver
+    `known_words` no ficheiro de regras) não são corrigidas: uma palavra
+    que existe não é um erro de escrita ("tortura" não é "tontura").
+    """
+
+    def __init__(self, known_words: FrozenSet[str] = frozenset()):
+        self.known_words = known_words
+        self._phrases: List[str] = []
+        self._payloads: List[List[Hashable]] = []
+        self._grams: List[Set[str]] = []
+        # (trigrama, comprimento da frase) -> frases
+        self._postings: Dict[Tuple[str, int], List[int]] = {}
+        # Número de palavras -> (comprimento mínimo, máximo) das frases
+        self._lengths: Dict[int, Tuple[int, int]] = {}
+        self._ids: Dict[str, int] = {}
+        self._window_cache: Dict[str, List[Tuple[int, FuzzyMatch]]] = {}
+
+    def add(self, phrase: str, payload: Hashable) -> None:
+        """Adiciona uma frase (já normalizada); frases curtas são ignoradas"""
+        if max_edits(len(phrase)) == 0:
+            return
+        phrase_id = self._ids.get(phrase)
+        if phrase_id is None:
+            phrase_id = self._ids[phrase] = len(self._phrases)
+            self._phrases.append(phrase)
+            self._payloads.append([])
+            grams = _trigrams(phrase)
+            self._grams.append(grams)
+            for gram in grams:
+                self._postings.setdefault((gram, len(phrase)), []).append(phrase_id)
+            count = len(phrase.split())
+            shortest, longest = self._lengths.get(count, (len(phrase), len(phrase)))
+            self._lengths[count] = (min(shortest, len(phrase)), max(longest, len(phrase)))
+            self._window_cache.clear()
+        self._payloads[phrase_id].append(payload)
+
+    def __len__(self) -> int:
+        return len(self._phrases)
+
+    def search(self, text: str, budget: float = 0.002, exclude: Set[str] = frozenset()) -> Dict:
+        """
+        Procura frases aproximadas no texto (já normalizado)
+
+        Args:
+            budget: Tempo máximo (s); ao esgotar devolve o que já encontrou
+            exclude: Frases a ignorar (ex.: já encontradas exatamente)
+
+        Returns:
+            {"matches": [FuzzyMatch], "truncated": bool}
+        """
+        deadline = time.perf_counter() + budget
+        words = _WORDS.findall(text)
+        known = [word in self.known_words for word in words]
+        best: Dict[int, FuzzyMatch] = {}
+        truncated = False
+
+        for start in range(len(words)):
+            for count, (shortest, longest) in self._lengths.items():
+                if start + count > len(words) or all(known[start:start + count]):
+                    continue
+                window = " ".join(words[start:start + count])
+                if not shortest - MAX_EDITS <= len(window) <= longest + MAX_EDITS:
+                    continue
+                found = self._match_window(window, deadline)
+                if found is None:
+                    truncated = True
+                    break
+                for phrase_id, match in found:
+                    current = best.get(phrase_id)
+                    if self._phrases[phrase_id] not in exclude and (current is None or match.score > current.score):
+                        best[phrase_id] = match
+            if truncated:
+                break
+
+        matches = []
+        for phrase_id, match in sorted(best.items(), key=lambda item: -item[1].score):
+            for payload in self._payloads[phrase_id]:
+                matches.append(match._replace(payload=payload))
+        return {"matches": matches, "truncated": truncated}
+
+    def _match_window(self, window: str, deadline: float) -> Optional[List[Tuple[int, FuzzyMatch]]]:
+        """Frases a que a janela corresponde, ou None se o orçamento esgotar"""
+        cached = self._window_cache.get(window)
+        if cached is not None:
+            return cached
+        if len(window) < MIN_FUZZY_LENGTH - MAX_EDITS:
+            return []
+        grams = _trigrams(window)
+        candidates: Set[int] = set()
+        for length in range(len(window) - MAX_EDITS, len(window) + MAX_EDITS + 1):
+            limit = max_edits(length)
+            if abs(length - len(window)) > limit:
+                continue
+            # Filtro por prefixo: quem partilha pelo menos `needed` trigramas
+            # tem de conter um dos (len - needed + 1) mais raros
+            needed = len(grams) - 3 * limit
+            rarest = sorted(grams, key=lambda gram: len(self._postings.get((gram, length), ())))
+            for gram in rarest[:len(grams) - needed + 1] if needed > 0 else rarest:
+                candidates.update(self._postings.get((gram, length), ()))
+
+        found = []
+        for phrase_id in candidates:
+            if time.perf_counter() > deadline:
+                return None
+            phrase = self._phrases[phrase_id]
+            limit = max_edits(len(phrase))
+            phrase_grams = self._grams[phrase_id]
+            if len(grams & phrase_grams) < max(len(grams), len(phrase_grams)) - 3 * limit:
+                continue
+            distance = bounded_levenshtein(window, phrase, limit)
+            if distance is not None:
+                found.append((phrase_id, FuzzyMatch(phrase, window, distance, round(1 - distance / len(phrase), 3), None)))
+
+        if len(self._window_cache) >= WINDOW_CACHE_SIZE:
+            self._window_cache.clear()
+        self._window_cache[window] = found
+        return found
+
+
+# Testes (executar com pytest -v)
+def test_fuzzy_index_tolerates_typos_within_bounds():
+    index = FuzzyPhraseIndex(known_words=frozenset("i never felt like this tenho tortura nas".split()))
+    index.add("dor no peito", ("symptom", "Cardiologia"))
+    index.add("dor no peito", ("red_flag", "Possível evento cardíaco"))
+    index.add("palpitacoes", ("symptom", "Cardiologia"))
+    index.add("hiv", ("symptom", "Doenças e Infeções"))
+    index.add("fever", ("symptom", "Doenças e Infeções"))
+    index.add("tontura", ("symptom", "Cardiologia"))
+
+    result = index.search("tenho dor no peitu e palpitassoes desde ontem")
+    found = {(m.phrase, m.payload) for m in result["matches"]}
+    assert ("dor no peito", ("red_flag", "Possível evento cardíaco")) in found
+    assert ("palpitacoes", ("symptom", "Cardiologia")) in found
+    assert not result["truncated"]
+
+    assert index.search("dor nas costas")["matches"] == []
+    # Frases curtas só por correspondência exata; palavras conhecidas não são corrigidas
+    assert index.search("hiu positivo")["matches"] == []
+    assert index.search("i never felt like this")["matches"] == []
+    assert index.search("tenho tortura nas costas")["matches"] == []
+    assert [m.phrase for m in index.search("tenho tontra")["matches"]] == ["tontura"]
+    # Sem a lista de palavras conhecidas, "tortura" passaria por "tontura"
+    unguarded = FuzzyPhraseIndex()
+    unguarded.add("tontura", ("symptom", "Cardiologia"))
+    assert [m.phrase for m in unguarded.search("tenho tortura nas costas")["matches"]] == ["tontura"]
+    assert bounded_levenshtein("peito", "peitu", 1) == 1 and bounded_levenshtein("peito", "pulso", 1) is None
@@ -0,0 +1,78 @@
+import json
+import asyncio
+from typing import AsyncIterator, Dict, NamedTuple, Optional
+
+
+class GeminiText(NamedTuple):
+    """Resposta (ou parte, em streaming) com o atributo `text` do SDK"""
+    text: str
+
+
+def _payload(prompt: str) -> Dict:
+    return {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+
+
+def _text(data: Dict) -> str:
+    """Texto do primeiro candidato de uma resposta generateContent"""
+    candidates = data.get("candidates") or [{}]
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+
+class GeminiRestModel:
+    """
+    Cliente mínimo da API REST do Gemini (generateContent e
+    streamGenerateContent por SSE), com a interface do GenerativeModel do
+    google.generativeai usada pelo AIEnhancer. Permite apontar o serviço a
+    outro endpoint com GEMINI_API_ENDPOINT, por exemplo o servidor falso de
+    fake_llm.py em testes de latência e de falhas.
+
+    Requer o httpx (importado só quando este cliente é usado).
+    """
+
+    def __init__(self, endpoint: str, model_name: str, api_key: Optional[str] = None, timeout: float = 60.0):
+        import httpx
+        self._httpx = httpx
+        self.base_url = f"{endpoint.rstrip('/')}/v1beta/models/{model_name}"
+        self.headers = {"x-goog-api-key": api_key} if api_key else {}
+        self.timeout = timeout
+        # Um cliente assíncrono (e pool de ligações) por event loop
+        self._async_client = None
+        self._async_loop = None
+
+    def _timeout(self, request_options: Optional[Dict]) -> float:
+        return (request_options or {}).get("timeout") or self.timeout
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_client = self._httpx.AsyncClient(headers=self.headers)
+            self._async_loop = loop
+        return self._async_client
+
+    def generate_content(self, prompt: str, request_options: Optional[Dict] = None) -> GeminiText:
+        response = self._httpx.post(
+            f"{self.base_url}:generateContent", json=_payload(prompt),
+            headers=self.headers, timeout=self._timeout(request_options)
+        )
+        response.raise_for_status()
+        return GeminiText(_text(response.json()))
+
+    async def generate_content_async(self, prompt: str, stream: bool = False, request_options: Optional[Dict] = None):
+        if stream:
+            return self._stream(prompt, self._timeout(request_options))
+        response = await self._client().post(
+            f"{self.base_url}:generateContent", json=_payload(prompt), timeout=self._timeout(request_options)
+        )
+        response.raise_for_status()
+        return GeminiText(_text(response.json()))
+
+    async def _stream(self, prompt: str, timeout: float) -> AsyncIterator[GeminiText]:
+        async with self._client().stream(
+            "POST", f"{self.base_url}:streamGenerateContent", params={"alt": "sse"},
+            json=_payload(prompt), timeout=timeout
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    yield GeminiText(_text(json.loads(line[5:])))
@@ -2,6 +2,7 @@
 from decision_trees import MedicalDecisionTree
 from singlestore_client import SingleStoreMed
 from ai_enhancer import AIEnhancer
+from log_config import setup_logging
 import os
 import time
 import sys
@@ -9,6 +10,7 @@ from dotenv import load_dotenv
 
 # Configuração inicial
 load_dotenv()
+setup_logging()
 
 def clear_screen():
     """Limpa o terminal de forma multiplataforma"""
@@ -0,0 +1,237 @@
+import os
+import copy
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+# Id do pedido em curso (definido pelo RequestIdMiddleware)
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# Atributos padrão de um LogRecord (os restantes vêm de `extra` e vão para o JSON)
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id", "sampled"}
+
+_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+_stats = {"queued": 0, "dropped_queue_full": 0, "dropped_sampled": 0, "dropped_rate_limited": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str) -> None:
+    """Incrementa um contador (chamado a partir de qualquer thread que registe)"""
+    with _stats_lock:
+        _stats[name] += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registo, com o id do pedido e os campos de `extra`"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ContextFilter(logging.Filter):
+    """
+    Corre na thread que regista: anexa o id do pedido e aplica amostragem
+    (registos INFO com extra={"sampled": True}) e limite de INFO por segundo.
+    Avisos e erros passam sempre.
+    """
+
+    def __init__(self, sample_rate: float, max_info_per_second: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.max_info_per_second = max_info_per_second
+        self._tokens = max_info_per_second
+        self._last = time.monotonic()
+        self._bucket_lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        if record.levelno > logging.INFO:
+            return True
+        if getattr(record, "sampled", False) and random.random() >= self.sample_rate:
+            _count("dropped_sampled")
+            return False
+        if self.max_info_per_second > 0:
+            with self._bucket_lock:
+                now = time.monotonic()
+                self._tokens = min(self.max_info_per_second, self._tokens + (now - self._last) * self.max_info_per_second)
+                self._last = now
+                if self._tokens < 1:
+                    _count("dropped_rate_limited")
+                    return False
+                self._tokens -= 1
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Nunca espera: com a fila cheia o registo é descartado (e contado)"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formata a mensagem já (os argumentos podem mudar depois), mas
+        # mantém os campos estruturados para o JsonFormatter. Altera uma
+        # cópia: o registo original pode ainda ir para outros handlers
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            _count("queued")
+        except queue.Full:
+            _count("dropped_queue_full")
+
+
+def setup_logging(path: Optional[str] = None, level: Optional[str] = None) -> None:
+    """
+    Configura o logging partilhado (uma só vez por processo): os módulos
+    registam numa fila e uma thread escreve JSON em LOG_FILE.
+
+    Variáveis: LOG_FILE, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATE (fração
+    dos INFO marcados como amostrados que é escrita), LOG_INFO_PER_SECOND.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        file_handler = logging.FileHandler(path or os.getenv('LOG_FILE', 'medical_system.log'), encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+
+        log_queue: "queue.Queue" = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+        handler = _NonBlockingQueueHandler(log_queue)
+        handler.addFilter(_ContextFilter(
+            sample_rate=float(os.getenv('LOG_SAMPLE_RATE', '0.01')),
+            max_info_per_second=float(os.getenv('LOG_INFO_PER_SECOND', '200'))
+        ))
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(level or os.getenv('LOG_LEVEL', 'INFO'))
+
+        _listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Escreve os registos pendentes e para a thread de escrita"""
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            if isinstance(existing, _NonBlockingQueueHandler):
+                root.removeHandler(existing)
+
+
+def logging_stats() -> Dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    return {**stats, "active": _listener is not None}
+
+
+class RequestIdMiddleware:
+    """
+    Middleware ASGI: usa o cabeçalho X-Request-ID (ou gera um id), guarda-o
+    em request_id_var durante o pedido e devolve-o na resposta
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or os.urandom(16).hex()
+        token = request_id_var.set(request_id)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
+
+
+# Testes (executar com pytest -v)
+def test_json_records_with_request_id_and_sampling(tmp_path, monkeypatch):
+    monkeypatch.setenv("LOG_SAMPLE_RATE", "0")
+    path = tmp_path / "app.log"
+    setup_logging(str(path), "INFO")
+    try:
+        token = request_id_var.set("abc123")
+        logging.info("Avaliação concluída", extra={"sampled": True, "category": "Cardiologia"})
+        logging.info("Pedido %s tratado", 7, extra={"category": "Neurologia"})
+        try:
+            raise ValueError("falha")
+        except ValueError:
+            logging.error("Erro", exc_info=True)
+        request_id_var.reset(token)
+    finally:
+        shutdown_logging()
+
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [r["message"] for r in records] == ["Pedido 7 tratado", "Erro"]
+    assert records[0]["request_id"] == "abc123" and records[0]["category"] == "Neurologia"
+    assert "ValueError: falha" in records[1]["exception"]
+    assert logging_stats()["dropped_sampled"] >= 1
+
+
+def test_prepare_leaves_the_callers_record_untouched():
+    import sys
+
+    handler = _NonBlockingQueueHandler(queue.Queue())
+    try:
+        raise ValueError("falha")
+    except ValueError:
+        record = logging.LogRecord("t", logging.ERROR, __file__, 1, "Pedido %s", (7,), sys.exc_info())
+    prepared = handler.prepare(record)
+    assert prepared is not record and prepared.msg == "Pedido 7" and prepared.exc_info is None
+    assert record.msg == "Pedido %s" and record.args == (7,) and record.exc_info is not None
+
+
+def test_counters_are_thread_safe():
+    before = logging_stats()["queued"]
+    threads = [threading.Thread(target=lambda: [_count("queued") for _ in range(10_000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert logging_stats()["queued"] - before == 40_000
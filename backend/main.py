@@ -1,25 +1,64 @@
 #!/usr/bin/env python3
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from decision_trees import MedicalDecisionTree
-from singlestore_client import SingleStoreMed
-from ai_enhancer import AIEnhancer
+from singlestore_client import SPECIALTY_ROUTING_MIN_CONFIDENCE, SingleStoreMed
+from ai_enhancer import AIEnhancer, Explanation
+from startup import StartupState
+from telemetry import Telemetry, create_exporter
+from resilience import Deadline, within
+from admission import AdmissionRejected, AdmissionTicket, PriorityAdmission
+from embedding_server import process_memory
+from log_config import RequestIdMiddleware, logging_stats, request_id_var, setup_logging, shutdown_logging
+import contextvars
 import os
+import json
+import math
 import time
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
 from dotenv import load_dotenv
-from typing import Optional
+from typing import List, Optional
 
 # Configuração
 load_dotenv()
-logging.basicConfig(
-    filename='medical_system.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Logging partilhado: JSON com o id do pedido, escrito por uma thread (LOG_FILE)
+setup_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Arranque: o aquecimento corre em segundo plano para o processo aceitar
+    sondas de imediato; /api/ready só responde 200 quando terminar.
+    Com WARMUP_BLOCKING=1 o servidor só aceita pedidos depois da primeira
+    passagem do aquecimento (passos falhados continuam a ser repetidos).
+    """
+    warmed = asyncio.Event()
+    warmup = asyncio.ensure_future(_warm_up(warmed))
+    # Regras clínicas recarregadas a quente quando o ficheiro muda (0 desativa)
+    tree.start_watching(float(os.getenv('RULES_RELOAD_SECONDS', '30')))
+    if os.getenv('WARMUP_BLOCKING', '0') == '1':
+        await warmed.wait()
+    yield
+    warmup.cancel()
+    tree.stop_watching()
+    db.engine.close()
+    cpu_executor.shutdown(wait=False)
+    io_executor.shutdown(wait=False)
+    telemetry.close()
+    ai.cache.close()
+    shutdown_logging()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# X-Request-ID em cada pedido/resposta (e nos registos de log)
+app.add_middleware(RequestIdMiddleware)
 
 # Configuração CORS para permitir conexão com o frontend
 app.add_middleware(
@@ -34,59 +73,526 @@ class SymptomsRequest(BaseModel):
     symptoms: str
     history: Optional[str] = "Não informado"
     age: Optional[int] = 0
+    use_cache: Optional[bool] = True  # False força uma nova geração do LLM
+
+class BatchTriageRequest(BaseModel):
+    cases: List[SymptomsRequest]
 
-# Inicialização dos componentes (singleton)
+# Número máximo de casos aceites por pedido em lote
+MAX_BATCH_SIZE = 500
+
+# Inicialização dos componentes (singleton). São baratos de construir: o
+# modelo de embeddings e o cliente do Gemini só são carregados no aquecimento.
 tree = MedicalDecisionTree()
 db = SingleStoreMed()
 ai = AIEnhancer()
 
+# Latência por etapa: histogramas em /metrics, Server-Timing e spans
+telemetry = Telemetry(create_exporter())
+
+# Estado de prontidão por componente (ver _warm_up e /api/ready)
+startup = StartupState()
+# Ping à base de dados no aquecimento (conta para a prontidão)
+WARMUP_DB_PING = os.getenv('WARMUP_DB_PING', '1') == '1'
+startup.register("embedding_model")
+startup.register("embedding_warmup")
+startup.register("decision_tree")
+startup.register("llm_client")
+if WARMUP_DB_PING:
+    startup.register("database")
+if db.engine.vector_index_enabled:
+    startup.register("vector_index")
+# Sem centróides a triagem funciona na mesma (só sem especialidades sugeridas)
+startup.register("specialty_centroids", required=False)
+# Espera (s) antes de repetir passos falhados do aquecimento, duplicada a
+# cada tentativa até ao máximo: falhas transitórias não deixam o pod em 503
+WARMUP_RETRY_DELAY = float(os.getenv('WARMUP_RETRY_DELAY_SECONDS', '1'))
+WARMUP_RETRY_MAX_DELAY = float(os.getenv('WARMUP_RETRY_MAX_DELAY_SECONDS', '60'))
+
+# Executores dimensionados: CPU (embeddings, o torch liberta o GIL) e I/O
+# bloqueante (driver SingleStore). O Gemini usa o cliente assíncrono.
+cpu_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('CPU_WORKERS', str(min(4, os.cpu_count() or 1)))),
+    thread_name_prefix="cpu"
+)
+io_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('IO_WORKERS', '16')),
+    thread_name_prefix="io"
+)
+# Limite de chamadas simultâneas ao LLM na triagem em lote
+BATCH_LLM_CONCURRENCY = int(os.getenv('BATCH_LLM_CONCURRENCY', '8'))
+# Orçamento de latência (SLO) de cada pedido: ao esgotar, a recuperação e o
+# LLM deixam de ser esperados e a resposta degrada para o diagnóstico
+# determinístico e os excertos já obtidos ("degraded": true)
+TRIAGE_DEADLINE = float(os.getenv('TRIAGE_DEADLINE_MS', '8000')) / 1000
+BATCH_TRIAGE_DEADLINE = float(os.getenv('BATCH_TRIAGE_DEADLINE_MS', '30000')) / 1000
+# Parte máxima do orçamento para embedding + pesquisa (o resto fica para o LLM)
+RETRIEVAL_TIMEOUT = float(os.getenv('RETRIEVAL_TIMEOUT_MS', '3000')) / 1000
+# Informação médica quando a recuperação não termina a tempo
+EMPTY_MEDICAL_INFO = {'relevant_info': [], 'sources': [], 'recommendation': "Consultar um médico para avaliação"}
+
+# Admissão das etapas caras (embedding, pesquisa, LLM) por urgência: os casos
+# "Alta" têm lugares reservados e passam à frente na fila; os restantes são
+# recusados com 429 (fila cheia) ou 503 (espera acima de QUEUE_MAX_WAIT)
+admission = PriorityAdmission(
+    max_concurrent=int(os.getenv('TRIAGE_MAX_CONCURRENT', '32')),
+    max_queue=int(os.getenv('TRIAGE_MAX_QUEUE', '64')),
+    reserved_urgent=int(os.getenv('TRIAGE_RESERVED_URGENT', '4'))
+)
+QUEUE_MAX_WAIT = float(os.getenv('TRIAGE_QUEUE_WAIT_MS', '2000')) / 1000
+
+# O contexto (id do pedido) é copiado para as threads dos executores
+async def _run_cpu(func, *args, **kwargs):
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, partial(context.run, func, *args, **kwargs))
+
+async def _run_io(func, *args, **kwargs):
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(io_executor, partial(context.run, func, *args, **kwargs))
+
+async def _embed(text: str):
+    """Embedding da query: micro-lotes se ativos, senão no executor de CPU"""
+    if db.engine.batcher is not None:
+        return await db.engine.generate_embedding_async(text)
+    return await _run_cpu(db.engine.generate_embedding, text)
+
+async def _warm_up(warmed: asyncio.Event):
+    """
+    Carrega e exercita cada componente, registando os tempos de carregamento.
+    Passos falhados (ex.: base de dados ainda indisponível) são repetidos
+    com espera exponencial até WARMUP_RETRY_MAX_DELAY, até ficarem prontos.
+    """
+    async def decision_tree():
+        tree.evaluate("dor no peito e febre alta", "Não informado", 40)
+
+    steps = {
+        "database": lambda: _run_io(db.engine.ping),
+        "vector_index": lambda: _run_io(db.engine.init_vector_index),
+        "specialty_centroids": lambda: _run_io(db.engine.init_specialty_centroids),
+        "embedding_model": lambda: _run_cpu(db.engine.load_embedding_model),
+        "embedding_warmup": lambda: _run_cpu(db.engine.warm_up),
+        "decision_tree": decision_tree,
+        "llm_client": lambda: _run_cpu(ai.load_model),
+    }
+
+    async def run(*names):
+        for name in names:
+            with startup.track(name):
+                await steps[name]()
+
+    database = ["database"] if WARMUP_DB_PING else []
+    if db.engine.vector_index_enabled:
+        database.append("vector_index")
+    # Depois do índice local: se existir, os centróides saem dele
+    await asyncio.gather(
+        run("embedding_model", "embedding_warmup"),
+        run("decision_tree", "llm_client"),
+        run(*database, "specialty_centroids"),
+    )
+    logging.info(f"Aquecimento concluído: {startup.snapshot()}")
+    warmed.set()
+
+    delay = WARMUP_RETRY_DELAY
+    while startup.failed():
+        logging.warning(f"Aquecimento: a repetir {startup.failed()} dentro de {delay:.0f}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, WARMUP_RETRY_MAX_DELAY)
+        # Pela ordem de registo (a base de dados antes do índice e dos centróides)
+        await run(*startup.failed())
+    logging.info("Aquecimento: todos os componentes prontos")
+
+def _validate_request(request: SymptomsRequest):
+    """Validação adicional dos dados de entrada"""
+    if len(request.symptoms.split()) < 3:
+        raise HTTPException(status_code=400, detail="Forneça pelo menos 3 palavras para descrever os sintomas")
+    
+    if request.age < 0:
+        raise HTTPException(status_code=400, detail="Idade não pode ser negativa")
+
+def _route(diagnosis: dict, query_embedding) -> tuple:
+    """
+    Especialidades sugeridas pelos centróides (um produto com o embedding já
+    calculado). Se a árvore de decisão não reconheceu sintomas, a pesquisa
+    usa a mais provável em vez da especialidade por omissão.
+
+    Returns:
+        (specialty_id para a pesquisa, especialidades ordenadas)
+    """
+    ranked = db.engine.route_specialty(query_embedding)
+    specialty_id = diagnosis['specialty_id']
+    if diagnosis.get('fallback') and ranked and ranked[0]['confidence'] >= SPECIALTY_ROUTING_MIN_CONFIDENCE:
+        specialty_id = ranked[0]['id']
+    return specialty_id, ranked
+
+async def _admit(urgency: str, deadline: Deadline) -> Optional[AdmissionTicket]:
+    """
+    Lugar na fila de admissão, com a prioridade da urgência do caso.
+    Casos "Alta" nunca são recusados: esperam até ao fim do orçamento e, se
+    mesmo assim não houver lugar, devolve None (resposta degradada, só com o
+    diagnóstico). Os restantes recebem HTTPException 429/503 com Retry-After.
+    """
+    urgent = admission.priority(urgency) == 0
+    try:
+        ticket = await admission.acquire(urgency, deadline.budget(None if urgent else QUEUE_MAX_WAIT))
+    except AdmissionRejected as e:
+        if urgent:
+            logging.warning("Caso urgente sem lugar dentro do orçamento: resposta degradada")
+            return None
+        telemetry.metrics.count_rejected(admission.level(urgency), str(e.status_code))
+        raise HTTPException(
+            status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+    telemetry.metrics.observe_queue_wait(ticket.urgency, ticket.waited)
+    return ticket
+
+def _unadmitted(diagnosis: dict) -> tuple:
+    """Resposta de um caso urgente que não obteve lugar: diagnóstico determinístico"""
+    medical_info = dict(EMPTY_MEDICAL_INFO)
+    explanation = Explanation(ai.fallback_explanation(diagnosis, medical_info), True, "queue_timeout")
+    return [], medical_info, ["queue_timeout"], explanation
+
+async def _retrieve(trace, deadline: Deadline, diagnosis: dict, symptoms: str, embedding_task) -> tuple:
+    """
+    Embedding, encaminhamento e pesquisa, limitados por RETRIEVAL_TIMEOUT e
+    pelo orçamento do pedido
+
+    Returns:
+        (especialidades sugeridas, informação médica, motivos de degradação)
+    """
+    async def retrieve():
+        query_embedding = await embedding_task
+        with trace.span("routing"):
+            specialty_id, ranked = _route(diagnosis, query_embedding)
+        with trace.span("db"):
+            medical_info = await _run_io(
+                db.get_medical_info,
+                specialty_id=specialty_id,
+                user_query=symptoms,
+                query_embedding=query_embedding
+            )
+        return ranked, medical_info
+
+    try:
+        ranked, medical_info = await within(deadline, retrieve(), RETRIEVAL_TIMEOUT)
+        return ranked, medical_info, []
+    except asyncio.TimeoutError:
+        logging.warning("Recuperação interrompida pelo orçamento do pedido")
+        return [], dict(EMPTY_MEDICAL_INFO), ["retrieval_timeout"]
+
+def _format_diagnosis(diagnosis: dict) -> dict:
+    return {
+        "category": diagnosis['category'],
+        "urgency": diagnosis['urgency'],
+        "alerts": diagnosis.get('alerts', [])
+    }
+
+def _format_routing(ranked: list) -> dict:
+    return {
+        "suggested_specialties": [
+            {"id": r['id'], "name": r['name'], "confidence": r['confidence']} for r in ranked
+        ]
+    }
+
+def _format_medical_info(medical_info: dict) -> dict:
+    return {
+        # Limita a 3 itens (texto = passagem ou resumo, nunca o documento inteiro)
+        "relevant_info": [
+            {
+                "id": info.get('id'),
+                "title": info.get('title'),
+                "text": info['text'],
+                "similarity": info.get('similarity')
+            }
+            for info in medical_info['relevant_info'][:3]
+        ],
+        "sources": list(medical_info['sources']),
+        "recommendation": medical_info['recommendation']
+    }
+
+def _format_triage_response(
+    diagnosis: dict,
+    medical_info: dict,
+    explanation: Explanation,
+    ranked: Optional[list] = None,
+    degraded: Optional[list] = None
+) -> dict:
+    """Formata a resposta para o frontend"""
+    return {
+        "diagnosis": {**_format_diagnosis(diagnosis), **_format_routing(ranked or [])},
+        "medical_info": _format_medical_info(medical_info),
+        "ai_explanation": explanation.text,
+        "degraded": bool(degraded),
+        "degraded_reasons": degraded or [],
+        "status": "success"
+    }
+
+def _sse(event: str, data: dict) -> str:
+    """Formata um evento Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @app.post("/api/triage")
 async def perform_triage(request: SymptomsRequest):
-    """Endpoint principal para a triagem médica"""
+    """
+    Endpoint principal para a triagem médica (responde dentro de
+    TRIAGE_DEADLINE). A urgência da árvore de decisão define a prioridade
+    na fila das etapas caras.
+    """
+    deadline = Deadline(TRIAGE_DEADLINE)
+    trace = telemetry.start("triage", request_id_var.get())
     try:
-        # Validação adicional
-        if len(request.symptoms.split()) < 3:
-            raise HTTPException(status_code=400, detail="Forneça pelo menos 3 palavras para descrever os sintomas")
-        
-        if request.age < 0:
-            raise HTTPException(status_code=400, detail="Idade não pode ser negativa")
-
-        # Processamento (mesma lógica do terminal)
-        diagnosis = tree.evaluate(request.symptoms, request.history, request.age)
-        medical_info = db.get_medical_info(
-            specialty_id=diagnosis['specialty_id'],
-            user_query=request.symptoms
-        )
-        ai_response = ai.enhance_response(
-            diagnosis=diagnosis,
-            medical_info=medical_info,
-            symptoms=request.symptoms
-        )
+        _validate_request(request)
 
-        # Formata a resposta para o frontend
-        return {
-            "diagnosis": {
-                "category": diagnosis['category'],
-                "urgency": diagnosis['urgency'],
-                "alerts": diagnosis.get('alerts', [])
-            },
-            "medical_info": {
-                "relevant_info": medical_info['relevant_info'][:3],  # Limita a 3 itens
-                "sources": [os.path.basename(s) for s in medical_info['sources']],
-                "recommendation": medical_info['recommendation']
-            },
-            "ai_explanation": ai_response,
-            "status": "success"
-        }
+        # A árvore de decisão custa microssegundos: corre no próprio loop
+        with trace.span("rules"):
+            diagnosis = tree.evaluate(request.symptoms, request.history, request.age)
 
+        with trace.span("queue", urgency=diagnosis['urgency']):
+            ticket = await _admit(diagnosis['urgency'], deadline)
+        if ticket is None:
+            ranked, medical_info, degraded, explanation = _unadmitted(diagnosis)
+        else:
+            async with ticket:
+                embedding_task = asyncio.ensure_future(
+                    trace.timed("embedding", _embed(request.symptoms))
+                )
+                ranked, medical_info, degraded = await _retrieve(
+                    trace, deadline, diagnosis, request.symptoms, embedding_task
+                )
+                with trace.span("llm"):
+                    explanation = await ai.enhance_response_async(
+                        diagnosis=diagnosis,
+                        medical_info=medical_info,
+                        symptoms=request.symptoms,
+                        use_cache=request.use_cache,
+                        deadline=deadline
+                    )
+                if explanation.degraded:
+                    degraded.append(f"llm_{explanation.reason}")
+
+        with trace.span("serialize"):
+            response = JSONResponse(_format_triage_response(diagnosis, medical_info, explanation, ranked, degraded))
+        response.headers["Server-Timing"] = trace.server_timing()
+        telemetry.finish(trace, degraded=degraded)
+        return response
+
+    except HTTPException as e:
+        telemetry.finish(trace, status=str(e.status_code))
+        raise
     except Exception as e:
+        telemetry.finish(trace, status="500")
         logging.error(f"Erro na triagem: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/triage/stream")
+async def perform_triage_stream(request: SymptomsRequest):
+    """
+    Triagem em streaming (Server-Sent Events).
+    Eventos, por ordem: "diagnosis", "routing" (especialidades sugeridas),
+    "sources", vários "token" com a explicação do Gemini à medida que é
+    gerada, e por fim "done" (ou "error"), com "degraded" se a recuperação
+    ou o LLM foram interrompidos pelo orçamento do pedido.
+    """
+    _validate_request(request)
+    deadline = Deadline(TRIAGE_DEADLINE)
+    trace = telemetry.start("triage_stream", request_id_var.get())
+
+    # Admissão antes de abrir o stream, para a recusa ser um 429/503 normal
+    with trace.span("rules"):
+        diagnosis = tree.evaluate(request.symptoms, request.history, request.age)
+    try:
+        with trace.span("queue", urgency=diagnosis['urgency']):
+            ticket = await _admit(diagnosis['urgency'], deadline)
+    except HTTPException as e:
+        telemetry.finish(trace, status=str(e.status_code))
+        raise
+
+    async def events():
+        # Os cabeçalhos já seguiram: as durações vão no evento "done"
+        try:
+            yield _sse("diagnosis", _format_diagnosis(diagnosis))
+            if ticket is None:
+                ranked, medical_info, degraded, explanation = _unadmitted(diagnosis)
+                yield _sse("routing", _format_routing(ranked))
+                yield _sse("sources", _format_medical_info(medical_info))
+                yield _sse("token", {"text": explanation.text})
+            else:
+                embedding_task = asyncio.ensure_future(
+                    trace.timed("embedding", _embed(request.symptoms))
+                )
+                ranked, medical_info, degraded = await _retrieve(
+                    trace, deadline, diagnosis, request.symptoms, embedding_task
+                )
+                yield _sse("routing", _format_routing(ranked))
+                yield _sse("sources", _format_medical_info(medical_info))
+
+                # Só o tempo de geração conta para "llm" (não o envio ao cliente)
+                stream = ai.stream_response_async(
+                    diagnosis=diagnosis,
+                    medical_info=medical_info,
+                    symptoms=request.symptoms,
+                    use_cache=request.use_cache,
+                    deadline=deadline
+                )
+                while True:
+                    try:
+                        with trace.span("llm"):
+                            part = await stream.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    if part.degraded:
+                        degraded.append(f"llm_{part.reason}")
+                    if part.text:
+                        yield _sse("token", {"text": part.text})
+                ticket.release()
+
+            timing = {name: round(seconds * 1000, 2) for name, seconds in trace.durations().items()}
+            telemetry.finish(trace, degraded=degraded)
+            yield _sse("done", {
+                "status": "success", "timing_ms": timing, "degraded": bool(degraded), "degraded_reasons": degraded
+            })
+
+        except Exception as e:
+            telemetry.finish(trace, status="500")
+            logging.error(f"Erro na triagem (stream): {str(e)}", exc_info=True)
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            if ticket is not None:
+                ticket.release()
+
+    # O lugar também é libertado se o cliente desligar antes de o stream começar
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(ticket.release) if ticket is not None else None
+    )
+
+@app.post("/api/triage/batch")
+async def perform_triage_batch(request: BatchTriageRequest):
+    """
+    Triagem de vários casos num só pedido.
+    Os embeddings são gerados num único lote e os documentos obtidos com o
+    mínimo de consultas à base de dados. Cada caso devolve o seu resultado
+    ou erro, pela mesma ordem de entrada. O lote partilha um orçamento de
+    BATCH_TRIAGE_DEADLINE; casos sem tempo para o LLM saem degradados.
+    A explicação de cada caso passa pela fila de admissão com a urgência do
+    caso (casos recusados devolvem 429/503 no seu resultado).
+    """
+    if len(request.cases) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Máximo de {MAX_BATCH_SIZE} casos por pedido")
+    deadline = Deadline(BATCH_TRIAGE_DEADLINE)
+    trace = telemetry.start("triage_batch", request_id_var.get())
+
+    results: List[Optional[dict]] = [None] * len(request.cases)
+    valid = []
+    for idx, case in enumerate(request.cases):
+        try:
+            _validate_request(case)
+            valid.append(idx)
+        except HTTPException as e:
+            results[idx] = {"status": "error", "status_code": e.status_code, "detail": e.detail}
+
+    try:
+        with trace.span("rules", cases=len(valid)):
+            diagnoses = tree.evaluate_batch([
+                {
+                    "symptoms": request.cases[idx].symptoms,
+                    "medical_history": request.cases[idx].history,
+                    "age": request.cases[idx].age
+                }
+                for idx in valid
+            ])
+        # Embeddings em lote e pesquisa agrupada numa só etapa; corre no
+        # executor de I/O (bloqueia sobretudo à espera da base de dados)
+        batch_degraded = []
+        with trace.span("embedding_db", cases=len(valid)):
+            try:
+                medical_infos = await within(deadline, _run_io(db.get_medical_info_batch, [
+                    (diagnosis['specialty_id'], request.cases[idx].symptoms)
+                    for idx, diagnosis in zip(valid, diagnoses)
+                ]))
+            except asyncio.TimeoutError:
+                logging.warning("Recuperação do lote interrompida pelo orçamento do pedido")
+                medical_infos = [dict(EMPTY_MEDICAL_INFO) for _ in valid]
+                batch_degraded.append("retrieval_timeout")
+    except Exception as e:
+        telemetry.finish(trace, status="500")
+        logging.error(f"Erro na triagem em lote: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    llm_slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    all_degraded = list(batch_degraded)
+
+    async def explain(idx: int, diagnosis: dict, medical_info: dict):
+        try:
+            degraded = list(batch_degraded)
+            async with llm_slots:
+                ticket = await _admit(diagnosis['urgency'], deadline)
+                if ticket is None:
+                    explanation = _unadmitted(diagnosis)[3]
+                    degraded.append("queue_timeout")
+                else:
+                    async with ticket:
+                        explanation = await ai.enhance_response_async(
+                            diagnosis=diagnosis,
+                            medical_info=medical_info,
+                            symptoms=request.cases[idx].symptoms,
+                            use_cache=request.cases[idx].use_cache,
+                            deadline=deadline
+                        )
+                    if explanation.degraded:
+                        degraded.append(f"llm_{explanation.reason}")
+            all_degraded.extend(degraded[len(batch_degraded):])
+            results[idx] = _format_triage_response(diagnosis, medical_info, explanation, degraded=degraded)
+        except HTTPException as e:
+            results[idx] = {"status": "error", "status_code": e.status_code, "detail": e.detail}
+        except Exception as e:
+            logging.error(f"Erro na triagem (caso {idx}): {str(e)}", exc_info=True)
+            results[idx] = {"status": "error", "status_code": 500, "detail": str(e)}
+
+    with trace.span("llm", cases=len(valid)):
+        await asyncio.gather(*(
+            explain(idx, diagnosis, medical_info)
+            for idx, diagnosis, medical_info in zip(valid, diagnoses, medical_infos)
+        ))
+
+    with trace.span("serialize"):
+        response = JSONResponse({"results": results, "status": "success"})
+    response.headers["Server-Timing"] = trace.server_timing()
+    telemetry.finish(trace, degraded=all_degraded)
+    return response
+
 @app.get("/api/health")
 async def health_check():
-    """Endpoint para verificar se a API está online"""
-    return {"status": "healthy", "version": "1.0"}
+    """Sonda de vida: a API está online (não implica que esteja aquecida)"""
+    return {
+        "status": "healthy",
+        "version": "1.0",
+        "rules": tree.rules.info(),
+        "specialty_centroids": db.engine.specialty_centroids.info(),
+        "fuzzy_matching": tree.fuzzy_stats(),
+        "ready": startup.ready,
+        "db_pool": db.engine.pool_stats(),
+        "embedding_cache": db.engine.embedding_cache.stats(),
+        "embedding_batcher": db.engine.batcher.stats() if db.engine.batcher is not None else None,
+        "document_cache": db.engine.document_cache.stats(),
+        "llm_cache": ai.cache.stats(),
+        "llm": ai.stats(),
+        "admission": admission.stats(),
+        "memory": {"pid": os.getpid(), **process_memory()},
+        "logging": logging_stats()
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Histogramas de latência por etapa (formato Prometheus)"""
+    return PlainTextResponse(telemetry.metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/ready")
+async def readiness_check():
+    """Sonda de prontidão: 200 só depois de todos os componentes aquecidos, senão 503"""
+    snapshot = startup.snapshot()
+    return JSONResponse(snapshot, status_code=200 if snapshot["ready"] else 503)
 
 if __name__ == "__main__":
     import uvicorn
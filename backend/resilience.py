@@ -0,0 +1,138 @@
+import time
+import asyncio
+import threading
+from typing import Callable, Dict, Optional
+
+
+class Deadline:
+    """
+    Orçamento de latência de um pedido (relógio monotónico), criado à
+    entrada do endpoint e passado às etapas seguintes
+    """
+
+    def __init__(self, seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.seconds = seconds
+        self._clock = clock
+        self.expires_at = clock() + seconds
+
+    def remaining(self) -> float:
+        """Tempo restante (s), nunca negativo"""
+        return max(0.0, self.expires_at - self._clock())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def budget(self, cap: Optional[float] = None) -> float:
+        """Tempo disponível para uma etapa: o restante, limitado a `cap`"""
+        remaining = self.remaining()
+        return remaining if cap is None else min(cap, remaining)
+
+
+async def within(deadline: Deadline, awaitable, cap: Optional[float] = None):
+    """
+    Espera pelo awaitable até ao fim do orçamento (asyncio.TimeoutError se
+    esgotar). Corrotinas são canceladas; trabalho já entregue a um executor
+    continua em segundo plano, mas o pedido deixa de esperar por ele.
+    """
+    return await asyncio.wait_for(awaitable, timeout=deadline.budget(cap))
+
+
+class CircuitBreaker:
+    """
+    Disjuntor para um serviço externo.
+
+    "closed": as chamadas passam; `failure_threshold` falhas seguidas abrem-no.
+    "open": as chamadas são recusadas durante `reset_timeout` segundos.
+    "half_open": passa uma única chamada de teste; sucesso fecha o disjuntor,
+    falha volta a abri-lo. Se o resultado do teste nunca chegar (ex.: pedido
+    cancelado), passa outro teste ao fim de `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._changed_at = clock()
+        self._stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow(self) -> bool:
+        """True se a chamada pode ser feita agora"""
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._clock() - self._changed_at >= self.reset_timeout:
+                # Chamada de teste (em "open" ou depois de um teste perdido)
+                self._state = "half_open"
+                self._changed_at = self._clock()
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self._state != "closed":
+                self._state = "closed"
+                self._changed_at = self._clock()
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == "half_open" or (self._state == "closed" and self._failures >= self.failure_threshold):
+                self._state = "open"
+                self._changed_at = self._clock()
+                self._stats["opened"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self._stats, "state": self._state, "consecutive_failures": self._failures}
+
+
+# Testes (executar com pytest -v)
+def test_breaker_opens_probes_and_closes():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    now[0] = 10.0
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow()  # uma só chamada de teste
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] = 20.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.stats() == {
+        "opened": 2, "rejected": 2, "state": "closed", "consecutive_failures": 0
+    }
+
+
+def test_deadline_bounds_awaitables():
+    async def slow():
+        await asyncio.sleep(1)
+
+    async def run():
+        deadline = Deadline(0.05)
+        try:
+            await within(deadline, slow())
+            assert False
+        except asyncio.TimeoutError:
+            pass
+        assert deadline.expired and deadline.budget(5) == 0
+
+    asyncio.run(run())
+    assert Deadline(10).budget(2) == 2
@@ -0,0 +1,274 @@
+import json
+import time
+import queue
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+class ResponseCache:
+    """
+    Cache de respostas do LLM com TTL e limite de tamanho (LRU).
+
+    A chave é uma impressão digital canónica do contexto clínico: categoria,
+    urgência, alertas ordenados, ids dos documentos recuperados e sintomas
+    normalizados. Opcionalmente guarda as respostas em SQLite; a tabela é
+    mantida abaixo de `max_disk_entries` (remove as que expiram primeiro).
+
+    Args:
+        max_entries: Número máximo de respostas em memória
+        ttl: Validade de cada resposta, em segundos
+        disk_path: Caminho do ficheiro SQLite (None desativa a persistência)
+        max_disk_entries: Número máximo de linhas na tabela em disco
+    """
+
+    # Escritas entre verificações do tamanho da tabela em disco
+    TRIM_EVERY = 256
+
+    def __init__(self, max_entries: int = 2000, ttl: float = 86400.0, disk_path: Optional[str] = None,
+                 max_disk_entries: int = 50_000, max_pending_writes: int = 10_000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0, "evictions": 0, "expired": 0,
+                       "disk_dropped": 0, "disk_evictions": 0}
+        self._disk_path = None
+        self._readers = threading.local()
+        self._writes: "queue.Queue" = queue.Queue(maxsize=max_pending_writes)
+        self._writer = None
+        if disk_path:
+            try:
+                db = sqlite3.connect(disk_path)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires_at REAL, text TEXT)"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+                db.commit()
+                db.close()
+            except sqlite3.Error as e:
+                logging.error(f"LLM response cache disk backend unavailable: {str(e)}")
+            else:
+                self._disk_path = disk_path
+                self._writer = threading.Thread(target=self._write_loop, name="response-cache-writer", daemon=True)
+                self._writer.start()
+
+    @staticmethod
+    def fingerprint(diagnosis: Dict, medical_info: Dict, symptoms: str) -> str:
+        """Impressão digital canónica do contexto clínico"""
+        canonical = [
+            diagnosis.get('category'),
+            diagnosis.get('urgency'),
+            sorted(diagnosis.get('alerts', [])),
+            sorted(str(info.get('id', info.get('title'))) for info in medical_info.get('relevant_info', [])),
+            " ".join(symptoms.lower().split())
+        ]
+        payload = json.dumps(canonical, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @property
+    def disk(self) -> bool:
+        """True se a persistência em SQLite estiver ativa"""
+        return self._disk_path is not None
+
+    def get(self, key: str) -> Optional[str]:
+        """Devolve a resposta em cache (se existir e não tiver expirado)"""
+        cached = self.get_memory(key)
+        return cached if cached is not None else self.get_disk(key)
+
+    def get_memory(self, key: str) -> Optional[str]:
+        """
+        Só a memória (seguro no event loop). Uma falha aqui não é contada:
+        segue-se get_disk, que a conta.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[1]
+            self._entries.pop(key, None)
+            if self._disk_path is None:
+                # Com disco, a linha (também expirada) é contada em get_disk
+                self._stats["expired"] += 1
+            return None
+
+    def get_disk(self, key: str) -> Optional[str]:
+        """Só o SQLite (bloqueante: fora do event loop), sem o lock da memória"""
+        row = None
+        if self._disk_path is not None:
+            try:
+                row = self._reader().execute(
+                    "SELECT expires_at, text FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logging.error(f"LLM response cache read failed: {str(e)}")
+        now = time.time()
+        with self._lock:
+            if row is not None and row[0] > now:
+                self._store(key, (row[0], row[1]))
+                self._stats["hits"] += 1
+                return row[1]
+            if row is not None:
+                self._stats["expired"] += 1
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, text: str) -> None:
+        """Guarda uma resposta com a validade configurada (a escrita em disco é feita em segundo plano)"""
+        entry = (time.time() + self.ttl, text)
+        with self._lock:
+            self._store(key, entry)
+        if self._disk_path is not None:
+            try:
+                self._writes.put_nowait((key, entry[0], text))
+            except queue.Full:
+                with self._lock:
+                    self._stats["disk_dropped"] += 1
+
+    def _reader(self) -> sqlite3.Connection:
+        db = getattr(self._readers, "db", None)
+        if db is None:
+            db = self._readers.db = sqlite3.connect(self._disk_path, check_same_thread=False)
+        return db
+
+    def _write_loop(self) -> None:
+        db = sqlite3.connect(self._disk_path)
+        since_trim = self.TRIM_EVERY
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < 512:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            rows = [item for item in batch if item is not None]
+            try:
+                if rows:
+                    db.executemany("INSERT OR REPLACE INTO responses (key, expires_at, text) VALUES (?, ?, ?)", rows)
+                    db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+                    since_trim += len(rows)
+                    if since_trim >= self.TRIM_EVERY:
+                        since_trim = 0
+                        self._trim(db)
+                    db.commit()
+            except sqlite3.Error as e:
+                logging.error(f"LLM response cache write failed: {str(e)}")
+            for _ in batch:
+                self._writes.task_done()
+            if len(rows) < len(batch):
+                db.close()
+                return
+
+    def _trim(self, db: sqlite3.Connection) -> None:
+        """Remove as linhas que expiram primeiro acima de max_disk_entries"""
+        excess = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            db.execute(
+                "DELETE FROM responses WHERE rowid IN "
+                "(SELECT rowid FROM responses ORDER BY expires_at LIMIT ?)",
+                (excess,)
+            )
+            with self._lock:
+                self._stats["disk_evictions"] += excess
+
+    def flush(self) -> None:
+        """Espera que as escritas pendentes cheguem ao disco"""
+        if self._writer is not None and self._writer.is_alive():
+            self._writes.join()
+
+    def close(self) -> None:
+        """Escreve o que estiver pendente e termina a thread de escrita"""
+        if self._writer is not None and self._writer.is_alive():
+            self._writes.put(None)
+            self._writer.join(timeout=5)
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def _store(self, key: str, entry: Tuple[float, str]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def stats(self) -> Dict:
+        """Contadores e taxa de acerto"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "disk": self._disk_path is not None,
+                "disk_pending": self._writes.qsize(),
+            }
+
+
+# Testes (executar com pytest -v)
+def test_fingerprint_is_canonical():
+    diagnosis = {"category": "Cardiologia", "urgency": "Alta", "alerts": ["b", "a"]}
+    info = {"relevant_info": [{"id": 2}, {"id": 1}]}
+    same = ResponseCache.fingerprint(
+        {**diagnosis, "alerts": ["a", "b"]},
+        {"relevant_info": [{"id": 1}, {"id": 2}]},
+        " Dor no   peito"
+    )
+    assert ResponseCache.fingerprint(diagnosis, info, "dor no peito") == same
+    assert ResponseCache.fingerprint(diagnosis, info, "febre") != same
+
+
+def test_cache_ttl_and_hit_rate():
+    cache = ResponseCache(max_entries=1, ttl=60)
+    cache.put("k", "explicação")
+    assert cache.get("k") == "explicação"
+    cache.put("k2", "outra")  # expulsa "k"
+    assert cache.get("k") is None
+    cache.ttl = -1
+    cache.put("k3", "expirada")
+    assert cache.get("k3") is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["expired"] == 1 and stats["evictions"] == 2
+
+
+def test_disk_tier_is_written_behind_and_survives_restart(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    cache = ResponseCache(disk_path=path)
+    cache.put("k", "explicação")
+    cache.flush()
+    assert ResponseCache(disk_path=path).get_disk("k") == "explicação"
+    cache.close()
+
+    restarted = ResponseCache(disk_path=path, ttl=-1)
+    assert restarted.get_memory("k") is None
+    assert restarted.get("k") == "explicação"
+    restarted.put("velha", "expirada")
+    restarted.close()
+    assert ResponseCache(disk_path=path).get("velha") is None
+
+
+def test_disk_tier_is_bounded(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    cache = ResponseCache(disk_path=path, max_disk_entries=2)
+    cache.TRIM_EVERY = 1
+    for key in ("a", "b", "c"):
+        cache.put(key, key.upper())
+        cache.flush()
+    cache.close()
+    assert cache.stats()["disk_evictions"] == 1
+
+    restarted = ResponseCache(disk_path=path)
+    assert restarted.get_disk("a") is None and restarted.get_disk("c") == "C"
+    restarted.close()
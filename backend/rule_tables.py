@@ -0,0 +1,207 @@
+import re
+import json
+import time
+import hashlib
+import unicodedata
+from typing import Dict, NamedTuple
+
+from specialties import resolve_specialty
+from symptom_matcher import SymptomMatcher
+from fuzzy_matcher import FuzzyPhraseIndex
+
+_COMBINING_MARKS = re.compile("[\u0300-\u036f]")
+_SPACES = re.compile(r"\s+")
+
+
+class RuleSetError(ValueError):
+    """Ficheiro de regras inválido (o conjunto em uso não é substituído)"""
+
+
+class CompiledRules(NamedTuple):
+    version: str
+    checksum: str
+    loaded_at: float
+    matcher: SymptomMatcher
+    fuzzy: FuzzyPhraseIndex
+    fallback_specialty: str
+    # Tabelas já validadas (frase original -> valor), para consulta
+    symptom_map: Dict[str, str]
+    red_flag_symptoms: Dict[str, str]
+    pediatric_red_flags: Dict[str, str]
+    duplicates: int
+
+    def info(self) -> Dict:
+        return {
+            "version": self.version,
+            "checksum": self.checksum[:12],
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)),
+            "symptoms": len(self.symptom_map),
+            "red_flags": len(self.red_flag_symptoms),
+            "pediatric_red_flags": len(self.pediatric_red_flags),
+            "duplicates_dropped": self.duplicates,
+            "known_words": len(self.fuzzy.known_words),
+        }
+
+
+def fold(text: str) -> str:
+    """Minúsculas, sem acentos e com espaços simples ("Convulsão" -> "convulsao")"""
+    text = text.casefold()
+    if not text.isascii():
+        text = _COMBINING_MARKS.sub("", unicodedata.normalize("NFKD", text))
+    return _SPACES.sub(" ", text)
+
+
+def load_rule_file(path: str) -> Dict:
+    """
+    Lê o ficheiro de regras versionado (JSON) e converte-o para tabelas
+    planas: os sintomas vêm agrupados por especialidade no ficheiro
+    """
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        data = json.loads(raw.decode("utf-8"))
+    except (OSError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise RuleSetError(f"Não foi possível ler {path}: {str(e)}")
+    if not isinstance(data, dict) or not isinstance(data.get("symptoms"), dict):
+        raise RuleSetError(f"{path}: esperado um objeto com 'symptoms' agrupados por especialidade")
+
+    symptom_map = {}
+    for specialty, phrases in data["symptoms"].items():
+        if not isinstance(phrases, list):
+            raise RuleSetError(f"{path}: 'symptoms.{specialty}' deve ser uma lista de frases")
+        for phrase in phrases:
+            if phrase in symptom_map and symptom_map[phrase] != specialty:
+                raise RuleSetError(f"Frase '{phrase}' atribuída a '{symptom_map[phrase]}' e '{specialty}'")
+            symptom_map[phrase] = specialty
+
+    return {
+        "version": data.get("version"),
+        "checksum": hashlib.sha256(raw).hexdigest(),
+        "fallback_specialty": data.get("fallback_specialty"),
+        "symptoms": symptom_map,
+        "red_flags": data.get("red_flags", {}),
+        "pediatric_red_flags": data.get("pediatric_red_flags", {}),
+        "known_words": data.get("known_words", []),
+    }
+
+
+def compile_rule_set(data: Dict) -> CompiledRules:
+    """
+    Valida as tabelas contra o registo de especialidades, normaliza as
+    frases (fold), remove duplicados e compila tudo num só autómato.
+    Frases que, normalizadas, apontam para especialidades diferentes são erro.
+    """
+    version = data.get("version")
+    if not isinstance(version, str) or not version.strip():
+        raise RuleSetError("O ficheiro de regras não tem 'version'")
+    fallback = resolve_specialty(data.get("fallback_specialty") or "Cirurgia Geral")
+    if fallback is None:
+        raise RuleSetError(f"fallback_specialty desconhecida: {data.get('fallback_specialty')}")
+
+    known_words = data.get("known_words") or []
+    if not isinstance(known_words, list) or not all(isinstance(word, str) and fold(word).strip() for word in known_words):
+        raise RuleSetError("'known_words' deve ser uma lista de palavras")
+    known_words = frozenset(fold(word).strip() for word in known_words)
+    if any(" " in word for word in known_words):
+        raise RuleSetError("'known_words' deve ter palavras isoladas, não frases")
+
+    matcher = SymptomMatcher()
+    fuzzy = FuzzyPhraseIndex(known_words)
+    tables = {}
+    duplicates = 0
+    for kind, key in (("symptom", "symptoms"), ("red_flag", "red_flags"), ("pediatric", "pediatric_red_flags")):
+        table = data.get(key) or {}
+        if not isinstance(table, dict):
+            raise RuleSetError(f"'{key}' deve mapear frases para valores")
+        validated, folded_values = {}, {}
+        for phrase, value in table.items():
+            if not isinstance(phrase, str) or not fold(phrase).strip():
+                raise RuleSetError(f"Frase vazia ou inválida em '{key}'")
+            if not isinstance(value, str) or not value.strip():
+                raise RuleSetError(f"Valor vazio para '{phrase}' em '{key}'")
+            if kind == "symptom":
+                specialty = resolve_specialty(value)
+                if specialty is None:
+                    raise RuleSetError(f"Especialidade desconhecida '{value}' (frase '{phrase}')")
+                value = specialty.name
+
+            folded = fold(phrase).strip()
+            if folded in known_words:
+                raise RuleSetError(f"'{phrase}' está em '{key}' e em 'known_words'")
+            if folded in folded_values:
+                if folded_values[folded] != value:
+                    raise RuleSetError(
+                        f"'{phrase}' coincide com outra frase de '{key}' após normalização, com valor diferente"
+                    )
+                duplicates += 1
+                continue
+            folded_values[folded] = value
+            validated[phrase] = value
+            matcher.add(folded, (kind, phrase, value))
+            fuzzy.add(folded, (kind, phrase, value))
+        tables[kind] = validated
+
+    return CompiledRules(
+        version=version.strip(),
+        checksum=data.get("checksum") or hashlib.sha256(
+            json.dumps({**tables, "known_words": sorted(known_words)}, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest(),
+        loaded_at=time.time(),
+        matcher=matcher.build(),
+        fuzzy=fuzzy,
+        fallback_specialty=fallback.name,
+        symptom_map=tables["symptom"],
+        red_flag_symptoms=tables["red_flag"],
+        pediatric_red_flags=tables["pediatric"],
+        duplicates=duplicates,
+    )
+
+
+def load_rules(path: str) -> CompiledRules:
+    """Lê, valida e compila o ficheiro de regras"""
+    return compile_rule_set(load_rule_file(path))
+
+
+# Testes (executar com pytest -v)
+def test_compile_folds_deduplicates_and_validates():
+    rules = compile_rule_set({
+        "version": "t1",
+        "symptoms": {"Convulsão": "Neurology", "convulsao": "Neurologia", "Febre": "Doenças e Infeções"},
+        "red_flags": {"Dor  no Peito": "Possível evento cardíaco"},
+    })
+    assert rules.duplicates == 1 and rules.symptom_map == {"Convulsão": "Neurologia", "Febre": "Doenças e Infeções"}
+    assert [p for _, _, p in rules.matcher.iter_matches(fold("CONVULSÃO e dor no   peito"))] == [
+        ("symptom", "Convulsão", "Neurologia"), ("red_flag", "Dor  no Peito", "Possível evento cardíaco")
+    ]
+
+    for bad in (
+        {"version": "t2", "symptoms": {"febre": "Ortopedia"}},
+        {"version": "t3", "symptoms": {"febre": "Neurologia", "Febre": "Cardiologia"}},
+        {"symptoms": {"febre": "Neurologia"}},
+    ):
+        try:
+            compile_rule_set(bad)
+            assert False, bad
+        except RuleSetError:
+            pass
+
+
+def test_known_words_are_validated_and_never_corrected():
+    import os
+
+    rules = load_rules(os.path.join(os.path.dirname(__file__), "rules", "triage_rules.json"))
+    assert rules.fuzzy.known_words
+    # Cada palavra conhecida, sozinha, não é tomada por uma frase das tabelas
+    for word in rules.fuzzy.known_words:
+        assert rules.fuzzy.search(word)["matches"] == [], word
+
+    for bad in (
+        {"version": "k1", "symptoms": {"tontura": "Cardiologia"}, "known_words": ["Tontura"]},
+        {"version": "k2", "symptoms": {"febre": "Doenças e Infeções"}, "known_words": "tortura"},
+        {"version": "k3", "symptoms": {"febre": "Doenças e Infeções"}, "known_words": ["great pain"]},
+    ):
+        try:
+            compile_rule_set(bad)
+            assert False, bad
+        except RuleSetError:
+            pass
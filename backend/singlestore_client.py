@@ -1,23 +1,50 @@
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import singlestoredb as s2
 import os
+import asyncio
+import threading
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import logging
+from connection_pool import ConnectionPool
+from embedding_cache import EmbeddingCache
+from vector_index import LocalVectorIndex
+from document_cache import DocumentCache
+from document_extracts import compute_extracts
+from encoders import create_encoder, encoder_id
+from embedding_batcher import EmbeddingBatcher
+from specialty_router import SpecialtyCentroids
 
 load_dotenv()
 
-# Configuração de logging
-logging.basicConfig(
-    filename='medical_diagnosis.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Número máximo de documentos devolvidos por pesquisa
+SEARCH_LIMIT = 10
+# Bónus de similaridade para documentos da especialidade identificada
+SPECIALTY_BOOST = float(os.getenv('SPECIALTY_BOOST', '0.1'))
+# Tamanho dos lotes enviados ao modelo de embeddings
+BATCH_ENCODE_SIZE = 64
+# Número de pesquisas agrupadas num único UNION ALL
+BATCH_QUERY_SIZE = 50
+# Texto usado para aquecer o modelo no arranque
+WARMUP_TEXT = "dor no peito e falta de ar há duas horas"
+# Confiança mínima dos centróides para uma especialidade ser usada na pesquisa
+SPECIALTY_ROUTING_MIN_CONFIDENCE = float(os.getenv('SPECIALTY_ROUTING_MIN_CONFIDENCE', '0.5'))
+# Linhas lidas de cada vez ao calcular os centróides a partir da base de dados
+CENTROID_FETCH_SIZE = 1000
 
 class MedicalDiagnosisEngine:
     def __init__(self):
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        # O codificador (torch, ONNX ou o servidor partilhado, ver encoders.py)
+        # só é carregado quando é preciso: ver load_embedding_model
+        self._embedding_model = None
+        self._model_lock = threading.Lock()
+        # Memoização dos embeddings das queries (mesmas queixas repetem-se)
+        self.embedding_cache = EmbeddingCache(
+            max_entries=int(os.getenv('EMBEDDING_CACHE_SIZE', '10000')),
+            disk_path=os.getenv('EMBEDDING_CACHE_PATH') or None,
+            namespace=encoder_id(),
+            max_disk_entries=int(os.getenv('EMBEDDING_CACHE_DISK_MAX_ENTRIES', '100000'))
+        )
         self.conn_params = {
             'host': os.getenv('SINGLESTORE_HOST'),
             'port': int(os.getenv('SINGLESTORE_PORT', '3306')),
@@ -25,13 +52,41 @@ class MedicalDiagnosisEngine:
             'password': os.getenv('SINGLESTORE_PASSWORD'),
             'database': os.getenv('SINGLESTORE_DB')
         }
-        self.specialty_mapping = {
-            "Cardiology": 1,
-            "Neurology": 2,
-            # Adicione outras especialidades conforme necessário
-        }
+        # Pedidos concorrentes (cache miss) são codificados em micro-lotes
+        self.batcher = None
+        if os.getenv('EMBEDDING_MICROBATCH', '1') == '1':
+            self.batcher = EmbeddingBatcher(
+                self._encode_batch,
+                max_batch_size=int(os.getenv('EMBEDDING_MICROBATCH_SIZE', '32')),
+                max_wait=float(os.getenv('EMBEDDING_MICROBATCH_WAIT_MS', '2')) / 1000
+            )
+        # Pool partilhado entre pedidos (evita handshake TCP/TLS por query)
+        self.pool = ConnectionPool(
+            self._connect,
+            max_size=int(os.getenv('SINGLESTORE_POOL_SIZE', '5')),
+            acquire_timeout=float(os.getenv('SINGLESTORE_POOL_TIMEOUT', '10')),
+            max_lifetime=float(os.getenv('SINGLESTORE_POOL_MAX_LIFETIME', '1800')),
+            health_check_after=float(os.getenv('SINGLESTORE_POOL_CHECK_AFTER', '30'))
+        )
+        # Texto dos documentos servido em processo (as pesquisas só devolvem ids)
+        self.document_cache = DocumentCache(
+            self._fetch_documents,
+            max_chars=int(os.getenv('DOCUMENT_CACHE_CHARS', '50000000'))
+        )
+        # Pesquisa por passagens (tabela pdf_chunks), com recurso ao documento inteiro
+        self.use_passages = os.getenv('PASSAGE_SEARCH', '1') == '1'
+        # Índice vetorial local opcional (evita ir à base de dados por query);
+        # é carregado por init_vector_index, no arranque da API
+        self.vector_index = None
+        self.vector_index_enabled = os.getenv('LOCAL_VECTOR_INDEX', '0') == '1'
+        # Centróides por especialidade (encaminhamento com o embedding da
+        # query); calculados por init_specialty_centroids, no arranque da API
+        self.specialty_centroids = SpecialtyCentroids(
+            temperature=float(os.getenv('SPECIALTY_ROUTING_TEMPERATURE', '0.05'))
+        )
+        self._stop_refresh = threading.Event()
 
-    def _get_connection(self):
+    def _connect(self):
         """Estabelece conexão com o SingleStore DB"""
         try:
             return s2.connect(**self.conn_params)
@@ -39,68 +94,714 @@ class MedicalDiagnosisEngine:
             logging.error(f"Connection error: {str(e)}")
             raise
 
+    def _get_connection(self):
+        """Empresta uma conexão do pool (usar com `with`)"""
+        return self.pool.connection()
+
+    def pool_stats(self) -> Dict:
+        """Estatísticas do pool de conexões"""
+        return self.pool.stats()
+
+    def close(self):
+        """Fecha as conexões abertas do pool e para as atualizações periódicas"""
+        self._stop_refresh.set()
+        if self.batcher is not None:
+            self.batcher.close()
+        self.embedding_cache.close()
+        self.pool.close()
+
+    @property
+    def embedding_model(self):
+        """Modelo de embeddings, carregado no primeiro uso"""
+        if self._embedding_model is None:
+            self.load_embedding_model()
+        return self._embedding_model
+
+    def load_embedding_model(self):
+        """Carrega o codificador configurado por EMBEDDING_BACKEND (uma só vez)"""
+        with self._model_lock:
+            if self._embedding_model is None:
+                self._embedding_model = create_encoder()
+        return self._embedding_model
+
+    def warm_up(self):
+        """
+        Corre o modelo uma vez (texto isolado e lote) sem passar pela cache,
+        para que a inicialização preguiçosa dos kernels não caia no primeiro pedido
+        """
+        self.embedding_model.encode(WARMUP_TEXT)
+        self.embedding_model.encode([WARMUP_TEXT] * 2, batch_size=BATCH_ENCODE_SIZE)
+
+    def ping(self):
+        """Verifica a ligação à base de dados (e abre a primeira conexão do pool)"""
+        with self._get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+
+    def init_vector_index(self):
+        """Carrega o snapshot (se existir), atualiza-o e agenda atualizações"""
+        if self.vector_index is not None:
+            return
+        vector_index = LocalVectorIndex(os.getenv('VECTOR_INDEX_PATH') or None)
+        vector_index.load_snapshot()
+        self.vector_index = vector_index
+        self.refresh_vector_index()
+
+        interval = float(os.getenv('VECTOR_INDEX_REFRESH_SECONDS', '300'))
+        if interval > 0:
+            def refresh_loop():
+                while not self._stop_refresh.wait(interval):
+                    self.refresh_vector_index()
+            threading.Thread(target=refresh_loop, name="vector-index-refresh", daemon=True).start()
+
+    def init_specialty_centroids(self):
+        """
+        Calcula os centróides e agenda o recálculo (documentos ingeridos
+        entretanto). Com o índice local, são recalculados a cada atualização.
+        """
+        self.refresh_specialty_centroids()
+        interval = float(os.getenv('SPECIALTY_CENTROIDS_REFRESH_SECONDS', '3600'))
+        if interval > 0 and self.vector_index is None:
+            def refresh_loop():
+                while not self._stop_refresh.wait(interval):
+                    self.refresh_specialty_centroids()
+            threading.Thread(target=refresh_loop, name="specialty-centroids-refresh", daemon=True).start()
+
+    def refresh_specialty_centroids(self) -> int:
+        """
+        Recalcula o centróide de cada especialidade: a partir do índice local,
+        se estiver carregado, senão lendo pdf_embeddings em blocos
+
+        Returns:
+            Número de especialidades com centróide
+        """
+        if self.vector_index is not None and len(self.vector_index):
+            count = self.specialty_centroids.build(self.vector_index.specialty_sums())
+        else:
+            try:
+                with self._get_connection() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute("""
+                            SELECT d.especialidade_id, e.embedding
+                            FROM pdf_embeddings e
+                            JOIN documentos_pdf d ON d.id = e.document_id
+                        """)
+
+                        def rows():
+                            while True:
+                                chunk = cursor.fetchmany(CENTROID_FETCH_SIZE)
+                                if not chunk:
+                                    return
+                                yield from chunk
+
+                        count = self.specialty_centroids.build_from_rows(rows())
+            except Exception as e:
+                logging.error(f"Specialty centroids refresh failed: {str(e)}")
+                return 0
+        logging.info(f"Specialty centroids refreshed: {self.specialty_centroids.info()}")
+        return count
+
+    def route_specialty(self, query_embedding: Optional[List[float]], top_k: int = 3) -> List[Dict]:
+        """
+        Especialidades mais próximas do embedding (já calculado) da query
+
+        Returns:
+            [{'id', 'name', 'similarity', 'confidence'}], vazio sem centróides
+        """
+        if not query_embedding:
+            return []
+        return self.specialty_centroids.rank(query_embedding, top_k)
+
+    def refresh_vector_index(self, full: bool = False) -> int:
+        """
+        Carrega para o índice local os embeddings ainda não indexados.
+        Compara os ids indexados com os de pdf_embeddings: documentos
+        removidos (ex.: reingestão, que apaga o id antigo e cria um novo) ou
+        ids abaixo do último indexado obrigam a reconstruir o índice, e os
+        documentos alterados saem da cache de documentos.
+
+        Args:
+            full: Reconstrói o índice do zero
+
+        Returns:
+            Número de vetores adicionados
+        """
+        if self.vector_index is None:
+            return 0
+        indexed = self.vector_index.document_ids()
+        last_id = self.vector_index.last_document_id
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT DISTINCT document_id FROM pdf_embeddings")
+                    current = {int(row[0]) for row in cursor.fetchall()}
+                    removed = indexed - current
+                    added_ids = current - indexed
+                    full = full or bool(removed) or any(doc_id <= last_id for doc_id in added_ids)
+                    if not full and not added_ids:
+                        return 0
+                    cursor.execute("""
+                        SELECT e.document_id, d.especialidade_id, e.embedding
+                        FROM pdf_embeddings e
+                        JOIN documentos_pdf d ON d.id = e.document_id
+                        WHERE e.document_id > %s
+                        ORDER BY e.document_id
+                    """, [0 if full else last_id])
+                    rows = cursor.fetchall()
+        except Exception as e:
+            logging.error(f"Vector index refresh failed: {str(e)}")
+            return 0
+
+        if full:
+            self.vector_index.build(rows)
+            added = len(rows)
+        else:
+            added = self.vector_index.add(rows)
+        changed = removed | added_ids
+        if changed:
+            self.document_cache.invalidate(changed)
+        if added or removed:
+            self.vector_index.save_snapshot()
+            self.specialty_centroids.build(self.vector_index.specialty_sums())
+            logging.info(
+                f"Vector index refreshed: {len(added_ids)} new and {len(removed)} removed documents "
+                f"({len(self.vector_index)} vectors, rebuilt={full})"
+            )
+        return added
+
+    def _fetch_documents(self, document_ids: List[int]) -> Dict[int, Dict]:
+        """
+        Obtém título, resumo e extratos de vários documentos numa só query.
+        Documentos ingeridos antes dos extratos existirem são calculados
+        aqui, uma única vez, a partir do texto (ficam depois em cache).
+        """
+        if not document_ids:
+            return {}
+        placeholders = ", ".join(["%s"] * len(document_ids))
+        with self._get_connection() as conn:
+            with conn.cursor() as cursor:
+                try:
+                    cursor.execute(
+                        f"SELECT id, titulo, resumo, extrato_diagnostico, extrato_recomendacao "
+                        f"FROM documentos_pdf WHERE id IN ({placeholders})",
+                        list(document_ids)
+                    )
+                    documents = {
+                        row[0]: {'title': row[1], 'summary': row[2], 'diagnosis': row[3], 'recommendation': row[4]}
+                        for row in cursor.fetchall()
+                    }
+                    pending = [doc_id for doc_id, doc in documents.items() if doc['summary'] is None]
+                except Exception as e:
+                    # Esquema ainda sem as colunas de extratos
+                    logging.warning(f"Precomputed extracts unavailable: {str(e)}")
+                    documents, pending = {}, list(document_ids)
+
+                if pending:
+                    placeholders = ", ".join(["%s"] * len(pending))
+                    cursor.execute(
+                        f"SELECT id, titulo, texto_extraido FROM documentos_pdf WHERE id IN ({placeholders})",
+                        pending
+                    )
+                    for doc_id, title, text in cursor.fetchall():
+                        documents[doc_id] = {'title': title, **compute_extracts(text)}
+        return documents
+
+    def _attach_documents(self, results: List[List[Dict]]) -> List[List[Dict]]:
+        """Junta título, resumo e extratos (da cache de documentos) aos resultados"""
+        ids = [document['id'] for documents in results for document in documents]
+        if not ids:
+            return results
+        try:
+            cached = self.document_cache.get_many(ids)
+        except Exception as e:
+            logging.error(f"Document fetch failed: {str(e)}")
+            cached = {}
+        for documents in results:
+            for document in documents:
+                entry = cached.get(document['id'], {})
+                document['excerpt'] = entry.get('summary') or ""
+                document['diagnosis'] = entry.get('diagnosis')
+                document['recommendation'] = entry.get('recommendation')
+                if not document.get('title'):
+                    # Sem metadados (ex.: a leitura dos documentos falhou): título genérico
+                    document['title'] = entry.get('title') or f"Documento {document['id']}"
+        return results
+
+    def _search_local(
+        self,
+        hits_per_query: List[List[Tuple[int, float]]],
+        query_embeddings: List[List[float]]
+    ) -> List[List[Dict]]:
+        """
+        Converte resultados do índice local em documentos. O índice só tem o
+        embedding de cada documento: a melhor passagem de cada documento
+        devolvido é procurada depois em pdf_chunks.
+        """
+        results = [
+            [{'id': doc_id, 'title': None, 'similarity': similarity} for doc_id, similarity in hits]
+            for hits in hits_per_query
+        ]
+        if self.use_passages:
+            self._attach_passages(list(zip(query_embeddings, results)))
+        return self._attach_documents(results)
+
+    def _attach_passages(self, queries: List[Tuple[List[float], List[Dict]]]) -> None:
+        """
+        Junta a melhor passagem (pdf_chunks) aos documentos já escolhidos,
+        sem mudar a ordem. Em cada bloco de BATCH_QUERY_SIZE queries, uma só
+        query UNION ALL; documentos sem passagens ficam com o resumo.
+        """
+        pending = [(idx, embedding, documents) for idx, (embedding, documents) in enumerate(queries) if documents]
+        found: Dict[Tuple[int, int], Tuple] = {}
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    for start in range(0, len(pending), BATCH_QUERY_SIZE):
+                        chunk = pending[start:start + BATCH_QUERY_SIZE]
+                        parts = []
+                        params = []
+                        for idx, embedding, documents in chunk:
+                            ids = [document['id'] for document in documents]
+                            parts.append(f"({self._document_passages_query(len(ids))})")
+                            params.extend([idx, str(embedding), *ids])
+                        cursor.execute(" UNION ALL ".join(parts), params)
+                        for row in cursor.fetchall():
+                            found[(int(row[0]), row[1])] = row[2:]
+        except Exception as e:
+            logging.error(f"Passage lookup failed: {str(e)}")
+            return
+
+        for idx, _, documents in pending:
+            for document in documents:
+                passage = found.get((idx, document['id']))
+                if passage is not None:
+                    document['passage'], document['passage_start'], document['passage_end'] = passage
+
+    @staticmethod
+    def _document_passages_query(count: int) -> str:
+        """Melhor passagem de cada um de `count` documentos (etiquetada com a query)"""
+        placeholders = ", ".join(["%s"] * count)
+        return f"""
+            SELECT 
+                %s AS query_idx,
+                b.document_id,
+                b.texto,
+                b.start_offset,
+                b.end_offset
+            FROM (
+                SELECT 
+                    c.document_id,
+                    c.texto,
+                    c.start_offset,
+                    c.end_offset,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY c.document_id
+                        ORDER BY DOT_PRODUCT(c.embedding, JSON_ARRAY_PACK(%s)) DESC
+                    ) AS rank_in_document
+                FROM pdf_chunks c
+                WHERE c.document_id IN ({placeholders})
+            ) b
+            WHERE b.rank_in_document = 1
+        """
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Codifica um micro-lote (chamado pela thread do EmbeddingBatcher)"""
+        return self.embedding_model.encode(texts, batch_size=BATCH_ENCODE_SIZE)
+
+    def _embed_cached(self, text: str) -> np.ndarray:
+        """Devolve o vetor float32 do texto, usando a cache sempre que possível"""
+        key = self.embedding_cache.normalize(text)
+        vector = self.embedding_cache.get(key)
+        if vector is None:
+            encoded = self.batcher.encode(key) if self.batcher is not None else self.embedding_model.encode(key)
+            vector = self.embedding_cache.put(key, encoded)
+        return vector
+
+    async def generate_embedding_async(self, text: str) -> Optional[List[float]]:
+        """
+        Versão assíncrona de generate_embedding: em cache miss espera pelo
+        micro-lote sem ocupar uma thread do executor. No event loop só se
+        consulta a cache em memória; a leitura do disco corre num executor.
+        """
+        try:
+            key = self.embedding_cache.normalize(text)
+            vector = self.embedding_cache.get_memory(key)
+            if vector is None:
+                if self.embedding_cache.disk:
+                    vector = await asyncio.get_running_loop().run_in_executor(None, self.embedding_cache.get_disk, key)
+                else:
+                    vector = self.embedding_cache.get_disk(key)  # sem disco: não há I/O, só conta a falha
+            if vector is None:
+                encoded = await asyncio.wrap_future(self.batcher.submit(key))
+                vector = self.embedding_cache.put(key, encoded)
+            return np.round(vector, 6).tolist()
+        except Exception as e:
+            logging.error(f"Embedding generation failed: {str(e)}")
+            return None
+
     def generate_embedding(self, text: str) -> Optional[List[float]]:
         """Gera embeddings para o texto de entrada"""
         try:
-            embedding = self.embedding_model.encode(text)
+            embedding = self._embed_cached(text)
             return np.round(embedding, 6).tolist()
         except Exception as e:
             logging.error(f"Embedding generation failed: {str(e)}")
             return None
 
-    def search_medical_documents(self, symptoms: str, specialty_id: Optional[int] = None) -> List[Dict]:
+    def generate_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Gera embeddings para vários textos numa única chamada ao modelo.
+        Só os textos que não estão em cache (sem repetições) são codificados.
+        """
+        if not texts:
+            return []
+        try:
+            keys = [self.embedding_cache.normalize(text) for text in texts]
+            vectors = {key: self.embedding_cache.get(key) for key in dict.fromkeys(keys)}
+            missing = [key for key, vector in vectors.items() if vector is None]
+            if missing:
+                encoded = self.embedding_model.encode(missing, batch_size=BATCH_ENCODE_SIZE)
+                for key, embedding in zip(missing, encoded):
+                    vectors[key] = self.embedding_cache.put(key, embedding)
+            return [np.round(vectors[key], 6).tolist() for key in keys]
+        except Exception as e:
+            logging.error(f"Batch embedding generation failed: {str(e)}")
+            return [None] * len(texts)
+
+    def _similarity_query(self, specialty_id: Optional[int] = None, tag: Optional[int] = None) -> str:
+        """Monta a query de similaridade (com etiqueta opcional para lotes)"""
+        query = f"""
+            SELECT 
+                {"%s AS query_idx," if tag is not None else ""}
+                d.id,
+                d.titulo,
+                DOT_PRODUCT(e.embedding, JSON_ARRAY_PACK(%s)) AS similarity
+            FROM documentos_pdf d
+            JOIN pdf_embeddings e ON d.id = e.document_id
+            WHERE 1=1
+        """
+        if specialty_id:
+            query += " AND d.especialidade_id = %s"
+        query += f" ORDER BY similarity DESC LIMIT {SEARCH_LIMIT}"
+        return query
+
+    @staticmethod
+    def _row_to_document(row) -> Dict:
+        """Linha (id, título, similaridade) -> documento (texto vem da cache)"""
+        return {
+            'id': row[0],
+            'title': row[1],
+            'similarity': float(row[2])
+        }
+
+    def _passage_query(self, specialty_id: Optional[int] = None, tag: Optional[int] = None) -> str:
+        """Query da melhor passagem por documento (com etiqueta opcional para lotes)"""
+        specialty_filter = "WHERE c.especialidade_id = %s" if specialty_id else ""
+        return f"""
+            SELECT 
+                {"%s AS query_idx," if tag is not None else ""}
+                d.id,
+                d.titulo,
+                b.similarity,
+                b.texto,
+                b.start_offset,
+                b.end_offset
+            FROM (
+                SELECT 
+                    c.document_id,
+                    c.texto,
+                    c.start_offset,
+                    c.end_offset,
+                    DOT_PRODUCT(c.embedding, JSON_ARRAY_PACK(%s)) AS similarity,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY c.document_id
+                        ORDER BY DOT_PRODUCT(c.embedding, JSON_ARRAY_PACK(%s)) DESC
+                    ) AS rank_in_document
+                FROM pdf_chunks c
+                {specialty_filter}
+            ) b
+            JOIN documentos_pdf d ON d.id = b.document_id
+            WHERE b.rank_in_document = 1
+            ORDER BY b.similarity DESC
+            LIMIT {SEARCH_LIMIT}
+        """
+
+    @classmethod
+    def _row_to_passage(cls, row) -> Dict:
+        """Linha (id, título, similaridade, passagem, início, fim) -> documento com a passagem"""
+        document = cls._row_to_document(row)
+        document['passage'] = row[3]
+        document['passage_start'] = row[4]
+        document['passage_end'] = row[5]
+        return document
+
+    def search_passages(self, query_embedding: List[float], specialty_id: Optional[int] = None) -> Optional[List[Dict]]:
+        """
+        Pesquisa na tabela de passagens e devolve, por documento, a melhor
+        passagem com os respetivos offsets no texto extraído.
+        
+        Returns:
+            Lista de documentos (com 'passage', 'passage_start' e
+            'passage_end') ou None se a pesquisa falhar
+        """
+        params = [str(query_embedding), str(query_embedding)]
+        if specialty_id:
+            params.append(specialty_id)
+
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(self._passage_query(specialty_id), params)
+                    rows = cursor.fetchall()
+        except Exception as e:
+            logging.error(f"Passage query failed: {str(e)}")
+            return None
+
+        return self._attach_documents([[self._row_to_passage(row) for row in rows]])[0]
+
+    def search_medical_documents(
+        self,
+        symptoms: str,
+        specialty_id: Optional[int] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> List[Dict]:
         """
         Busca documentos médicos relevantes para os sintomas
         
         Args:
             symptoms: Descrição dos sintomas do paciente
             specialty_id: ID da especialidade médica (opcional)
+            query_embedding: Embedding já calculado dos sintomas (opcional)
             
         Returns:
             Lista de documentos ordenados por relevância
         """
-        query_embedding = self.generate_embedding(symptoms)
+        if query_embedding is None:
+            query_embedding = self.generate_embedding(symptoms)
         if not query_embedding:
             return []
 
+        if self.vector_index is not None:
+            hits = self.vector_index.search(query_embedding, SEARCH_LIMIT, specialty_id=specialty_id)
+            return self._search_local([hits], [query_embedding])[0]
+
+        # Corpus ainda não dividido em passagens: usa o embedding do documento
+        if self.use_passages:
+            documents = self.search_passages(query_embedding, specialty_id)
+            if documents:
+                return documents
+
         try:
             with self._get_connection() as conn:
                 with conn.cursor() as cursor:
-                    # Converter embedding para formato binário
-                    embedding_bytes = bytes(np.array(query_embedding, dtype=np.float32).tobytes())
-                    
-                    base_query = """
-                        SELECT 
-                            d.id,
-                            d.titulo,
-                            d.texto_extraido,
-                            DOT_PRODUCT(e.embedding, JSON_ARRAY_PACK(%s)) AS similarity
-                        FROM documentos_pdf d
-                        JOIN pdf_embeddings e ON d.id = e.document_id
-                        WHERE 1=1
-                    """
-                    
                     params = [str(query_embedding)]
-                    
                     if specialty_id:
-                        base_query += " AND d.especialidade_id = %s"
                         params.append(specialty_id)
                     
-                    base_query += " ORDER BY similarity DESC LIMIT 10"
-                    
-                    cursor.execute(base_query, params)
+                    cursor.execute(self._similarity_query(specialty_id), params)
                     
-                    return [{
-                        'id': row[0],
-                        'title': row[1],
-                        'content': row[2],
-                        'similarity': float(row[3])
-                    } for row in cursor.fetchall()]
+                    documents = [self._row_to_document(row) for row in cursor.fetchall()]
                     
         except Exception as e:
             logging.error(f"Database query failed: {str(e)}")
             return []
 
+        return self._attach_documents([documents])[0]
+
+    def search_medical_documents_batch(self, queries: List[Tuple[str, Optional[int]]]) -> List[List[Dict]]:
+        """
+        Versão em lote de search_medical_documents
+        
+        Args:
+            queries: Lista de pares (sintomas, specialty_id opcional)
+            
+        Returns:
+            Lista de resultados, pela mesma ordem das queries.
+            Os embeddings são gerados numa só chamada ao modelo e cada bloco
+            de BATCH_QUERY_SIZE queries é resolvido num único UNION ALL.
+        """
+        results: List[List[Dict]] = [[] for _ in queries]
+        embeddings = self.generate_embeddings([symptoms for symptoms, _ in queries])
+        pending = [
+            (idx, embedding, specialty_id)
+            for idx, (embedding, (_, specialty_id)) in enumerate(zip(embeddings, queries))
+            if embedding
+        ]
+        if not pending:
+            return results
+
+        if self.vector_index is not None:
+            hits = [
+                self.vector_index.search(embedding, SEARCH_LIMIT, specialty_id=specialty_id)
+                for _, embedding, specialty_id in pending
+            ]
+            local = self._search_local(hits, [embedding for _, embedding, _ in pending])
+            for (idx, _, _), documents in zip(pending, local):
+                results[idx] = documents
+            return results
+
+        # Mesma lógica de search_medical_documents: passagens primeiro e, para
+        # as queries sem passagens (corpus ainda não dividido), o embedding do documento
+        found: Dict[int, List[Dict]] = {}
+        if self.use_passages:
+            try:
+                found = self._search_batch_sql(pending, passages=True)
+            except Exception as e:
+                logging.error(f"Batch passage query failed: {str(e)}")
+        remaining = [query for query in pending if not found.get(query[0])]
+        if remaining:
+            try:
+                found.update(self._search_batch_sql(remaining, passages=False))
+            except Exception as e:
+                logging.error(f"Batch database query failed: {str(e)}")
+
+        # O UNION ALL não garante a ordem entre blocos
+        for idx, documents in found.items():
+            documents.sort(key=lambda x: x['similarity'], reverse=True)
+            results[idx] = documents
+        return self._attach_documents(results)
+
+    def _search_batch_sql(self, pending: List[Tuple[int, List[float], Optional[int]]], passages: bool) -> Dict[int, List[Dict]]:
+        """Resolve cada bloco de BATCH_QUERY_SIZE queries num único UNION ALL"""
+        found: Dict[int, List[Dict]] = {}
+        to_document = self._row_to_passage if passages else self._row_to_document
+        with self._get_connection() as conn:
+            with conn.cursor() as cursor:
+                for start in range(0, len(pending), BATCH_QUERY_SIZE):
+                    chunk = pending[start:start + BATCH_QUERY_SIZE]
+                    parts = []
+                    params = []
+                    for idx, embedding, specialty_id in chunk:
+                        if passages:
+                            parts.append(f"({self._passage_query(specialty_id, tag=idx)})")
+                            params.extend([idx, str(embedding), str(embedding)])
+                        else:
+                            parts.append(f"({self._similarity_query(specialty_id, tag=idx)})")
+                            params.extend([idx, str(embedding)])
+                        if specialty_id:
+                            params.append(specialty_id)
+
+                    cursor.execute(" UNION ALL ".join(parts), params)
+
+                    for row in cursor.fetchall():
+                        found.setdefault(int(row[0]), []).append(to_document(row[1:]))
+        return found
+
+    def search_boosted_documents(
+        self,
+        symptoms: str,
+        specialty_id: Optional[int] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> List[Dict]:
+        """
+        Pesquisa única que combina o top-k da especialidade com o top-k global.
+        
+        O embedding é calculado uma vez e uma só query ordena todos os
+        documentos por similaridade, somando SPECIALTY_BOOST aos da
+        especialidade. Cada documento aparece uma única vez (melhor passagem,
+        ou melhor vetor se o corpus ainda não estiver dividido em passagens).
+        
+        Returns:
+            Lista de documentos ordenados por relevância, com 'in_specialty'
+        """
+        if not specialty_id:
+            return self.search_medical_documents(symptoms, query_embedding=query_embedding)
+
+        if query_embedding is None:
+            query_embedding = self.generate_embedding(symptoms)
+        if not query_embedding:
+            return []
+
+        if self.vector_index is not None:
+            hits = self.vector_index.search(
+                query_embedding, SEARCH_LIMIT,
+                boost_specialty=specialty_id, boost=SPECIALTY_BOOST
+            )
+            documents = self._search_local([hits], [query_embedding])[0]
+            for document in documents:
+                document['in_specialty'] = self.vector_index.specialty_of(document['id']) == specialty_id
+            return documents
+
+        # Mesma lógica de search_medical_documents: passagens primeiro e, se o
+        # corpus ainda não estiver dividido, o embedding do documento
+        documents = None
+        if self.use_passages:
+            documents = self._search_boosted_sql(query_embedding, specialty_id, passages=True)
+        if not documents:
+            documents = self._search_boosted_sql(query_embedding, specialty_id, passages=False)
+        return self._attach_documents([documents or []])[0]
+
+    def _search_boosted_sql(
+        self,
+        query_embedding: List[float],
+        specialty_id: int,
+        passages: bool
+    ) -> Optional[List[Dict]]:
+        """
+        Query de search_boosted_documents: com `passages`, ordena pela melhor
+        passagem de cada documento (pdf_chunks), senão pelo melhor vetor de
+        pdf_embeddings. Devolve None se a query falhar.
+        """
+        if passages:
+            source = """
+                SELECT document_id, similarity, texto, start_offset, end_offset
+                FROM (
+                    SELECT 
+                        document_id,
+                        texto,
+                        start_offset,
+                        end_offset,
+                        DOT_PRODUCT(embedding, JSON_ARRAY_PACK(%s)) AS similarity,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY document_id
+                            ORDER BY DOT_PRODUCT(embedding, JSON_ARRAY_PACK(%s)) DESC
+                        ) AS rank_in_document
+                    FROM pdf_chunks
+                ) c
+                WHERE c.rank_in_document = 1
+            """
+            embedding_params = [str(query_embedding), str(query_embedding)]
+        else:
+            source = """
+                SELECT document_id, MAX(DOT_PRODUCT(embedding, JSON_ARRAY_PACK(%s))) AS similarity
+                FROM pdf_embeddings
+                GROUP BY document_id
+            """
+            embedding_params = [str(query_embedding)]
+        query = f"""
+            SELECT 
+                d.id,
+                d.titulo,
+                s.similarity,
+                d.especialidade_id = %s AS in_specialty
+                {", s.texto, s.start_offset, s.end_offset" if passages else ""}
+            FROM ({source}) s
+            JOIN documentos_pdf d ON d.id = s.document_id
+            ORDER BY s.similarity + IF(d.especialidade_id = %s, %s, 0) DESC
+            LIMIT {SEARCH_LIMIT}
+        """
+        params = [specialty_id, *embedding_params, specialty_id, SPECIALTY_BOOST]
+
+        try:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(query, params)
+                    rows = cursor.fetchall()
+        except Exception as e:
+            logging.error(f"{'Boosted passage' if passages else 'Database'} query failed: {str(e)}")
+            return None
+
+        documents = {}
+        for row in rows:
+            if row[0] not in documents:
+                document = self._row_to_document(row)
+                document['in_specialty'] = bool(row[3])
+                if passages:
+                    document['passage'], document['passage_start'], document['passage_end'] = row[4:7]
+                documents[row[0]] = document
+        return list(documents.values())
+
     def generate_diagnostic_report(self, symptoms: str) -> Dict:
         """
         Gera um relatório de diagnóstico baseado nos documentos médicos
@@ -114,28 +815,24 @@ class MedicalDiagnosisEngine:
             - recommended_actions: Ações recomendadas
             - supporting_evidence: Trechos de documentos relevantes
             - confidence: Nível de confiança (0-1)
+            - specialties: Especialidades sugeridas pelos centróides
         """
-        # Primeiro tenta identificar a especialidade mais relevante
-        specialty_priority = self._identify_specialty(symptoms)
-        
-        results = {}
-        
-        # Busca primeiro na especialidade específica
-        if specialty_priority:
-            results = self.search_medical_documents(symptoms, specialty_priority['id'])
+        # Um só embedding serve o encaminhamento e a pesquisa
+        query_embedding = self.generate_embedding(symptoms)
+        specialties = self.route_specialty(query_embedding)
+        specialty_priority = self._identify_specialty(symptoms, query_embedding, specialties)
+        specialty_id = specialty_priority['id'] if specialty_priority else None
         
-        # Se não encontrar resultados suficientes, faz busca geral
-        if not results or len(results) < 3:
-            general_results = self.search_medical_documents(symptoms)
-            results.extend(general_results)
-            results = sorted(results, key=lambda x: x['similarity'], reverse=True)[:10]
+        # Uma só pesquisa: especialidade favorecida, completada pelo resto
+        results = self.search_boosted_documents(symptoms, specialty_id, query_embedding)
         
         if not results:
             return {
                 'possible_diagnoses': [],
                 'recommended_actions': ["Consultar um médico imediatamente"],
                 'supporting_evidence': [],
-                'confidence': 0.0
+                'confidence': 0.0,
+                'specialties': specialties
             }
         
         # Processa os resultados para gerar o relatório
@@ -144,16 +841,13 @@ class MedicalDiagnosisEngine:
         total_similarity = sum(r['similarity'] for r in results)
         
         for doc in results[:5]:  # Limita aos 5 mais relevantes
-            # Extrai possíveis diagnósticos do conteúdo (simplificado)
-            content = doc['content'].lower()
-            if "diagnóstico" in content:
-                start = content.index("diagnóstico") + len("diagnóstico")
-                end = content.find(".", start)
-                diagnoses.add(content[start:end].strip().capitalize())
+            # Extratos de diagnóstico pré-calculados na ingestão
+            if doc.get('diagnosis'):
+                diagnoses.add(doc['diagnosis'])
             
             evidence.append({
                 'title': doc['title'],
-                'excerpt': doc['content'][:300] + "...",
+                'excerpt': doc.get('passage') or doc['excerpt'],
                 'similarity': doc['similarity']
             })
         
@@ -163,27 +857,26 @@ class MedicalDiagnosisEngine:
             'possible_diagnoses': list(diagnoses)[:3],  # Limita a 3 diagnósticos
             'recommended_actions': self._generate_actions(symptoms, results),
             'supporting_evidence': evidence,
-            'confidence': round(confidence, 2)
+            'confidence': round(confidence, 2),
+            'specialties': specialties
         }
     
-    def _identify_specialty(self, symptoms: str) -> Optional[Dict]:
-        """Identifica a especialidade médica mais relevante para os sintomas"""
-        symptom_keywords = {
-            "cardiaco": "Cardiology",
-            "coração": "Cardiology",
-            "peito": "Cardiology",
-            "neurológico": "Neurology",
-            "cabeça": "Neurology",
-            # Adicione mais mapeamentos conforme necessário
-        }
-        
-        symptoms_lower = symptoms.lower()
-        for keyword, specialty in symptom_keywords.items():
-            if keyword in symptoms_lower:
-                return {
-                    'name': specialty,
-                    'id': self.specialty_mapping.get(specialty)
-                }
+    def _identify_specialty(
+        self,
+        symptoms: str,
+        query_embedding: Optional[List[float]] = None,
+        ranked: Optional[List[Dict]] = None
+    ) -> Optional[Dict]:
+        """
+        Identifica a especialidade médica mais relevante para os sintomas:
+        a do centróide mais próximo, se a confiança for suficiente
+        """
+        if ranked is None:
+            if query_embedding is None:
+                query_embedding = self.generate_embedding(symptoms)
+            ranked = self.route_specialty(query_embedding, top_k=1)
+        if ranked and ranked[0]['confidence'] >= SPECIALTY_ROUTING_MIN_CONFIDENCE:
+            return ranked[0]
         return None
     
     def _generate_actions(self, symptoms: str, documents: List[Dict]) -> List[str]:
@@ -198,19 +891,66 @@ class MedicalDiagnosisEngine:
         
         # Ações específicas dos documentos
         for doc in documents[:3]:
-            content = doc['content'].lower()
-            if "recomendação" in content:
-                start = content.index("recomendação") + len("recomendação")
-                end = content.find(".", start)
-                recommendation = content[start:end].strip()
-                if recommendation:
-                    actions.add(recommendation.capitalize())
+            if doc.get('recommendation'):
+                actions.add(doc['recommendation'])
         
         if not actions:
             actions.add("Consultar um médico para avaliação")
         
         return list(actions)[:3]  # Limita a 3 ações
 
+class SingleStoreMed:
+    """Camada usada pela API: devolve a informação médica já formatada"""
+
+    def __init__(self, engine: Optional[MedicalDiagnosisEngine] = None):
+        self.engine = engine or MedicalDiagnosisEngine()
+
+    def get_medical_info(
+        self,
+        specialty_id: Optional[int],
+        user_query: str,
+        query_embedding: Optional[List[float]] = None
+    ) -> Dict:
+        """Pesquisa documentos para um caso e formata-os"""
+        documents = self.engine.search_medical_documents(user_query, specialty_id, query_embedding)
+        return self._format_medical_info(user_query, documents)
+
+    def get_medical_info_batch(self, cases: List[Tuple[Optional[int], str]]) -> List[Dict]:
+        """
+        Versão em lote de get_medical_info
+        
+        Args:
+            cases: Lista de pares (specialty_id, user_query)
+            
+        Returns:
+            Lista de resultados pela mesma ordem dos casos
+        """
+        queries = [(user_query, specialty_id) for specialty_id, user_query in cases]
+        results = self.engine.search_medical_documents_batch(queries)
+        return [
+            self._format_medical_info(user_query, documents)
+            for (_, user_query), documents in zip(cases, results)
+        ]
+
+    def _format_medical_info(self, user_query: str, documents: List[Dict]) -> Dict:
+        actions = self.engine._generate_actions(user_query, documents)
+        return {
+            'relevant_info': [
+                {
+                    'id': doc['id'],
+                    'title': doc['title'],
+                    'text': doc.get('passage') or doc['excerpt'],
+                    'passage': doc.get('passage'),
+                    'passage_start': doc.get('passage_start'),
+                    'passage_end': doc.get('passage_end'),
+                    'similarity': doc['similarity']
+                }
+                for doc in documents
+            ],
+            'sources': [doc['title'] for doc in documents],
+            'recommendation': actions[0] if actions else "Consultar um médico para avaliação"
+        }
+
 # Exemplo de uso
 if __name__ == "__main__":
     engine = MedicalDiagnosisEngine()
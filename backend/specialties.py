@@ -0,0 +1,35 @@
+from typing import Dict, NamedTuple, Optional
+
+
+class Specialty(NamedTuple):
+    id: int              # especialidade_id na base de dados
+    name: str            # nome usado nas regras e nas respostas da API
+    folder: str          # pasta em database/documents/Files (ingestão)
+
+
+# Registo único de especialidades: árvore de decisão, regras, pesquisa e
+# ingestão usam todos estes ids
+SPECIALTIES = (
+    Specialty(1, "Cardiologia", "Cardiology"),
+    Specialty(2, "Dermatologia", "Dermatology"),
+    Specialty(3, "Cirurgia Geral", "General Surgery"),
+    Specialty(4, "Ginecologia e Obstetricia", "Gynecology and Obstetrics"),
+    Specialty(5, "Psiquiatria", "Psychiatry"),
+    Specialty(6, "Doenças e Infeções", "Infectious Diseases"),
+    Specialty(7, "Neurologia", "Neurology"),
+)
+
+SPECIALTY_MAPPING: Dict[str, int] = {s.name: s.id for s in SPECIALTIES}
+
+# Nome, pasta ou id (em texto) -> especialidade, sem distinguir maiúsculas
+_LOOKUP: Dict[str, Specialty] = {}
+for _specialty in SPECIALTIES:
+    for _key in (_specialty.name, _specialty.folder, str(_specialty.id)):
+        _LOOKUP[_key.casefold()] = _specialty
+
+
+def resolve_specialty(name) -> Optional[Specialty]:
+    """Especialidade pelo nome (pt), pasta (en) ou id; None se desconhecida"""
+    if name is None:
+        return None
+    return _LOOKUP.get(str(name).strip().casefold())
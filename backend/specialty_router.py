@@ -0,0 +1,120 @@
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from specialties import resolve_specialty
+
+
+class _CentroidState(NamedTuple):
+    """Centróides em uso (trocados atomicamente a cada reconstrução)"""
+    ids: np.ndarray       # (s,) especialidade_id
+    matrix: np.ndarray    # (s, dim) float32, linhas normalizadas
+    counts: np.ndarray    # (s,) vetores que deram origem a cada centróide
+
+
+def _empty_state() -> _CentroidState:
+    return _CentroidState(np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.int64))
+
+
+class SpecialtyCentroids:
+    """
+    Encaminhamento por especialidade a partir do embedding da query.
+
+    Cada especialidade é representada pela média (normalizada) dos
+    embeddings dos seus documentos em pdf_embeddings. Ordenar as
+    especialidades é um produto matriz-vetor com poucas linhas; a confiança
+    é um softmax das similaridades com temperatura `temperature`.
+    """
+
+    def __init__(self, temperature: float = 0.05):
+        self.temperature = temperature
+        self._state = _empty_state()
+        self._write_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._state.ids)
+
+    def build(self, sums: Dict[int, Tuple[np.ndarray, int]]) -> int:
+        """
+        Substitui os centróides a partir de {especialidade_id: (soma dos
+        vetores, número de vetores)}; devolve o número de especialidades
+        """
+        sums = {int(sid): (vector, count) for sid, (vector, count) in sums.items() if sid and count}
+        if not sums:
+            state = _empty_state()
+        else:
+            ids = np.asarray(sorted(sums), dtype=np.int64)
+            matrix = np.vstack([np.asarray(sums[sid][0], dtype=np.float64) for sid in ids])
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            state = _CentroidState(
+                ids,
+                np.ascontiguousarray(matrix / np.maximum(norms, 1e-12), dtype=np.float32),
+                np.asarray([sums[sid][1] for sid in ids], dtype=np.int64)
+            )
+        with self._write_lock:
+            self._state = state
+        return len(state.ids)
+
+    def build_from_rows(self, rows: Iterable[Tuple[int, bytes]]) -> int:
+        """Reconstrói a partir de linhas (especialidade_id, embedding) lidas em streaming"""
+        sums: Dict[int, list] = {}
+        for specialty_id, embedding in rows:
+            vector = np.frombuffer(embedding, dtype=np.float32)
+            entry = sums.get(specialty_id)
+            if entry is None:
+                sums[specialty_id] = [vector.astype(np.float64), 1]
+            else:
+                entry[0] += vector
+                entry[1] += 1
+        return self.build({sid: (vector, count) for sid, (vector, count) in sums.items()})
+
+    def rank(self, query, top_k: Optional[int] = None) -> List[Dict]:
+        """
+        Especialidades por ordem de similaridade ao embedding da query
+
+        Returns:
+            [{"id", "name", "similarity", "confidence"}] (vazio sem centróides)
+        """
+        state = self._state
+        if not len(state.ids):
+            return []
+        scores = state.matrix @ np.asarray(query, dtype=np.float32)
+        weights = np.exp((scores - scores.max()) / self.temperature)
+        confidences = weights / weights.sum()
+        order = np.argsort(-scores, kind="stable")[:top_k]
+
+        ranked = []
+        for idx in order:
+            specialty = resolve_specialty(int(state.ids[idx]))
+            ranked.append({
+                'id': int(state.ids[idx]),
+                'name': specialty.name if specialty else None,
+                'similarity': round(float(scores[idx]), 4),
+                'confidence': round(float(confidences[idx]), 4),
+            })
+        return ranked
+
+    def info(self) -> Dict:
+        state = self._state
+        return {
+            "specialties": len(state.ids),
+            "vectors": int(state.counts.sum()) if len(state.counts) else 0,
+            "temperature": self.temperature,
+        }
+
+
+# Testes (executar com pytest -v)
+def test_centroids_rank_specialties_by_query():
+    vectors = np.eye(3, dtype=np.float32)
+    centroids = SpecialtyCentroids(temperature=0.1)
+    assert centroids.rank(vectors[0]) == []
+
+    rows = [(1, vectors[0].tobytes()), (1, (vectors[0] * 0.6 + vectors[1] * 0.8).tobytes()), (7, vectors[2].tobytes())]
+    assert centroids.build_from_rows(rows) == 2
+
+    ranked = centroids.rank(np.array([0.9, 0.1, 0.1], dtype=np.float32))
+    assert [r['name'] for r in ranked] == ["Cardiologia", "Neurologia"]
+    assert ranked[0]['confidence'] > 0.9 and abs(sum(r['confidence'] for r in ranked) - 1) < 1e-3
+    assert centroids.rank(vectors[2], top_k=1)[0]['id'] == 7
+    assert centroids.info()["vectors"] == 3
@@ -0,0 +1,96 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+class StartupState:
+    """
+    Estado de arranque de cada componente, usado pela sonda de prontidão.
+
+    Cada componente é registado como "pending" e passa a "ready" (com o
+    tempo de carregamento) ou "failed" (com o erro). O serviço só está
+    pronto quando todos os componentes obrigatórios estão "ready"; passos
+    falhados podem ser repetidos (ver `failed`), contando as tentativas.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._components: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, required: bool = True) -> None:
+        with self._lock:
+            self._components[name] = {"status": "pending", "required": required, "seconds": None, "error": None, "attempts": 0}
+
+    @contextmanager
+    def track(self, name: str):
+        """Mede o bloco e regista o resultado; erros são registados e não propagados"""
+        with self._lock:
+            component = self._components.setdefault(name, {"required": True, "error": None, "attempts": 0})
+            component.update(status="loading", seconds=None, attempts=component["attempts"] + 1)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            logging.error(f"Startup step '{name}' failed: {str(e)}", exc_info=True)
+            with self._lock:
+                component.update(status="failed", seconds=round(time.perf_counter() - start, 3), error=str(e))
+        else:
+            with self._lock:
+                component.update(status="ready", seconds=round(time.perf_counter() - start, 3), error=None)
+
+    def failed(self) -> List[str]:
+        """Componentes cuja última tentativa falhou, pela ordem de registo"""
+        with self._lock:
+            return [name for name, c in self._components.items() if c["status"] == "failed"]
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return all(c["status"] == "ready" for c in self._components.values() if c["required"])
+
+    def snapshot(self) -> Dict:
+        """Prontidão global e estado de cada componente"""
+        with self._lock:
+            components = {name: dict(c) for name, c in self._components.items()}
+        return {
+            "ready": all(c["status"] == "ready" for c in components.values() if c["required"]),
+            "uptime": round(time.time() - self.started_at, 3),
+            "components": components,
+        }
+
+
+# Testes (executar com pytest -v)
+def test_startup_state_tracks_components():
+    state = StartupState()
+    state.register("model")
+    state.register("database", required=False)
+    assert not state.ready
+
+    with state.track("model"):
+        pass
+    with state.track("database"):
+        raise RuntimeError("sem ligação")
+
+    snapshot = state.snapshot()
+    assert state.ready and snapshot["ready"]
+    assert snapshot["components"]["model"]["status"] == "ready"
+    assert snapshot["components"]["database"] == {
+        **snapshot["components"]["database"], "status": "failed", "error": "sem ligação"
+    }
+
+
+def test_failed_steps_can_be_retried():
+    state = StartupState()
+    state.register("database")
+    with state.track("database"):
+        raise ConnectionError("timeout")
+    assert state.failed() == ["database"] and not state.ready
+
+    with state.track("database"):
+        pass
+    component = state.snapshot()["components"]["database"]
+    assert state.ready and state.failed() == []
+    assert component["status"] == "ready" and component["attempts"] == 2 and component["error"] is None
@@ -0,0 +1,73 @@
+from typing import Dict, Hashable, Iterator, List, Tuple
+
+
+class SymptomMatcher:
+    """
+    Autómato Aho-Corasick para procurar várias frases numa só passagem.
+
+    Cada frase pode ter vários payloads associados (ex.: especialidade,
+    alerta geral, alerta pediátrico). As frases devem já vir normalizadas.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, Hashable]]] = [[]]
+        self._built = False
+
+    def add(self, phrase: str, payload: Hashable) -> None:
+        """Adiciona uma frase (já normalizada) ao autómato"""
+        if not phrase:
+            return
+        state = 0
+        for ch in phrase:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = nxt
+        self._output[state].append((len(phrase), payload))
+        self._built = False
+
+    def build(self) -> "SymptomMatcher":
+        """Calcula as ligações de falha (BFS) e propaga as saídas"""
+        goto, fail, output = self._goto, self._fail, self._output
+        queue = list(goto[0].values())
+        for state in queue:
+            fail[state] = 0
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                candidate = goto[f].get(ch, 0)
+                fail[nxt] = candidate if candidate != nxt else 0
+                # Saídas do estado de falha já estão completas (ordem BFS)
+                output[nxt] = output[nxt] + output[fail[nxt]]
+        self._built = True
+        return self
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Hashable]]:
+        """Devolve (início, fim, payload) para cada ocorrência no texto"""
+        if not self._built:
+            self.build()
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                end = i + 1
+                for length, payload in output[state]:
+                    yield end - length, end, payload
+
+    def __len__(self) -> int:
+        return len(self._goto)
@@ -0,0 +1,370 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Limites (s) dos intervalos dos histogramas de latência por etapa
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class StageMetrics:
+    """
+    Histogramas de latência por (endpoint, etapa), tempo de espera na fila
+    de admissão por urgência e contagens de pedidos, exportados no formato
+    de texto do Prometheus.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = STAGE_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # (endpoint, etapa) -> [contagens por intervalo, soma, total]
+        self._series: Dict[Tuple[str, str], list] = {}
+        self._requests: Dict[Tuple[str, str], int] = {}
+        self._degraded: Dict[Tuple[str, str], int] = {}
+        # urgência -> [contagens por intervalo, soma, total]
+        self._queue_waits: Dict[str, list] = {}
+        self._rejected: Dict[Tuple[str, str], int] = {}
+
+    def _add(self, histograms: Dict, key, seconds: float) -> None:
+        series = histograms.get(key)
+        if series is None:
+            series = histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, limit in enumerate(self.buckets):
+            if seconds <= limit:
+                series[0][i] += 1
+                break
+        series[1] += seconds
+        series[2] += 1
+
+    def observe(self, endpoint: str, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._add(self._series, (endpoint, stage), seconds)
+
+    def observe_queue_wait(self, urgency: str, seconds: float) -> None:
+        with self._lock:
+            self._add(self._queue_waits, urgency, seconds)
+
+    def count_rejected(self, urgency: str, status: str) -> None:
+        with self._lock:
+            self._rejected[(urgency, status)] = self._rejected.get((urgency, status), 0) + 1
+
+    def count_request(self, endpoint: str, status: str) -> None:
+        with self._lock:
+            self._requests[(endpoint, status)] = self._requests.get((endpoint, status), 0) + 1
+
+    def count_degraded(self, endpoint: str, reason: str) -> None:
+        with self._lock:
+            self._degraded[(endpoint, reason)] = self._degraded.get((endpoint, reason), 0) + 1
+
+    def _histogram(self, name: str, labels: str, counts: List[int], total: float, count: int) -> List[str]:
+        lines = []
+        cumulative = 0
+        for limit, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{labels},le="{limit}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f"{name}_sum{{{labels}}} {total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {count}")
+        return lines
+
+    def render(self) -> str:
+        """Métricas no formato de exposição do Prometheus (text/plain 0.0.4)"""
+        lines = [
+            "# HELP triage_stage_duration_seconds Latência de cada etapa da triagem",
+            "# TYPE triage_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+            queue_waits = {key: (list(counts), total, count) for key, (counts, total, count) in self._queue_waits.items()}
+            requests = dict(self._requests)
+            degraded = dict(self._degraded)
+            rejected = dict(self._rejected)
+        for (endpoint, stage), values in sorted(series.items()):
+            lines += self._histogram("triage_stage_duration_seconds", f'endpoint="{endpoint}",stage="{stage}"', *values)
+
+        lines += [
+            "# HELP triage_queue_wait_seconds Espera na fila de admissão por urgência",
+            "# TYPE triage_queue_wait_seconds histogram",
+        ]
+        for urgency, values in sorted(queue_waits.items()):
+            lines += self._histogram("triage_queue_wait_seconds", f'urgency="{urgency}"', *values)
+
+        lines += [
+            "# HELP triage_requests_total Pedidos de triagem por endpoint e código de resposta",
+            "# TYPE triage_requests_total counter",
+        ]
+        for (endpoint, status), count in sorted(requests.items()):
+            lines.append(f'triage_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+        lines += [
+            "# HELP triage_degraded_total Respostas degradadas por endpoint e motivo",
+            "# TYPE triage_degraded_total counter",
+        ]
+        for (endpoint, reason), count in sorted(degraded.items()):
+            lines.append(f'triage_degraded_total{{endpoint="{endpoint}",reason="{reason}"}} {count}')
+
+        lines += [
+            "# HELP triage_admission_rejected_total Pedidos recusados pela admissão por urgência e código",
+            "# TYPE triage_admission_rejected_total counter",
+        ]
+        for (urgency, status), count in sorted(rejected.items()):
+            lines.append(f'triage_admission_rejected_total{{urgency="{urgency}",status="{status}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+class RequestTrace:
+    """
+    Spans de um pedido: uma raiz (o endpoint) e uma filha por etapa, com
+    identificadores e tempos no formato do OpenTelemetry.
+    """
+
+    def __init__(self, endpoint: str, request_id: Optional[str] = None):
+        self.endpoint = endpoint
+        self.request_id = request_id
+        self.trace_id = os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._start = time.perf_counter()
+        self.spans: List[Dict] = []
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Mede uma etapa (funciona à volta de `await` dentro de corrotinas)"""
+        start_ns, start = time.time_ns(), time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self.spans.append({
+                "name": name,
+                "span_id": os.urandom(8).hex(),
+                "start_ns": start_ns,
+                "end_ns": start_ns + int(duration * 1e9),
+                "duration": duration,
+                "attributes": attributes,
+                "error": error,
+            })
+
+    async def timed(self, name: str, awaitable, **attributes):
+        """Mede um awaitable (ex.: uma etapa lançada como tarefa concorrente)"""
+        with self.span(name, **attributes):
+            return await awaitable
+
+    def finish(self) -> float:
+        """Fecha a raiz e devolve a duração total (s)"""
+        total = time.perf_counter() - self._start
+        self.end_ns = self.start_ns + int(total * 1e9)
+        return total
+
+    def durations(self) -> Dict[str, float]:
+        """Duração (s) por etapa (somada se a etapa se repetir)"""
+        durations: Dict[str, float] = {}
+        for span in self.spans:
+            durations[span["name"]] = durations.get(span["name"], 0.0) + span["duration"]
+        return durations
+
+    def server_timing(self) -> str:
+        """Valor do cabeçalho Server-Timing (durações em ms)"""
+        entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.durations().items()]
+        entries.append(f"total;dur={(time.perf_counter() - self._start) * 1000:.2f}")
+        return ", ".join(entries)
+
+    def to_otel(self) -> List[Dict]:
+        """Spans no formato JSON do OTLP (raiz primeiro)"""
+        def otel(name, span_id, parent, start_ns, end_ns, attributes, error):
+            return {
+                "traceId": self.trace_id,
+                "spanId": span_id,
+                "parentSpanId": parent,
+                "name": name,
+                "startTimeUnixNano": start_ns,
+                "endTimeUnixNano": end_ns,
+                "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in attributes.items()],
+                "status": {"code": "STATUS_CODE_ERROR", "message": error} if error else {"code": "STATUS_CODE_OK"},
+            }
+
+        attributes = {"endpoint": self.endpoint}
+        if self.request_id:
+            attributes["request_id"] = self.request_id
+        root = otel(f"triage.{self.endpoint}", self.span_id, None, self.start_ns,
+                    self.end_ns or time.time_ns(), attributes, None)
+        return [root] + [
+            otel(f"triage.{s['name']}", s["span_id"], self.span_id, s["start_ns"], s["end_ns"], s["attributes"], s["error"])
+            for s in self.spans
+        ]
+
+
+class JsonlSpanExporter:
+    """
+    Escreve os spans (formato OTLP JSON) num ficheiro, uma linha por span.
+    export() corre no event loop e só põe as linhas numa fila limitada;
+    uma thread dedicada escreve-as em disco. Com a fila cheia, os spans do
+    pedido são descartados (e contados) em vez de atrasar a resposta.
+    """
+
+    def __init__(self, path: str, max_queue: int = 10000):
+        self.path = path
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._stats = {"exported": 0, "dropped": 0, "errors": 0}
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, trace: RequestTrace) -> None:
+        lines = "".join(json.dumps(span, ensure_ascii=False) + "\n" for span in trace.to_otel())
+        try:
+            self._queue.put_nowait(lines)
+        except queue.Full:
+            self._stats["dropped"] += 1
+
+    def _run(self) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                batch = [self._queue.get()]
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                traces = [lines for lines in batch if lines is not None]
+                try:
+                    f.write("".join(traces))
+                    f.flush()
+                    self._stats["exported"] += len(traces)
+                except OSError as e:
+                    self._stats["errors"] += 1
+                    logging.error(f"Span export failed: {str(e)}")
+                if len(traces) < len(batch):
+                    return
+
+    def close(self) -> None:
+        """Escreve os spans pendentes e termina a thread"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+    def stats(self) -> Dict:
+        return {**self._stats, "queued": self._queue.qsize()}
+
+
+class OtelSpanExporter:
+    """Reenvia os spans para o SDK do OpenTelemetry configurado no processo"""
+
+    def __init__(self):
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = trace.get_tracer("smartnurse.triage")
+
+    def export(self, trace: RequestTrace) -> None:
+        root = self._tracer.start_span(
+            f"triage.{trace.endpoint}", start_time=trace.start_ns, attributes={"endpoint": trace.endpoint}
+        )
+        context = self._trace.set_span_in_context(root)
+        for span in trace.spans:
+            child = self._tracer.start_span(
+                f"triage.{span['name']}", context=context, start_time=span["start_ns"],
+                attributes={k: str(v) for k, v in span["attributes"].items()}
+            )
+            if span["error"]:
+                child.set_status(self._trace.Status(self._trace.StatusCode.ERROR, span["error"]))
+            child.end(end_time=span["end_ns"])
+        root.end(end_time=trace.end_ns)
+
+
+def create_exporter():
+    """Exportador configurado por TRACE_EXPORTER (jsonl|otel; vazio desativa)"""
+    kind = os.getenv('TRACE_EXPORTER', '')
+    try:
+        if kind == 'jsonl':
+            return JsonlSpanExporter(os.getenv('TRACE_EXPORT_PATH', 'triage_spans.jsonl'))
+        if kind == 'otel':
+            return OtelSpanExporter()
+    except ImportError as e:
+        logging.error(f"Trace exporter '{kind}' unavailable: {str(e)}")
+    return None
+
+
+class Telemetry:
+    """Ponto de entrada: cria traces, regista métricas e exporta spans"""
+
+    def __init__(self, exporter=None):
+        self.metrics = StageMetrics()
+        self.exporter = exporter
+
+    def start(self, endpoint: str, request_id: Optional[str] = None) -> RequestTrace:
+        return RequestTrace(endpoint, request_id)
+
+    def finish(self, trace: RequestTrace, status: str = "200", degraded: Sequence[str] = ()) -> None:
+        total = trace.finish()
+        # Uma observação por etapa e pedido (ex.: os vários chunks do LLM em streaming)
+        for stage, seconds in trace.durations().items():
+            self.metrics.observe(trace.endpoint, stage, seconds)
+        self.metrics.observe(trace.endpoint, "total", total)
+        self.metrics.count_request(trace.endpoint, status)
+        for reason in degraded:
+            self.metrics.count_degraded(trace.endpoint, reason)
+        if self.exporter is not None:
+            try:
+                self.exporter.export(trace)
+            except Exception as e:
+                logging.error(f"Span export failed: {str(e)}")
+
+    def close(self) -> None:
+        """Esvazia o exportador (se tiver escrita em segundo plano)"""
+        close = getattr(self.exporter, "close", None)
+        if close is not None:
+            close()
+
+
+# Testes (executar com pytest -v)
+def test_trace_metrics_and_server_timing():
+    telemetry = Telemetry()
+    trace = telemetry.start("triage")
+    with trace.span("rules"):
+        pass
+    try:
+        with trace.span("db"):
+            raise RuntimeError("timeout")
+    except RuntimeError:
+        pass
+    assert trace.server_timing().startswith("rules;dur=") and "db;dur=" in trace.server_timing()
+    telemetry.finish(trace, status="500", degraded=["llm_timeout"])
+
+    spans = trace.to_otel()
+    assert [s["name"] for s in spans] == ["triage.triage", "triage.rules", "triage.db"]
+    assert all(s["parentSpanId"] == spans[0]["spanId"] for s in spans[1:])
+    assert spans[2]["status"]["code"] == "STATUS_CODE_ERROR"
+
+    text = telemetry.metrics.render()
+    assert 'triage_stage_duration_seconds_count{endpoint="triage",stage="rules"} 1' in text
+    assert 'triage_stage_duration_seconds_bucket{endpoint="triage",stage="db",le="+Inf"} 1' in text
+    assert 'triage_requests_total{endpoint="triage",status="500"} 1' in text
+    assert 'triage_degraded_total{endpoint="triage",reason="llm_timeout"} 1' in text
+
+    telemetry.metrics.observe_queue_wait("Alta", 0.0002)
+    telemetry.metrics.count_rejected("Baixa", "429")
+    text = telemetry.metrics.render()
+    assert 'triage_queue_wait_seconds_bucket{urgency="Alta",le="0.0005"} 1' in text
+    assert 'triage_admission_rejected_total{urgency="Baixa",status="429"} 1' in text
+
+
+def test_jsonl_exporter_writes_in_background(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    telemetry = Telemetry(JsonlSpanExporter(str(path)))
+    for _ in range(3):
+        trace = telemetry.start("triage")
+        with trace.span("rules"):
+            pass
+        telemetry.finish(trace)
+    telemetry.close()
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 6 and json.loads(lines[1])["name"] == "triage.rules"
+    assert telemetry.exporter.stats() == {"exported": 3, "dropped": 0, "errors": 0, "queued": 0}
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+class _IndexState(NamedTuple):
+    """Estado imutável do índice (trocado atomicamente a cada atualização)"""
+    matrix: np.ndarray        # (n, dim) float32, ordenado por especialidade
+    doc_ids: np.ndarray       # (n,) int64
+    specialties: np.ndarray   # (n,) int64
+    partitions: Dict[int, Tuple[int, int]]  # especialidade -> [início, fim)
+
+
+def _empty_state(dim: int = 0) -> _IndexState:
+    return _IndexState(
+        np.zeros((0, dim), dtype=np.float32),
+        np.zeros(0, dtype=np.int64),
+        np.zeros(0, dtype=np.int64),
+        {}
+    )
+
+
+class LocalVectorIndex:
+    """
+    Índice vetorial em memória para a tabela pdf_embeddings.
+
+    Os vetores ficam numa matriz float32 contígua, ordenada por
+    especialidade_id, pelo que cada especialidade é uma fatia da matriz.
+    O top-k é um produto matriz-vetor seguido de argpartition. A matriz pode
+    ser guardada num snapshot em disco e carregada com memory-map: cada
+    snapshot é uma pasta versionada e o ficheiro CURRENT aponta para a
+    versão completa mais recente.
+
+    Args:
+        snapshot_dir: Diretório do snapshot (None = só em memória)
+    """
+
+    MATRIX_FILE = "matrix.npy"
+    META_FILE = "meta.npz"
+    CURRENT_FILE = "CURRENT"
+    # Versões antigas só são apagadas depois disto (outro processo pode estar a escrever)
+    SNAPSHOT_GRACE_SECONDS = 300
+
+    def __init__(self, snapshot_dir: Optional[str] = None):
+        self.snapshot_dir = snapshot_dir
+        self._state = _empty_state()
+        self._write_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._state.doc_ids)
+
+    def document_ids(self) -> set:
+        """Ids dos documentos indexados"""
+        return set(int(doc_id) for doc_id in np.unique(self._state.doc_ids))
+
+    @property
+    def last_document_id(self) -> int:
+        """Maior document_id carregado (base da atualização incremental)"""
+        doc_ids = self._state.doc_ids
+        return int(doc_ids.max()) if len(doc_ids) else 0
+
+    def specialty_of(self, document_id: int) -> Optional[int]:
+        """Especialidade de um documento indexado (None se não existir)"""
+        state = self._state
+        matches = np.flatnonzero(state.doc_ids == document_id)
+        return int(state.specialties[matches[0]]) if len(matches) else None
+
+    def specialty_sums(self) -> Dict[int, Tuple[np.ndarray, int]]:
+        """Soma e número de vetores de cada especialidade (centróides)"""
+        state = self._state
+        return {
+            specialty_id: (state.matrix[start:end].sum(axis=0, dtype=np.float64), end - start)
+            for specialty_id, (start, end) in state.partitions.items()
+        }
+
+    @staticmethod
+    def _build_state(matrix: np.ndarray, doc_ids: np.ndarray, specialties: np.ndarray) -> _IndexState:
+        order = np.argsort(specialties, kind="stable")
+        matrix = np.ascontiguousarray(matrix[order], dtype=np.float32)
+        doc_ids = doc_ids[order]
+        specialties = specialties[order]
+        partitions = {}
+        if len(specialties):
+            values, starts = np.unique(specialties, return_index=True)
+            ends = list(starts[1:]) + [len(specialties)]
+            partitions = {int(v): (int(s), int(e)) for v, s, e in zip(values, starts, ends)}
+        return _IndexState(matrix, doc_ids, specialties, partitions)
+
+    @staticmethod
+    def _rows_to_arrays(rows: Iterable[Tuple[int, int, bytes]]):
+        doc_ids, specialties, vectors = [], [], []
+        for document_id, specialty_id, embedding in rows:
+            doc_ids.append(int(document_id))
+            specialties.append(int(specialty_id or 0))
+            vectors.append(np.frombuffer(embedding, dtype=np.float32))
+        if not vectors:
+            return None
+        return (
+            np.vstack(vectors),
+            np.asarray(doc_ids, dtype=np.int64),
+            np.asarray(specialties, dtype=np.int64)
+        )
+
+    def build(self, rows: Iterable[Tuple[int, int, bytes]]) -> None:
+        """Substitui o índice por linhas (document_id, especialidade_id, embedding)"""
+        arrays = self._rows_to_arrays(rows)
+        with self._write_lock:
+            self._state = self._build_state(*arrays) if arrays else _empty_state()
+
+    def add(self, rows: Iterable[Tuple[int, int, bytes]]) -> int:
+        """Acrescenta novas linhas ao índice; devolve quantas foram adicionadas"""
+        arrays = self._rows_to_arrays(rows)
+        if not arrays:
+            return 0
+        matrix, doc_ids, specialties = arrays
+        with self._write_lock:
+            current = self._state
+            if len(current.doc_ids):
+                matrix = np.vstack([current.matrix, matrix])
+                doc_ids = np.concatenate([current.doc_ids, doc_ids])
+                specialties = np.concatenate([current.specialties, specialties])
+            self._state = self._build_state(matrix, doc_ids, specialties)
+        return len(arrays[1])
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int = 10,
+        specialty_id: Optional[int] = None,
+        boost_specialty: Optional[int] = None,
+        boost: float = 0.0
+    ) -> List[Tuple[int, float]]:
+        """
+        Devolve até k pares (document_id, similaridade), um por documento.
+
+        Args:
+            query: Vetor da query
+            specialty_id: Restringe a pesquisa a uma especialidade
+            boost_specialty: Especialidade cujos documentos recebem `boost`
+                na ordenação (a similaridade devolvida não inclui o bónus)
+        """
+        state = self._state
+        matrix, doc_ids = state.matrix, state.doc_ids
+        if specialty_id:
+            if specialty_id not in state.partitions:
+                return []
+            start, end = state.partitions[specialty_id]
+            matrix, doc_ids = matrix[start:end], doc_ids[start:end]
+        if not len(doc_ids):
+            return []
+
+        scores = matrix @ np.asarray(query, dtype=np.float32)
+        ranking = scores
+        if boost and boost_specialty in state.partitions and not specialty_id:
+            start, end = state.partitions[boost_specialty]
+            ranking = scores.copy()
+            ranking[start:end] += boost
+
+        # Margem para documentos com vários vetores
+        candidates = min(len(ranking), k * 4)
+        top = np.argpartition(-ranking, candidates - 1)[:candidates]
+        top = top[np.argsort(-ranking[top], kind="stable")]
+
+        results, seen = [], set()
+        for idx in top:
+            document_id = int(doc_ids[idx])
+            if document_id in seen:
+                continue
+            seen.add(document_id)
+            results.append((document_id, float(scores[idx])))
+            if len(results) == k:
+                break
+        return results
+
+    def save_snapshot(self) -> None:
+        """
+        Grava o índice em disco de forma atómica: matriz e metadados vão para
+        uma pasta nova e só depois CURRENT passa a apontar para ela (um único
+        os.replace), pelo que um leitor nunca vê uma matriz de uma versão com
+        ids de outra
+        """
+        if not self.snapshot_dir:
+            return
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        state = self._state
+        version = f"v{time.time_ns()}-{os.getpid()}"
+        version_dir = os.path.join(self.snapshot_dir, version)
+        os.makedirs(version_dir)
+        np.save(os.path.join(version_dir, self.MATRIX_FILE), state.matrix)
+        np.savez(
+            os.path.join(version_dir, self.META_FILE),
+            doc_ids=state.doc_ids,
+            specialties=state.specialties,
+            partitions=np.array(json.dumps(state.partitions))
+        )
+        current_path = os.path.join(self.snapshot_dir, self.CURRENT_FILE)
+        with open(current_path + f".{os.getpid()}.tmp", "w") as f:
+            f.write(version)
+        os.replace(current_path + f".{os.getpid()}.tmp", current_path)
+        self._remove_old_snapshots(version)
+
+    def _remove_old_snapshots(self, current: str) -> None:
+        cutoff = time.time() - self.SNAPSHOT_GRACE_SECONDS
+        for name in os.listdir(self.snapshot_dir):
+            path = os.path.join(self.snapshot_dir, name)
+            if name == current or not name.startswith("v") or not os.path.isdir(path):
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    # Pode continuar mapeada noutro processo (no Windows falha e fica)
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def load_snapshot(self) -> bool:
+        """Carrega o snapshot com memory-map; devolve False se não existir ou estiver inconsistente"""
+        if not self.snapshot_dir:
+            return False
+        try:
+            with open(os.path.join(self.snapshot_dir, self.CURRENT_FILE)) as f:
+                version_dir = os.path.join(self.snapshot_dir, f.read().strip())
+        except FileNotFoundError:
+            return False
+        try:
+            matrix = np.load(os.path.join(version_dir, self.MATRIX_FILE), mmap_mode="r")
+            with np.load(os.path.join(version_dir, self.META_FILE)) as meta:
+                partitions = {
+                    int(k): tuple(v) for k, v in json.loads(str(meta["partitions"])).items()
+                }
+                state = _IndexState(matrix, meta["doc_ids"], meta["specialties"], partitions)
+            if not len(state.matrix) == len(state.doc_ids) == len(state.specialties):
+                raise ValueError(f"{len(state.matrix)} vetores para {len(state.doc_ids)} ids")
+        except Exception as e:
+            logging.error(f"Vector index snapshot could not be loaded: {str(e)}")
+            return False
+        with self._write_lock:
+            self._state = state
+        return True
+
+
+# Testes (executar com pytest -v)
+def _rows():
+    vectors = np.eye(3, dtype=np.float32)
+    return [
+        (1, 2, vectors[0].tobytes()),
+        (2, 1, vectors[1].tobytes()),
+        (3, 1, (vectors[0] * 0.5).tobytes()),
+    ]
+
+
+def test_index_search_partitions_and_boost():
+    index = LocalVectorIndex()
+    index.build(_rows())
+    query = np.array([1, 0.1, 0], dtype=np.float32)
+    assert [doc for doc, _ in index.search(query, k=2)] == [1, 3]
+    assert [doc for doc, _ in index.search(query, k=5, specialty_id=1)] == [3, 2]
+    boosted = index.search(query, k=1, boost_specialty=1, boost=0.6)
+    assert boosted[0][0] == 3 and abs(boosted[0][1] - 0.5) < 1e-6
+    assert index.specialty_of(3) == 1 and index.specialty_of(9) is None
+
+
+def test_index_snapshot_and_incremental_add(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    index.build(_rows()[:2])
+    index.save_snapshot()
+    restored = LocalVectorIndex(str(tmp_path))
+    assert restored.load_snapshot() and len(restored) == 2
+    assert restored.add(_rows()[2:]) == 1
+    assert restored.last_document_id == 3 and restored.document_ids() == {1, 2, 3}
+
+    # Nova versão: CURRENT aponta para ela; um ponteiro para uma versão
+    # incompleta é rejeitado em vez de carregar matriz e ids desencontrados
+    restored.save_snapshot()
+    reloaded = LocalVectorIndex(str(tmp_path))
+    assert reloaded.load_snapshot() and len(reloaded) == 3
+    broken = tmp_path / "v0-broken"
+    broken.mkdir()
+    np.save(broken / LocalVectorIndex.MATRIX_FILE, np.zeros((5, 3), dtype=np.float32))
+    np.savez(broken / LocalVectorIndex.META_FILE, doc_ids=np.arange(2), specialties=np.arange(2), partitions=np.array("{}"))
+    (tmp_path / LocalVectorIndex.CURRENT_FILE).write_text("v0-broken")
+    assert not LocalVectorIndex(str(tmp_path)).load_snapshot()
+    sums = restored.specialty_sums()
+    assert sums[1][1] == 2 and np.allclose(sums[1][0], [0.5, 1, 0])
@@ -1,6 +1,6 @@
 import { useState, useEffect, useRef } from "react";
 import "./ChatbotTree.css";
-import { performTriage } from "./api";
+import { performTriageStream } from "./api";
 
 // Definindo os tipos de dados
 interface Message {
@@ -99,25 +99,41 @@ function ChatbotTree() {
       try {
         simulateTyping("Analisando seus sintomas...", async () => {
           try {
-            const data: TriageData = await performTriage(input);
-            setTriageData(data);
-
-            let botResponse = `- Categoria Detetada: ${data.diagnosis.category}\n`;
-            botResponse += `- Classificação de Urgência: ${data.diagnosis.urgency}\n\n`;
-
-            if (data.diagnosis.alerts.length > 0) {
-              botResponse += "⚠️ Alertas:\n";
-              data.diagnosis.alerts.forEach((alert: string) => {
-                botResponse += `• ${alert}\n`;
+            setIsBotWriting(true);
+
+            // A explicação chega por partes: acrescenta-as à última mensagem
+            const appendToLastMessage = (text: string) => {
+              setMessages((prev) => {
+                const updated = [...prev];
+                const last = updated[updated.length - 1];
+                updated[updated.length - 1] = { ...last, bot: last.bot + text };
+                return updated;
               });
-              botResponse += "\n";
+            };
+
+            const data = await performTriageStream(input, {
+              onDiagnosis: (diagnosis) => {
+                let botResponse = `- Categoria Detetada: ${diagnosis.category}\n`;
+                botResponse += `- Classificação de Urgência: ${diagnosis.urgency}\n\n`;
+
+                if (diagnosis.alerts.length > 0) {
+                  botResponse += "⚠️ Alertas:\n";
+                  diagnosis.alerts.forEach((alert: string) => {
+                    botResponse += `• ${alert}\n`;
+                  });
+                  botResponse += "\n";
+                }
+
+                botResponse += "💡 Explicação:\n";
+                setMessages((prev) => [...prev, { user: "", bot: botResponse }]);
+              },
+              onToken: appendToLastMessage,
+            });
+
+            if (data.diagnosis && data.medical_info) {
+              setTriageData(data as TriageData);
             }
-
-            "botResponse += `📌 Recomendação: ${data.medical_info.recommendation}\n\n`;"
-            botResponse += `💡 Explicação:\n${data.ai_explanation}`;
-
-            setMessages((prev) => [...prev, { user: "", bot: "" }]);
-            simulateTyping(botResponse);
+            setIsBotWriting(false);
           } catch (error: unknown) {
             const errorMessage =
               error instanceof Error
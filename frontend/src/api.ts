@@ -11,4 +11,97 @@ export const performTriage = async (symptoms: string, history = "Não informado"
   }
 
   return await response.json();
-};
\ No newline at end of file
+};
+export interface TriageDiagnosis {
+  category: string;
+  urgency: string;
+  alerts: string[];
+}
+
+export interface TriageMedicalInfo {
+  relevant_info: Array<{ title?: string; text: string; similarity?: number }>;
+  sources: string[];
+  recommendation: string;
+}
+
+export interface TriageStreamResult {
+  diagnosis: TriageDiagnosis | null;
+  medical_info: TriageMedicalInfo | null;
+  ai_explanation: string;
+  status: string;
+}
+
+export interface TriageStreamHandlers {
+  onDiagnosis?: (diagnosis: TriageDiagnosis) => void;
+  onSources?: (medicalInfo: TriageMedicalInfo) => void;
+  onToken?: (text: string) => void;
+}
+
+// Consome /api/triage/stream (Server-Sent Events sobre POST) e devolve a
+// resposta completa no mesmo formato de performTriage
+export const performTriageStream = async (
+  symptoms: string,
+  handlers: TriageStreamHandlers = {},
+  history = "Não informado",
+  age = 0
+): Promise<TriageStreamResult> => {
+  const response = await fetch("http://localhost:8000/api/triage/stream", {
+    method: "POST",
+    headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+    body: JSON.stringify({ symptoms, history, age }),
+  });
+
+  if (!response.ok || !response.body) {
+    const error = await response.json().catch(() => ({}));
+    throw new Error(error.detail || "Erro na triagem");
+  }
+
+  const result: TriageStreamResult = { diagnosis: null, medical_info: null, ai_explanation: "", status: "" };
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = "";
+
+  const handleEvent = (raw: string) => {
+    let event = "message";
+    let data = "";
+    for (const line of raw.split("\n")) {
+      if (line.startsWith("event:")) event = line.slice(6).trim();
+      else if (line.startsWith("data:")) data += line.slice(5).trim();
+    }
+    if (!data) return;
+    const payload = JSON.parse(data);
+
+    switch (event) {
+      case "diagnosis":
+        result.diagnosis = payload;
+        handlers.onDiagnosis?.(payload);
+        break;
+      case "sources":
+        result.medical_info = payload;
+        handlers.onSources?.(payload);
+        break;
+      case "token":
+        result.ai_explanation += payload.text;
+        handlers.onToken?.(payload.text);
+        break;
+      case "done":
+        result.status = payload.status;
+        break;
+      case "error":
+        throw new Error(payload.detail || "Erro na triagem");
+    }
+  };
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += value;
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      handleEvent(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf("\n\n");
+    }
+  }
+
+  return result;
+};